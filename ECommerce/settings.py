@@ -62,9 +62,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost so it also counts the queries made by the other middleware
+    'myapp.sqlbudget.SQLBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     # WhiteNoise must sit directly after SecurityMiddleware to work correctly
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this for serving static files
+    # Before anything that reads the database (see myapp/db_routers.py)
+    'myapp.db_routers.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +78,12 @@ MIDDLEWARE = [
     'allauth.account.middleware.AccountMiddleware', 
 ]
 
+# Per-request SQL budget (see myapp/sqlbudget.py). Budgets are declared per
+# view with @query_budget; the X-DB-* headers are only sent when enabled.
+SQL_BUDGET_DEFAULT = int(os.getenv('SQL_BUDGET_DEFAULT', '20'))
+SQL_BUDGET_REPEAT_THRESHOLD = int(os.getenv('SQL_BUDGET_REPEAT_THRESHOLD', '5'))
+SQL_BUDGET_HEADERS = os.getenv('SQL_BUDGET_HEADERS', str(DEBUG)).lower() in ('1', 'true', 'yes')
+
 # --- 3. AUTHENTICATION SETUP ---
 SITE_ID = 1
 AUTHENTICATION_BACKENDS = [
@@ -132,7 +142,8 @@ if os.environ.get('DATABASE_URL'):
     DATABASES = {
         'default': dj_database_url.config(
             default=os.environ.get('DATABASE_URL'),
-            conn_max_age=600
+            conn_max_age=600,
+            conn_health_checks=True,
         )
     }
 else:
@@ -140,7 +151,11 @@ else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
-            'NAME': BASE_DIR / 'db.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            # Take the write lock when a transaction starts, so concurrent
+            # read-then-write transactions (checkout, stock holds) queue for
+            # up to `timeout` seconds instead of failing with "database is locked"
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
         }
     }
 
@@ -167,6 +182,12 @@ STORAGES = {
         # third-party static sourcemap references missing in some packages.
         'BACKEND': 'whitenoise.storage.CompressedStaticFilesStorage',
     },
+    # Rendered invoice PDFs, content-addressed (see myapp/invoices.py). Kept
+    # outside MEDIA_ROOT: they are only served through the ownership-checked views.
+    'invoices': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': os.getenv('INVOICE_STORAGE_ROOT', str(BASE_DIR / 'private' / 'invoices'))},
+    },
 }
 WHITENOISE_MANIFEST_STRICT = False
 
@@ -293,6 +314,91 @@ RAZORPAY_WEBHOOK_ID = os.getenv('RAZORPAY_WEBHOOK_ID', '')
 # --- 13. INVOICE SETTINGS ---
 CONSOLIDATED_INVOICE = os.getenv('CONSOLIDATED_INVOICE', 'True').lower() in ('1', 'true', 'yes')
 
+# --- 14. INVENTORY ---
+# Seconds a cart line keeps its units reserved (see myapp/inventory.py)
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', '900'))
+
+# --- 15. CART ---
+# Where guest carts live until login (see myapp/carts.py): 'session' or 'cache'
+CART_GUEST_BACKEND = os.getenv('CART_GUEST_BACKEND', 'session')
+# Seconds an idle guest cart survives in the cache backend
+CART_CACHE_TIMEOUT = int(os.getenv('CART_CACHE_TIMEOUT', str(60 * 60 * 24 * 14)))
+# Guest carts change on every click, so they skip the per-process tier
+CART_CACHE_ALIAS = 'shared'
+
+# --- 16. CACHES ---
+# 'default' keeps a bounded LRU in each worker in front of 'shared', which all
+# workers see (myapp/cache_backends.py). 'shared' is Redis when REDIS_URL is set
+# (needs the redis package) and files under CACHE_DIR otherwise; the tests use
+# an in-memory stand-in (ECommerce/settings_test.py).
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    SHARED_CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}
+else:
+    SHARED_CACHE = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / 'private' / 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    }
+CACHES = {
+    'default': {
+        'BACKEND': 'myapp.cache_backends.TwoTierCache',
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'LOCAL_MAX_ENTRIES': int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', '2048')),
+            # Seconds a worker trusts its own copy of an entry / of a version counter
+            'LOCAL_TIMEOUT': int(os.getenv('CACHE_LOCAL_TIMEOUT', '60')),
+            'VERSION_LOCAL_TIMEOUT': 1,
+        },
+    },
+    'shared': SHARED_CACHE,
+}
+
+# --- 17. SESSIONS ---
+# With Redis, sessions are read and written in the shared cache and copied to
+# the database at most once per SESSION_FLUSH_INTERVAL seconds each
+# (myapp/sessions.py). That needs atomic cache add()/incr(), which the file
+# cache lacks, so without Redis every save also writes the database (cached_db).
+SESSION_ENGINE = 'myapp.sessions' if REDIS_URL else 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'shared'
+SESSION_FLUSH_INTERVAL = int(os.getenv('SESSION_FLUSH_INTERVAL', '30'))
+
+# --- 18. READ REPLICAS ---
+# Read-only ORM queries go to a replica; after a write the visitor reads from
+# the primary for REPLICA_PIN_SECONDS (myapp/db_routers.py). Replicas come from
+# DATABASE_REPLICA_URLS (comma separated). Locally, SQLITE_REPLICA=1 adds a
+# SQLite copy that `manage.py simulate_replica_lag` keeps a few seconds behind.
+# The tests get a separate replica database (ECommerce/settings_test.py).
+DATABASE_ROUTERS = ['myapp.db_routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+for n, url in enumerate(filter(None, map(str.strip, os.getenv('DATABASE_REPLICA_URLS', '').split(','))), 1):
+    DATABASES[f'replica_{n}'] = dj_database_url.parse(url, conn_max_age=600, conn_health_checks=True)
+if not os.environ.get('DATABASE_URL') and os.getenv('SQLITE_REPLICA', '').lower() in ('1', 'true', 'yes'):
+    DATABASES['replica'] = {**DATABASES['default'], 'NAME': BASE_DIR / 'db.replica.sqlite3'}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+# --- 19. CONNECTION POOLING ---
+# On PostgreSQL each process keeps a psycopg pool (needs psycopg[pool]) per
+# alias, sized to the gunicorn threads (gunicorn.conf.py) that share it.
+# CONN_HEALTH_CHECKS makes the pool check a connection before lending it out.
+# DB_POOL=0 falls back to persistent per-thread connections (CONN_MAX_AGE).
+DB_POOL = os.getenv('DB_POOL', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', os.getenv('GUNICORN_THREADS', '4')))
+if DB_POOL:
+    for db in DATABASES.values():
+        if db['ENGINE'] == 'django.db.backends.postgresql':
+            db['CONN_MAX_AGE'] = 0  # the pool keeps the connections; Django must not
+            db.setdefault('OPTIONS', {})['pool'] = {
+                'min_size': min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE),
+                'max_size': DB_POOL_MAX_SIZE,
+                # Seconds a thread waits for a free connection before the request fails
+                'timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+                # Drop idle extras, and replace every connection now and then
+                'max_idle': 300,
+                'max_lifetime': 1800,
+            }
+
 # Helpful reminder for production deployments
 SECURITY_REMINDERS = {
     'set_debug_false': 'Set DJANGO_DEBUG=False in production',
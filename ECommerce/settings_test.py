@@ -0,0 +1,26 @@
+"""Settings for the test suite: ``manage.py test`` picks them up by default.
+
+Other runners (pytest-django, ``python -m django test``, IDEs) must set
+``DJANGO_SETTINGS_MODULE=ECommerce.settings_test``.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES, DATABASES
+
+# An in-memory stand-in for the shared cache, so tests never touch CACHE_DIR or Redis
+CACHES = {
+    **CACHES,
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+}
+
+# locmem's add()/incr() are atomic, so the tests run the write-behind session engine
+SESSION_ENGINE = 'myapp.sessions'
+
+# No real replicas. 'replica' is a separate test database rather than a mirror,
+# so tests can simulate lag by opting in with override_settings(DATABASE_REPLICAS=['replica'])
+DATABASES = {
+    'default': DATABASES['default'],
+    'replica': {**DATABASES['default'], 'TEST': {
+        'NAME': None if DATABASES['default']['ENGINE'].endswith('sqlite3')
+        else f"test_{DATABASES['default']['NAME']}_replica"}},
+}
+DATABASE_REPLICAS = []
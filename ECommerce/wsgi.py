@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ECommerce.settings')
 
 application = get_wsgi_application()
+
+# Build the in-memory autocomplete index while the worker boots instead of
+# on the first keystroke.
+from myapp.autocomplete import warm_index  # noqa: E402
+
+warm_index()
@@ -0,0 +1,62 @@
+"""Gunicorn settings for the web service (Procfile, render.yaml, bench_gunicorn).
+
+Threaded workers, since a request mostly waits on the database or the cache
+and threads in one process share a connection pool. Each setting can be
+overridden from the environment or on the command line.
+
+* ``WEB_CONCURRENCY`` worker processes, by default one per CPU this process
+  may run on, plus one.
+* ``GUNICORN_THREADS`` threads per worker (default 4). The database pool of
+  each worker is sized from this (``DB_POOL_MAX_SIZE`` in settings).
+* The app is preloaded in the master, so workers fork with the code already
+  imported. Connections and pools must not be shared across the fork, so
+  :func:`pre_fork` closes any the master opened.
+* Workers are recycled after ``GUNICORN_MAX_REQUESTS`` requests, plus a random
+  jitter so they don't all restart at once. This bounds slow memory growth.
+"""
+import os
+
+
+def _cpus():
+    try:
+        return len(os.sched_getaffinity(0))  # respects container CPU limits
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', _cpus() + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', str(max_requests // 10)))
+
+# Render's proxy gives up after 30s; drop a stuck request before it does
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '25'))
+# Longer than the proxy's idle timeout, so the proxy closes idle connections first
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '75'))
+# Heartbeat files in memory, not on a disk that can stall
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '*')
+
+# Read by the settings to size each worker's database pool
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+
+
+def pre_fork(server, worker):
+    # Runs in the master; a worker then opens its own connections on first use
+    from django.core.cache import caches
+    from django.db import connections
+
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+        # close_pool() would first create a pool that was never opened
+        if connection.alias in getattr(connection, '_connection_pools', {}):
+            connection.close_pool()
+    caches.close_all()
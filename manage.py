@@ -6,6 +6,8 @@ import sys
 
 def main():
     """Run administrative tasks."""
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ECommerce.settings_test')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ECommerce.settings')
     try:
         from django.core.management import execute_from_command_line
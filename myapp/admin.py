@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
-from .models import CartOrder, Product, ContactMessage, Profile
+from django.utils import timezone
+from .models import CartOrder, Product, ContactMessage, Profile, Job
 
 # --- 1. USER & PROFILE MANAGEMENT (The "Amazon" Style) ---
 class ProfileInline(admin.StackedInline):
@@ -13,10 +14,12 @@ class CustomUserAdmin(UserAdmin):
     inlines = (ProfileInline, )
     list_display = ('username', 'email', 'get_user_type', 'is_staff', 'is_superuser')
     list_filter = ('is_staff', 'profile__user_type')
+    list_select_related = ('profile',)
 
     def get_user_type(self, obj):
         return obj.profile.user_type
     get_user_type.short_description = 'Account Type'
+    get_user_type.admin_order_field = 'profile__user_type'
 
 # Re-register User with our custom Profile view
 admin.site.unregister(User)
@@ -71,4 +74,16 @@ class CartOrderAdmin(admin.ModelAdmin):
 class ContactMessageAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'subject', 'timestamp')
     search_fields = ('name', 'email', 'subject')
-    readonly_fields = ('timestamp',)
\ No newline at end of file
+    readonly_fields = ('timestamp',)
+
+# --- 5. BACKGROUND JOBS ---
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'queue', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by')
+    list_filter = ('status', 'queue', 'task')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_until', 'last_error')
+    actions = ['requeue']
+
+    @admin.action(description='Re-queue selected jobs now')
+    def requeue(self, request, queryset):
+        queryset.exclude(status='running').update(status='queued', attempts=0, run_at=timezone.now(), finished_at=None)
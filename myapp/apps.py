@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class MyappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myapp'
+
+    def ready(self):
+        # Register the search-index, autocomplete, rating rollup, sales rollup and cache-version signal handlers,
+        # and the background tasks the job worker can run
+        from . import autocomplete, ratings, sales, search, tasks, versioning  # noqa: F401
@@ -0,0 +1,225 @@
+"""In-memory prefix index that powers the header search autocomplete.
+
+Every distinct product title and brand is kept once, lower-cased, in a
+sorted list so a prefix lookup is two ``bisect`` calls. Each entry carries
+the number of products behind it. Keys shared by several products (brands,
+mostly) are also kept in a second, much smaller sorted list; completions
+list those first, most products first, then fill up with single-product
+titles in alphabetical order. That keeps every lookup at O(limit log n)
+however short the prefix. Results are memoised in a small LRU until one
+of the keys under that prefix changes.
+
+The index is built once per worker (see ``ECommerce/wsgi.py``) and then
+patched in place by the ``Product`` signals below. Saves made by *other*
+workers are only visible here after the periodic background refresh
+(``AUTOCOMPLETE_MAX_AGE`` seconds).
+"""
+import bisect
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+MEMO_SIZE = 4096
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def _remove_sorted(keys, key):
+    position = bisect.bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._keys = []          # sorted, distinct normalized strings
+        self._popular = []       # sorted subset of _keys with product count > 1
+        self._entries = {}       # key -> [display text, kind, product count]
+        self._products = {}      # product id -> (title key, brand key)
+        self._memo = OrderedDict()
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    # --- building ---
+    def build(self, rows):
+        """Load ``(id, title, brand)`` rows in one pass and sort once."""
+        entries, products = {}, {}
+        for product_id, title, brand in rows:
+            keys = []
+            for text, kind in ((title, 'title'), (brand, 'brand')):
+                key = normalize(text)
+                if not key:
+                    keys.append(None)
+                    continue
+                entry = entries.get(key)
+                if entry is None:
+                    entries[key] = [text.strip(), kind, 1]
+                else:
+                    entry[2] += 1
+                keys.append(key)
+            products[product_id] = tuple(keys)
+        with self._lock:
+            self._entries = entries
+            self._products = products
+            self._keys = sorted(entries)
+            self._popular = [key for key in self._keys if entries[key][2] > 1]
+            self._memo.clear()
+            self.built_at = time.monotonic()
+
+    # --- incremental updates ---
+    def _add(self, text, kind):
+        key = normalize(text)
+        if not key:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [text.strip(), kind, 1]
+            bisect.insort(self._keys, key)
+        else:
+            entry[2] += 1
+            if entry[2] == 2:
+                bisect.insort(self._popular, key)
+        self._forget(key)
+        return key
+
+    def _remove(self, key):
+        if not key or key not in self._entries:
+            return
+        entry = self._entries[key]
+        entry[2] -= 1
+        if entry[2] == 1:
+            _remove_sorted(self._popular, key)
+        elif entry[2] <= 0:
+            del self._entries[key]
+            _remove_sorted(self._keys, key)
+        self._forget(key)
+
+    def _forget(self, key):
+        """Drop memoised results for every prefix of ``key``."""
+        for end in range(1, len(key) + 1):
+            self._memo.pop(key[:end], None)
+
+    def upsert(self, product_id, title, brand):
+        with self._lock:
+            new_keys = (normalize(title) or None, normalize(brand) or None)
+            old_keys = self._products.get(product_id)
+            if old_keys == new_keys:
+                return
+            if old_keys:
+                for key in old_keys:
+                    self._remove(key)
+            self._products[product_id] = (self._add(title, 'title'), self._add(brand, 'brand'))
+
+    def discard(self, product_id):
+        with self._lock:
+            for key in self._products.pop(product_id, ()):
+                self._remove(key)
+
+    # --- lookups ---
+    def complete(self, prefix, limit=DEFAULT_LIMIT):
+        """Return up to ``limit`` ``{'text', 'kind'}`` completions for ``prefix``."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            cached = self._memo.get(prefix)
+            if cached is not None:
+                self._memo.move_to_end(prefix)
+                return cached[:limit]
+            entries = self._entries
+            end = prefix + '\uffff'
+            lo = bisect.bisect_left(self._popular, prefix)
+            hi = bisect.bisect_left(self._popular, end, lo)
+            best = heapq.nsmallest(MAX_LIMIT, self._popular[lo:hi], key=lambda key: (-entries[key][2], key))
+            if len(best) < MAX_LIMIT:
+                taken = set(best)
+                position = bisect.bisect_left(self._keys, prefix)
+                stop = bisect.bisect_left(self._keys, end, position)
+                while position < stop and len(best) < MAX_LIMIT:
+                    key = self._keys[position]
+                    if key not in taken:
+                        best.append(key)
+                    position += 1
+            results = [{'text': entries[key][0], 'kind': entries[key][1]} for key in best]
+            self._memo[prefix] = results
+            if len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return results[:limit]
+
+
+_index = PrefixIndex()
+_refreshing = threading.Lock()
+
+
+def _load_rows():
+    return Product.objects.values_list('id', 'title', 'brand').iterator(chunk_size=10000)
+
+
+def warm_index():
+    """Build the index now; called from the WSGI module at worker boot."""
+    try:
+        _index.build(_load_rows())
+    except DatabaseError:
+        # Fresh deploy before migrate: the first lookup retries the build.
+        _index.built_at = None
+
+
+def _refresh_in_background():
+    if not _refreshing.acquire(blocking=False):
+        return
+
+    def run():
+        global _index
+        try:
+            fresh = PrefixIndex()
+            fresh.build(_load_rows())
+            _index = fresh
+        except DatabaseError:
+            pass
+        finally:
+            connection.close()
+            _refreshing.release()
+
+    threading.Thread(target=run, name='autocomplete-refresh', daemon=True).start()
+
+
+def get_index():
+    if _index.built_at is None:
+        warm_index()
+    else:
+        max_age = getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 300)
+        if max_age and time.monotonic() - _index.built_at > max_age:
+            _refresh_in_background()
+    return _index
+
+
+def complete(prefix, limit=DEFAULT_LIMIT):
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    return get_index().complete(prefix, limit)
+
+
+@receiver(post_save, sender=Product)
+def update_autocomplete(sender, instance, **kwargs):
+    if _index.built_at is not None:
+        _index.upsert(instance.pk, instance.title, instance.brand)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_autocomplete(sender, instance, **kwargs):
+    if _index.built_at is not None:
+        _index.discard(instance.pk)
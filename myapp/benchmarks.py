@@ -0,0 +1,63 @@
+"""Shared helpers for the ``bench_*`` management commands."""
+import contextlib
+import json
+import math
+import statistics
+import time
+
+from django.db import connection
+
+
+@contextlib.contextmanager
+def isolated_database(verbosity=0, test_name=None):
+    """Run the block against a throwaway, fully migrated copy of the default database.
+
+    Uses the same machinery as ``manage.py test`` so benchmarks never touch
+    real data. On SQLite the copy lives in memory unless ``test_name`` gives
+    it a file, which multi-threaded benchmarks need so every thread sees the
+    same database without shared-cache table locks.
+    """
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    old_test_name = test_settings.get('NAME')
+    if test_name:
+        test_settings['NAME'] = test_name
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        test_settings['NAME'] = old_test_name
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of ``samples`` (``pct`` in 0-100)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples_ms):
+    """Latency summary (milliseconds) for a list of samples."""
+    return {
+        'count': len(samples_ms),
+        'mean_ms': round(statistics.fmean(samples_ms), 3) if samples_ms else 0.0,
+        'p50_ms': round(percentile(samples_ms, 50), 3),
+        'p95_ms': round(percentile(samples_ms, 95), 3),
+        'p99_ms': round(percentile(samples_ms, 99), 3),
+        'max_ms': round(max(samples_ms), 3) if samples_ms else 0.0,
+    }
+
+
+def time_call(fn, *args, **kwargs):
+    """Call ``fn`` and return ``(result, elapsed_ms)``."""
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - started) * 1000.0
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2, default=str)
@@ -0,0 +1,211 @@
+"""Two-tier cache: a bounded LRU in each process in front of a shared cache.
+
+``TwoTierCache`` is a Django cache backend. Reads try the process-local tier
+first and fall back to the shared tier, which is another configured cache
+alias (``OPTIONS['SHARED']``: Redis or files in production, locmem in tests).
+Writes go to both tiers. Local entries live at most ``LOCAL_TIMEOUT``
+seconds, and ``LOCAL_MAX_ENTRIES`` bounds the tier, evicting the least
+recently used entry.
+
+Another worker cannot evict a local copy, so this suits keys whose value
+never changes under the same name. That is what :mod:`myapp.versioning`
+produces: fragments and snapshots are filed under a namespace version, and
+a change bumps the version rather than deleting keys. The version counters
+themselves (``version:*``) are mutable, so their local copies live only
+``VERSION_LOCAL_TIMEOUT`` seconds. Other mutable per-user data (carts,
+sessions) should use the shared alias directly.
+
+Each process counts local hits, shared hits, misses, sets and evictions;
+:func:`cache_stats` reports them, served at ``/cache-stats/`` to staff.
+"""
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_LOCAL_TIMEOUT = 60
+DEFAULT_VERSION_LOCAL_TIMEOUT = 1
+
+_MISSING = object()
+
+# Local tiers are per process, shared by every thread's backend instance
+# (django.core.cache.caches hands each thread its own), like LocMemCache.
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class LocalTier:
+    """Thread-safe LRU of pickled values with per-entry expiry."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.counts = Counter()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, pickled = entry
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.counts['local_hits'] += 1
+                    return pickle.loads(pickled)
+                del self._data[key]
+        return _MISSING
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            self.discard(key)
+            return
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, pickled)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = options.get('SHARED', 'shared')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', DEFAULT_LOCAL_TIMEOUT)
+        self.version_local_timeout = options.get('VERSION_LOCAL_TIMEOUT', DEFAULT_VERSION_LOCAL_TIMEOUT)
+        self.version_prefix = options.get('VERSION_KEY_PREFIX', 'version:')
+        name = location or self._shared_alias
+        with _tiers_lock:
+            if name not in _tiers:
+                _tiers[name] = LocalTier(options.get('LOCAL_MAX_ENTRIES', DEFAULT_MAX_ENTRIES))
+            self.local = _tiers[name]
+
+    @cached_property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_ttl(self, key, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        ceiling = self.version_local_timeout if key.startswith(self.version_prefix) else self.local_timeout
+        return ceiling if timeout is None else min(timeout, ceiling)
+
+    def _fill(self, key, version, value, timeout=DEFAULT_TIMEOUT):
+        self.local.set(self.make_and_validate_key(key, version), value, self._local_ttl(key, timeout))
+
+    def get(self, key, default=None, version=None):
+        value = self.local.get(self.make_and_validate_key(key, version))
+        if value is not _MISSING:
+            return value
+        value = self.shared.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self.local.count('misses')
+            return default
+        self.local.count('shared_hits')
+        self._fill(key, version, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found, wanted = {}, []
+        for key in keys:
+            value = self.local.get(self.make_and_validate_key(key, version))
+            if value is _MISSING:
+                wanted.append(key)
+            else:
+                found[key] = value
+        if wanted:
+            fetched = self.shared.get_many(wanted, version=version)
+            self.local.count('shared_hits', len(fetched))
+            self.local.count('misses', len(wanted) - len(fetched))
+            for key, value in fetched.items():
+                self._fill(key, version, value)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self.local.count('sets')
+        self._fill(key, version, value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        self.local.count('sets', len(data))
+        for key, value in data.items():
+            if key not in failed:
+                self._fill(key, version, value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        if added:
+            self.local.count('sets')
+            self._fill(key, version, value, timeout)
+        else:
+            self.local.discard(self.make_and_validate_key(key, version))
+        return added
+
+    def incr(self, key, delta=1, version=None):
+        self.local.discard(self.make_and_validate_key(key, version))
+        return self.shared.incr(key, delta, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.local.discard(self.make_and_validate_key(key, version))
+        return self.shared.touch(key, timeout, version=version)
+
+    def has_key(self, key, version=None):
+        if self.local.get(self.make_and_validate_key(key, version)) is not _MISSING:
+            return True
+        return self.shared.has_key(key, version=version)
+
+    def delete(self, key, version=None):
+        self.local.discard(self.make_and_validate_key(key, version))
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self.local.discard(self.make_and_validate_key(key, version))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        counts = dict(self.local.counts)
+        lookups = counts.get('local_hits', 0) + counts.get('shared_hits', 0) + counts.get('misses', 0)
+        hits = lookups - counts.get('misses', 0)
+        return {
+            **{name: counts.get(name, 0) for name in ('local_hits', 'shared_hits', 'misses', 'sets', 'evictions')},
+            'local_entries': len(self.local),
+            'local_max_entries': self.local.max_entries,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+        }
+
+
+def cache_stats():
+    """``{alias: counters}`` for every two-tier cache, as seen by this process."""
+    return {alias: caches[alias].stats() for alias, config in settings.CACHES.items()
+            if config['BACKEND'] == f'{__name__}.TwoTierCache'}
@@ -0,0 +1,409 @@
+"""One cart API over every place a cart can live.
+
+Views talk to :class:`CartService`, which picks a backend for the request:
+
+* :class:`DatabaseCart` for signed-in shoppers: ``Cart``/``CartItem`` rows,
+  priced by :mod:`myapp.pricing`, with stock held through :mod:`myapp.inventory`;
+* :class:`SessionCart` for guests: ``{product_id: quantity}`` in the session;
+* :class:`CacheCart` for guests when ``CART_GUEST_BACKEND = 'cache'``: the same
+  dict in the cache, under a token kept in the session, so the session row
+  stays small.
+
+Every backend returns :class:`CartLine` objects and a
+:class:`~myapp.pricing.CartPricing`, so templates do not care which one is in
+use. On login :func:`merge_guest_cart` folds the guest cart into the
+database cart with a single upsert, however many lines it has, and costs
+nothing when the visitor has no guest cart.
+"""
+import secrets
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from . import inventory
+from .models import Cart, CartItem, Coupon, Product
+from .pricing import CartPricing, price_cart
+
+SESSION_CART_KEY = 'guest_cart'
+CACHE_TOKEN_KEY = 'guest_cart_token'
+DEFAULT_CACHE_TIMEOUT = 60 * 60 * 24 * 14
+# Rows per INSERT of the login merge (4 parameters each)
+MERGE_BATCH_SIZE = 500
+
+
+class CouponUnavailable(Exception):
+    """The cart's coupon ran out of uses between the checkout page and the order."""
+
+    def __init__(self, coupon):
+        super().__init__(f"Coupon {coupon.code} has no uses left")
+        self.coupon = coupon
+
+
+def _quantity(raw):
+    try:
+        return max(0, int(raw))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _parse(data):
+    """``{product_id: quantity}`` from stored ``{'<id>': quantity}``, dropping malformed entries."""
+    quantities = {}
+    for key, raw in data.items():
+        if str(key).isdigit() and _quantity(raw):
+            quantities[int(key)] = _quantity(raw)
+    return quantities
+
+
+def _serialize(quantities):
+    return {str(product_id): quantity for product_id, quantity in quantities.items() if quantity > 0}
+
+
+class CartLine:
+    """A priced cart line. ``id`` is what the update/remove URLs take."""
+
+    def __init__(self, id, product, quantity, price, variant=None, total_price=None):
+        self.id = id
+        self.product = product
+        self.variant = variant
+        self.quantity = quantity
+        self.price = price
+        self.total_price = price * quantity if total_price is None else total_price
+
+    @property
+    def product_id(self):
+        return self.product.id
+
+    @property
+    def variant_id(self):
+        return self.variant.id if self.variant else None
+
+    @property
+    def product_name(self):
+        return self.product.title
+
+
+class GuestCart(ABC):
+    """Base for guest carts: ``{str(product_id): quantity}`` kept somewhere per visitor.
+
+    Guest lines are plain products (no variants or coupons); the line id is the
+    product id.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @abstractmethod
+    def load(self):
+        """The stored ``{str(product_id): quantity}`` dict (empty when there is none)."""
+
+    @abstractmethod
+    def save(self, data):
+        """Store ``data``, or forget the cart when it is empty."""
+
+    def quantities(self):
+        return _parse(self.load())
+
+    def _change(self, change):
+        """Apply ``change`` (edits a ``{product_id: quantity}`` dict in place) and store the result."""
+        quantities = self.quantities()
+        change(quantities)
+        self.save(_serialize(quantities))
+
+    def lines(self):
+        quantities = self.quantities()
+        if not quantities:
+            return []
+        products = Product.objects.in_bulk(quantities)
+        gone = quantities.keys() - products.keys()
+        if gone:
+            # Products deleted since they were added
+            def drop_gone(current):
+                for pk in gone:
+                    current.pop(pk, None)
+            self._change(drop_gone)
+        return [CartLine(pk, products[pk], quantity, products[pk].price)
+                for pk, quantity in quantities.items() if pk in products]
+
+    def pricing(self):
+        lines = self.lines()
+        return CartPricing(lines, sum((line.total_price for line in lines), Decimal('0')), None)
+
+    def add(self, product, quantity=1, variant=None):
+        def add(quantities):
+            quantities[product.id] = quantities.get(product.id, 0) + quantity
+        self._change(add)
+
+    def update(self, line_id, quantity):
+        if line_id not in self.quantities():
+            return None
+
+        def update(quantities):
+            if line_id in quantities:
+                quantities[line_id] = quantity
+        self._change(update)
+        return line_id
+
+    def remove(self, line_id):
+        if line_id in self.quantities():
+            self._change(lambda quantities: quantities.pop(line_id, None))
+
+    def clear(self):
+        self.save({})
+
+    def apply_coupon(self, coupon):
+        return False
+
+
+class SessionCart(GuestCart):
+    def load(self):
+        return self.request.session.get(SESSION_CART_KEY, {})
+
+    def save(self, data):
+        if data:
+            self.request.session[SESSION_CART_KEY] = data
+        else:
+            self.request.session.pop(SESSION_CART_KEY, None)
+
+    def _change(self, change):
+        session = self.request.session
+        if not hasattr(session, 'update_value'):
+            return super()._change(change)
+
+        # myapp.sessions: apply the change to the latest stored cart under the
+        # session lock, so two requests adding at once both count
+        def apply(data):
+            quantities = _parse(data or {})
+            change(quantities)
+            return _serialize(quantities) or None
+        session.update_value(SESSION_CART_KEY, apply)
+
+
+class CacheCart(GuestCart):
+    """Guest cart in the cache; the session only holds the token it is filed under.
+
+    The token, unlike the session key, survives the key rotation on login,
+    so :func:`merge_guest_cart` can still find the cart.
+    """
+
+    @property
+    def cache(self):
+        # Carts change on every click, so they skip the per-process tier of 'default'
+        return caches[getattr(settings, 'CART_CACHE_ALIAS', 'default')]
+
+    def _key(self, token):
+        return f'cart:{token}'
+
+    def load(self):
+        token = self.request.session.get(CACHE_TOKEN_KEY)
+        return self.cache.get(self._key(token), {}) if token else {}
+
+    def save(self, data):
+        token = self.request.session.get(CACHE_TOKEN_KEY)
+        if data:
+            if not token:
+                token = self.request.session[CACHE_TOKEN_KEY] = secrets.token_urlsafe(16)
+            self.cache.set(self._key(token), data,
+                           getattr(settings, 'CART_CACHE_TIMEOUT', DEFAULT_CACHE_TIMEOUT))
+        elif token:
+            self.cache.delete(self._key(token))
+            del self.request.session[CACHE_TOKEN_KEY]
+
+
+GUEST_BACKENDS = {'session': SessionCart, 'cache': CacheCart}
+
+
+def guest_cart(request):
+    return GUEST_BACKENDS[getattr(settings, 'CART_GUEST_BACKEND', 'session')](request)
+
+
+class DatabaseCart:
+    """A signed-in shopper's ``Cart``; the line id is the ``CartItem`` id."""
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def cart(self):
+        return Cart.objects.get_or_create(user=self.user)[0]
+
+    def _items(self):
+        return CartItem.objects.filter(cart__user=self.user)
+
+    def pricing(self):
+        priced = price_cart(self.cart)
+        lines = [CartLine(item.id, item.product, item.quantity, item.unit_price,
+                          variant=item.variant, total_price=item.line_total)
+                 for item in priced.items]
+        return CartPricing(lines, priced.subtotal, priced.coupon)
+
+    def lines(self):
+        return self.pricing().items
+
+    def add(self, product, quantity=1, variant=None):
+        item = CartItem.objects.filter(cart=self.cart, product=product, variant=variant).order_by('id').first()
+        if item:
+            item.quantity = max(1, item.quantity + quantity)
+            item.save(update_fields=['quantity'])
+        else:
+            item = CartItem.objects.create(cart=self.cart, product=product, variant=variant, quantity=quantity)
+        # Best effort: whatever cannot be held now is re-checked against stock at checkout
+        inventory.hold(item)
+        return item
+
+    def update(self, line_id, quantity):
+        item = self._items().filter(id=line_id).select_related('product', 'variant').first()
+        if item is None:
+            return None
+        if quantity > 0:
+            item.quantity = quantity
+            item.save(update_fields=['quantity'])
+            inventory.hold(item)
+        else:
+            inventory.release([item])
+            item.delete()
+        return item
+
+    def remove(self, line_id):
+        items = self._items().filter(id=line_id)
+        inventory.release(items)
+        items.delete()
+
+    def clear(self):
+        items = self._items()
+        inventory.release(items)
+        items.delete()
+
+    def apply_coupon(self, coupon):
+        Cart.objects.filter(pk=self.cart.pk).update(coupon=coupon)
+        return True
+
+    def checkout(self):
+        """Sell every line, use up the coupon and empty the cart.
+
+        Returns the :class:`~myapp.pricing.CartPricing` of the sold
+        ``CartItem`` rows, discount included. Call inside the checkout
+        transaction; raises :class:`~myapp.inventory.OutOfStock` or
+        :class:`CouponUnavailable` without changing anything.
+        """
+        items = list(self._items().select_related('product', 'variant', 'cart__coupon'))
+        inventory.commit(self.user, [(item.product_id, item.variant_id, item.quantity) for item in items])
+        coupon = items[0].cart.coupon if items else None
+        priced = CartPricing(items, sum((item.total_price for item in items), Decimal('0')), coupon)
+        if priced.discount:
+            # Conditional, so two checkouts cannot both take a coupon's last use
+            used = (Coupon.objects.filter(Q(max_uses__isnull=True) | Q(used_count__lt=F('max_uses')), pk=coupon.pk)
+                    .update(used_count=F('used_count') + 1))
+            if not used:
+                raise CouponUnavailable(coupon)
+        if items:
+            CartItem.objects.filter(id__in=[item.id for item in items]).delete()
+        if coupon:
+            Cart.objects.filter(pk=items[0].cart_id).update(coupon=None)
+        return priced
+
+    def merge(self, quantities):
+        """Add guest ``{product_id: quantity}`` to this cart; returns the number of lines touched.
+
+        One read of the products that still exist, then one upsert that adds
+        to the cart's plain (variant-less) lines or inserts them. Merged lines
+        are not held: stock is re-checked at checkout.
+        """
+        known = sorted(Product.objects.filter(id__in=quantities).values_list('id', flat=True))
+        rows = [(product_id, quantities[product_id]) for product_id in known]
+        if rows and connection.vendor in ('postgresql', 'sqlite'):
+            self._upsert(rows)
+        elif rows:
+            self._update_then_insert(rows)
+        return len(rows)
+
+    def _upsert(self, rows):
+        """``INSERT ... ON CONFLICT DO UPDATE`` on the ``cartitem_one_plain_line`` partial index.
+
+        PostgreSQL and SQLite (3.24+) share the syntax, including the index
+        predicate that picks the partial unique index as the conflict target.
+        """
+        qn = connection.ops.quote_name
+        table = qn(CartItem._meta.db_table)
+        added_at = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), MERGE_BATCH_SIZE):
+                batch = rows[start:start + MERGE_BATCH_SIZE]
+                values = ', '.join(['(%s, %s, NULL, %s, %s)'] * len(batch))
+                params = []
+                for product_id, quantity in batch:
+                    params += [self.cart.pk, product_id, quantity, added_at]
+                cursor.execute(
+                    f"INSERT INTO {table} ({qn('cart_id')}, {qn('product_id')}, {qn('variant_id')}, "
+                    f"{qn('quantity')}, {qn('added_at')}) VALUES {values} "
+                    f"ON CONFLICT ({qn('cart_id')}, {qn('product_id')}) WHERE {qn('variant_id')} IS NULL "
+                    f"DO UPDATE SET {qn('quantity')} = {table}.{qn('quantity')} + EXCLUDED.{qn('quantity')}",
+                    params,
+                )
+
+    def _update_then_insert(self, rows):
+        """Fallback for databases without ``ON CONFLICT``: one read, one bulk update, one bulk insert."""
+        existing = {item.product_id: item for item in
+                    CartItem.objects.filter(cart=self.cart, product_id__in=[pk for pk, _q in rows], variant=None)}
+        for product_id, quantity in rows:
+            if product_id in existing:
+                existing[product_id].quantity = F('quantity') + quantity
+        CartItem.objects.bulk_update(existing.values(), ['quantity'])
+        CartItem.objects.bulk_create([CartItem(cart=self.cart, product_id=product_id, quantity=quantity)
+                                      for product_id, quantity in rows if product_id not in existing])
+
+
+class CartService:
+    """The cart for ``request``: the database cart when signed in, the guest cart otherwise."""
+
+    def __init__(self, request):
+        self.request = request
+        if request.user.is_authenticated:
+            self.backend = DatabaseCart(request.user)
+        else:
+            self.backend = guest_cart(request)
+
+    @property
+    def is_guest(self):
+        return isinstance(self.backend, GuestCart)
+
+    def lines(self):
+        return self.backend.lines()
+
+    def pricing(self):
+        return self.backend.pricing()
+
+    def add(self, product, quantity=1, variant=None):
+        return self.backend.add(product, quantity, variant)
+
+    def update(self, line_id, quantity):
+        return self.backend.update(line_id, quantity)
+
+    def remove(self, line_id):
+        self.backend.remove(line_id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def apply_coupon(self, coupon):
+        return self.backend.apply_coupon(coupon)
+
+    def checkout(self):
+        return self.backend.checkout()
+
+
+def merge_guest_cart(request, user):
+    """Move the guest cart of ``request`` into ``user``'s database cart."""
+    guest = guest_cart(request)
+    quantities = guest.quantities()
+    if not quantities:
+        return 0
+    merged = DatabaseCart(user).merge(quantities)
+    guest.clear()
+    return merged
@@ -1,6 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import layout
 from .forms import SellerSignUpForm
 
+
 def signup_form_context(request):
+    """Shared layout context; each value is built only if the template uses it."""
     return {
-        'signup_form': SellerSignUpForm()
-    }
\ No newline at end of file
+        'signup_form': SimpleLazyObject(SellerSignUpForm),
+        'category_nav': SimpleLazyObject(layout.category_nav),
+    }
@@ -0,0 +1,140 @@
+"""Read replicas with read-your-writes stickiness.
+
+``DATABASE_ROUTERS = ['myapp.db_routers.ReplicaRouter']``. Read-only ORM
+queries go to a random alias in ``DATABASE_REPLICAS``, and everything else
+goes to ``default``, the primary. With no replicas configured the router
+stays out of the way.
+
+A replica lags behind the primary, so a visitor who just added to their
+cart or placed an order could read the state from before. Three rules keep
+them on the primary while that matters:
+
+* Any write (``router.db_for_write``: ``save``, ``update``, ``delete``,
+  ``bulk_create``, ``select_for_update``, ``get_or_create``) pins the current
+  context to the primary for ``REPLICA_PIN_SECONDS``.
+  :class:`ReplicaPinMiddleware` carries the pin over to the visitor's next
+  requests in a cookie. A cookie costs no session load, and it covers guest
+  carts too.
+* Reads inside a transaction on the primary stay there, so a
+  read-modify-write such as checkout sees its own rows.
+* Sessions, the job queue and stock holds (``PRIMARY_MODELS``) coordinate
+  between workers, so they are always read from the primary. Session writes
+  do not pin: the write-behind flush only copies what the cache already
+  serves.
+
+Writes that bypass the ORM (raw cursors) do not pin; wrap the reads that
+depend on them in :func:`scope` with a future ``pinned_until``.
+
+Locally, ``SQLITE_REPLICA=1`` adds a SQLite copy of the database as a
+replica. ``manage.py simulate_replica_lag`` keeps it current by copying the
+primary over it every ``--lag`` seconds (:func:`replicate`), so the copy is
+always up to that many seconds behind.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections
+
+DEFAULT_PIN_SECONDS = 5
+PIN_COOKIE = 'db_primary'
+PRIMARY_MODELS = {'sessions.session', 'myapp.job', 'myapp.stockreservation'}
+UNPINNED_MODELS = {'sessions.session'}
+
+# Epoch seconds until which reads in this context go to the primary
+_pinned_until = ContextVar('db_pinned_until', default=0.0)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS)
+
+
+def pin(seconds=None):
+    """Send this context's reads to the primary for the next ``seconds``."""
+    until = time.time() + (pin_seconds() if seconds is None else seconds)
+    if until > _pinned_until.get():
+        _pinned_until.set(until)
+
+
+def pinned_until():
+    return _pinned_until.get()
+
+
+def is_pinned():
+    return time.time() < _pinned_until.get()
+
+
+@contextmanager
+def scope(pinned_until=0.0):
+    """Run the block with its own pin, e.g. one per request or job; the outer pin is restored after."""
+    token = _pinned_until.set(pinned_until)
+    try:
+        yield
+    finally:
+        _pinned_until.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        pool = replicas()
+        if not pool or model._meta.label_lower in PRIMARY_MODELS:
+            return None
+        if is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(pool)
+
+    def db_for_write(self, model, **hints):
+        if not replicas():
+            return None
+        if model._meta.label_lower not in UNPINNED_MODELS:
+            pin()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data, so objects read from different ones may be related
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Restores the visitor's pin from the cookie and extends the cookie after a write.
+
+    Goes before any middleware that reads the database.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            until = 0.0
+        with scope(until):
+            response = self.get_response(request)
+            wrote_until = pinned_until()
+        if wrote_until > until:
+            response.set_cookie(PIN_COOKIE, f'{wrote_until:.0f}', max_age=pin_seconds() + 1,
+                                secure=request.is_secure(), httponly=True, samesite='Lax')
+        return response
+
+
+def replicate(source=DEFAULT_DB_ALIAS, target='replica'):
+    """Copy the whole ``source`` database over ``target``; the lag simulation's replication step.
+
+    SQLite only: uses the online backup API, so writers on ``source`` are not blocked.
+    """
+    source_connection, target_connection = connections[source], connections[target]
+    if source_connection.vendor != 'sqlite' or target_connection.vendor != 'sqlite':
+        raise NotSupportedError("Simulated replication copies SQLite databases only.")
+    source_connection.ensure_connection()
+    target_connection.ensure_connection()
+    source_connection.connection.backup(target_connection.connection)
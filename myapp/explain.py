@@ -0,0 +1,215 @@
+"""Index advice from the query plans of the statements the views actually run.
+
+:class:`StatementLog` is an ``execute_wrapper`` that keeps one example of
+every distinct statement (by :func:`~myapp.sqlbudget.query_shape`), counts
+how often it ran and remembers which routes ran it. :func:`advise` then asks
+the database for each statement's plan:
+
+* PostgreSQL: ``EXPLAIN (FORMAT JSON)``. The cost is the planner's total cost.
+  Findings are sequential scans, sorts, and for a filtered sequential scan the
+  columns of the filter, which are the candidate index.
+* SQLite: ``EXPLAIN QUERY PLAN``. SQLite reports no costs, so they are
+  estimated from the plan's nested loops: a full scan reads the whole table
+  and a seek costs log2 of it, once per row of the loops around it. A seek
+  returns as many rows as ``sqlite_stat1`` (from ``ANALYZE``) says its index
+  keys match. A temporary B-tree (sort, GROUP BY, DISTINCT) costs
+  n·log2(n) of the rows it receives. An ``AUTOMATIC INDEX`` means SQLite
+  built a throwaway index for this one statement, so an index on those
+  columns is missing.
+
+Statements with findings are ranked by cost × calls. Scans of tables with
+fewer than ``min_rows`` rows are ignored, since an index does not pay off
+there.
+"""
+import json
+import math
+import re
+from contextlib import contextmanager
+
+from django.db import connection as default_connection
+
+from .sqlbudget import query_shape
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+DEFAULT_MIN_ROWS = 100
+
+_SQLITE_NODE_RE = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\S+)')
+_SQLITE_INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\S+)|USING INTEGER PRIMARY KEY')
+_SQLITE_AUTOMATIC_RE = re.compile(r'AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \(([^)]*)\)')
+_FILTER_COLUMN_RE = re.compile(r'\(?"?(\w+)"?\)?(?:::\w+)? (?:=|<>|<=|>=|<|>|~~|IS|= ANY)')
+
+
+class Statement:
+    def __init__(self, shape, sql, params):
+        self.shape = shape
+        self.sql = sql
+        self.params = params
+        self.calls = 0
+        self.routes = set()
+
+
+class StatementLog:
+    """Keep one example of each distinct explainable statement, with call counts per route."""
+
+    def __init__(self):
+        self.statements = {}
+        self.route = None
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if not many and sql.lstrip().split(None, 1)[0].upper() in EXPLAINABLE:
+            shape = query_shape(sql)
+            statement = self.statements.get(shape)
+            if statement is None:
+                statement = self.statements[shape] = Statement(shape, sql, params)
+            statement.calls += 1
+            statement.routes.add(self.route)
+        return result
+
+    @contextmanager
+    def capture(self, route, connection=None):
+        self.route = route
+        with (connection or default_connection).execute_wrapper(self):
+            yield self
+
+
+class Plan:
+    def __init__(self, cost, findings, lines):
+        self.cost = cost
+        # [(kind, table, detail)]; kind is 'seq_scan', 'temp_sort' or 'missing_index'
+        self.findings = findings
+        self.lines = lines
+
+
+class Explainer:
+    """Runs the vendor's plan command; caches table sizes for the cost estimates."""
+
+    def __init__(self, connection=None, min_rows=DEFAULT_MIN_ROWS):
+        self.connection = connection or default_connection
+        self.min_rows = min_rows
+        self._rows = {}
+        self._stats = None
+        self._tables = set(self.connection.introspection.table_names())
+
+    def table_rows(self, table):
+        if table not in self._tables:
+            return 0
+        if table not in self._rows:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {self.connection.ops.quote_name(table)}')
+                self._rows[table] = cursor.fetchone()[0]
+        return self._rows[table]
+
+    def explain(self, sql, params):
+        if self.connection.vendor == 'postgresql':
+            return self._explain_postgresql(sql, params)
+        return self._explain_sqlite(sql, params)
+
+    def _index_stats(self):
+        """``{index: [rows, rows per 1st key, rows per 1st+2nd key, ...]}`` from ``ANALYZE``."""
+        if self._stats is None:
+            self._stats = {}
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+                if cursor.fetchone():
+                    cursor.execute('SELECT idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL')
+                    for index, stat in cursor.fetchall():
+                        self._stats[index] = [int(n) for n in stat.split() if n.isdigit()]
+        return self._stats
+
+    def _sqlite_rows_per_lookup(self, table, detail):
+        """Rows one ``SEARCH`` returns: the index statistics for its equality terms, or SQLite's guess."""
+        terms = detail[detail.find('(') + 1:detail.rfind(')')].split(' AND ') if '(' in detail else []
+        equalities = sum(1 for term in terms if term.endswith('=?') and term[-3] not in '<>')
+        ranged = len(terms) > equalities
+        if 'INTEGER PRIMARY KEY' in detail and not ranged:
+            return 1
+        index = _SQLITE_INDEX_RE.search(detail)
+        stats = self._index_stats().get(index.group(1)) if index and index.group(1) else None
+        rows = self.table_rows(table)
+        if stats and equalities < len(stats):
+            estimate = stats[equalities]
+        else:
+            estimate = max(1, rows // 10 ** equalities) if rows else 1
+        return max(1, estimate // 4) if ranged else estimate
+
+    def _explain_sqlite(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            nodes = [(row[0], row[1], row[-1]) for row in cursor.fetchall()]
+        # Nested loops: each node runs once per row of the nodes before it under the same parent
+        cost, flow, findings = 0.0, {}, []
+        for _node_id, parent, detail in nodes:
+            node = _SQLITE_NODE_RE.match(detail)
+            table = node.group(2) if node else None
+            rows = self.table_rows(table) if table else 0
+            loops = flow.get(parent, 1)
+            automatic = _SQLITE_AUTOMATIC_RE.search(detail)
+            if automatic:
+                columns = [term.split('=')[0].strip() for term in automatic.group(1).split(' AND ')]
+                cost += rows + loops * (math.log2(rows + 1) + 1)
+                flow[parent] = loops * self._sqlite_rows_per_lookup(table, detail)
+                if rows >= self.min_rows:
+                    findings.append(('missing_index', table, f"({', '.join(columns)})"))
+            elif node and node.group(1) == 'SCAN':
+                cost += loops * rows
+                flow[parent] = loops * max(rows, 1)
+                if not _SQLITE_INDEX_RE.search(detail) and rows >= self.min_rows:
+                    findings.append(('seq_scan', table, detail))
+            elif node:
+                cost += loops * (math.log2(rows + 1) + 1)
+                flow[parent] = loops * self._sqlite_rows_per_lookup(table, detail)
+            elif detail.startswith('USE TEMP B-TREE'):
+                sorted_rows = flow.get(parent, 1)
+                cost += sorted_rows * math.log2(sorted_rows + 1)
+                if sorted_rows >= self.min_rows:
+                    findings.append(('temp_sort', None, f"{detail} (~{sorted_rows} rows)"))
+        return Plan(round(cost, 1), findings, [detail for _id, _parent, detail in nodes])
+
+    def _explain_postgresql(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            raw = cursor.fetchone()[0]
+        root = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+        findings, lines = [], []
+
+        def walk(node, depth):
+            kind, table = node['Node Type'], node.get('Relation Name')
+            lines.append(f"{'  ' * depth}{kind}{f' on {table}' if table else ''} "
+                         f"(cost={node['Total Cost']}, rows={node['Plan Rows']})")
+            if kind == 'Seq Scan' and self.table_rows(table) >= self.min_rows:
+                findings.append(('seq_scan', table, node.get('Filter', '')))
+                columns = list(dict.fromkeys(_FILTER_COLUMN_RE.findall(node.get('Filter', ''))))
+                if columns:
+                    findings.append(('missing_index', table, f"({', '.join(columns)})"))
+            elif kind in ('Sort', 'Incremental Sort') and node['Plan Rows'] >= self.min_rows:
+                findings.append(('temp_sort', None, ', '.join(node.get('Sort Key', []))))
+            for child in node.get('Plans', []):
+                walk(child, depth + 1)
+
+        walk(root, 0)
+        return Plan(root['Total Cost'], findings, lines)
+
+
+def advise(statements, connection=None, min_rows=DEFAULT_MIN_ROWS):
+    """Explain ``statements`` and return the ones with findings, worst (cost × calls) first."""
+    explainer = Explainer(connection, min_rows)
+    advice = []
+    for statement in statements:
+        try:
+            plan = explainer.explain(statement.sql, statement.params)
+        except Exception as exc:  # e.g. a statement that needs state the replay didn't leave behind
+            plan = Plan(0, [('error', None, str(exc).splitlines()[0] if str(exc) else type(exc).__name__)], [])
+        if not plan.findings:
+            continue
+        advice.append({
+            'score': round(plan.cost * statement.calls, 1),
+            'cost': plan.cost,
+            'calls': statement.calls,
+            'routes': sorted(route for route in statement.routes if route),
+            'findings': [{'kind': kind, 'table': table, 'detail': detail} for kind, table, detail in plan.findings],
+            'sql': statement.shape,
+            'plan': plan.lines,
+        })
+    advice.sort(key=lambda entry: -entry['score'])
+    return advice
@@ -0,0 +1,137 @@
+"""Sidebar facet counts (category, brand, price range, star rating).
+
+All four facets come from one ``GROUP BY`` over the listing queryset,
+bucketed by ``(category, brand, price bucket, star bucket)``. The grouped
+rows are rolled up in Python, so picking a category, brand or rating in the
+sidebar never costs another query. Each facet ignores its own selection,
+which keeps the other options visible once one is picked.
+
+The grouped rows for the unfiltered listing and for single-filter listings
+are cached under the catalog version (see ``myapp.versioning``), so the
+common sidebar states cost no database round trip at all until a product
+or review changes.
+"""
+from collections import Counter
+
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, IntegerField, Q, Value, When
+from django.db.models.functions import Cast, Floor
+
+from .models import Product
+from .versioning import CATALOG, catalog_version, fill_timeout
+
+# (key, label, min price inclusive, max price exclusive)
+PRICE_BUCKETS = [
+    ('0-500', 'Under ₹500', None, 500),
+    ('500-1000', '₹500 – ₹1,000', 500, 1000),
+    ('1000-5000', '₹1,000 – ₹5,000', 1000, 5000),
+    ('5000-20000', '₹5,000 – ₹20,000', 5000, 20000),
+    ('20000-', '₹20,000 & above', 20000, None),
+]
+RATING_THRESHOLDS = [4, 3, 2, 1]
+BRAND_LIMIT = 12
+SNAPSHOT_TIMEOUT = 60 * 60
+
+
+def price_bucket_expression():
+    whens = []
+    for key, _label, low, high in PRICE_BUCKETS:
+        condition = Q()
+        if low is not None:
+            condition &= Q(price__gte=low)
+        if high is not None:
+            condition &= Q(price__lt=high)
+        whens.append(When(condition, then=Value(key)))
+    return Case(*whens, output_field=CharField())
+
+
+def star_bucket_expression():
+    """Whole stars (0 for unrated) so that "N stars & up" is ``stars >= N``."""
+    return Cast(Floor('avg_rating'), IntegerField())
+
+
+def _grouped_rows(queryset):
+    rows = (
+        queryset.order_by()
+        .annotate(price_bucket=price_bucket_expression(), stars=star_bucket_expression())
+        .values_list('category', 'brand', 'price_bucket', 'stars')
+        .annotate(n=Count('id'))
+    )
+    return [tuple(row) for row in rows]
+
+
+def _snapshot_key(filters):
+    active = sorted((name, str(value)) for name, value in filters.items() if value)
+    if len(active) > 1 or any(name == 'search' for name, _ in active):
+        return None
+    state = '&'.join(f'{name}={value}' for name, value in active)
+    return f'facets:v{catalog_version()}:{state}'
+
+
+def grouped_rows(queryset, filters):
+    """Return the grouped facet rows for ``queryset``.
+
+    ``filters`` describes the SQL filters already applied to ``queryset``
+    (search, price range, availability); it is only used to decide whether
+    the result is a cacheable snapshot and under which key.
+    """
+    key = _snapshot_key(filters)
+    if key is None:
+        return _grouped_rows(queryset)
+    rows = cache.get(key)
+    if rows is None:
+        rows = _grouped_rows(queryset)
+        cache.set(key, rows, fill_timeout(SNAPSHOT_TIMEOUT, CATALOG))
+    return rows
+
+
+def _selected(row, category, brand, min_rating):
+    row_category, row_brand, _bucket, stars, _n = row
+    return {
+        'category': not category or row_category == category,
+        'brand': not brand or row_brand == brand,
+        'rating': not min_rating or stars >= min_rating,
+    }
+
+
+def roll_up(rows, category='', brand='', min_rating=0):
+    categories, brands, prices, stars_count = Counter(), Counter(), Counter(), Counter()
+    total = 0
+    for row in rows:
+        row_category, row_brand, bucket, stars, n = row
+        matches = _selected(row, category, brand, min_rating)
+        if matches['brand'] and matches['rating']:
+            categories[row_category] += n
+        if matches['category'] and matches['rating']:
+            brands[row_brand] += n
+        if matches['category'] and matches['brand']:
+            stars_count[stars] += n
+        if all(matches.values()):
+            prices[bucket] += n
+            total += n
+
+    category_labels = dict(Product.CATEGORY_CHOICES)
+    return {
+        'total': total,
+        'categories': [
+            {'value': value, 'label': category_labels.get(value, value), 'count': count}
+            for value, count in sorted(categories.items())
+        ],
+        'brands': [
+            {'value': value, 'label': value, 'count': count}
+            for value, count in sorted(brands.items(), key=lambda item: (-item[1], item[0]))[:BRAND_LIMIT]
+        ],
+        'prices': [
+            {'value': key, 'label': label, 'min': low, 'max': high, 'count': prices[key]}
+            for key, label, low, high in PRICE_BUCKETS if prices[key]
+        ],
+        'ratings': [
+            {'value': threshold, 'count': sum(n for stars, n in stars_count.items() if stars >= threshold)}
+            for threshold in RATING_THRESHOLDS
+        ],
+    }
+
+
+def facet_counts(queryset, filters=None, category='', brand='', min_rating=0):
+    """Facet counts for ``queryset`` with the given sidebar selections."""
+    return roll_up(grouped_rows(queryset, filters or {}), category, brand, min_rating)
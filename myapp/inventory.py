@@ -0,0 +1,175 @@
+"""Stock reservations and atomic stock decrements.
+
+``stock_count`` is only ever lowered by conditional updates of the form
+``UPDATE ... SET stock_count = stock_count - n WHERE stock_count >= n``. The
+database checks and decrements in one step, so two buyers racing for the last
+unit cannot both get it. The stock being sold is the variant's when a cart
+line has one, otherwise the product's.
+
+* :func:`hold` reserves a cart line's quantity for ``STOCK_RESERVATION_TTL``
+  seconds by taking it out of stock, so ``stock_count``/``in_stock`` show what
+  other shoppers can still buy;
+* :func:`release` gives a line's units back when it leaves the cart;
+* :func:`commit` runs inside the checkout transaction. It turns the cart's
+  holds into sales and takes whatever is not held from stock, all or nothing;
+* :func:`sweep` returns expired holds to stock (``manage.py sweep_reservations``).
+
+The updates skip the model signals, so when a product sells out or comes back
+into stock the catalog version is bumped here, on commit, for the cached
+"in stock" facet snapshots.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .models import Product, ProductVariant, StockReservation
+from .versioning import bump_catalog_version
+
+DEFAULT_TTL = 900
+
+
+class OutOfStock(Exception):
+    """Checkout asked for more units than are in stock; nothing was taken."""
+
+    def __init__(self, wanted):
+        super().__init__('Not enough stock')
+        # {(product_id, variant_id): units still needed beyond existing holds}
+        self.wanted = wanted
+
+    def product_titles(self):
+        """Titles of the products that are short (queried on demand, after rollback)."""
+        ids = {product_id for product_id, _variant_id in self.wanted}
+        return list(Product.objects.filter(id__in=ids).order_by('title').values_list('title', flat=True))
+
+
+def _expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', DEFAULT_TTL))
+
+
+def _amounts(amounts):
+    return Case(*[When(pk=pk, then=Value(units)) for pk, units in amounts.items()], output_field=IntegerField())
+
+
+def _take(model, amounts):
+    """Decrement ``{pk: units}`` in one statement; ``False`` unless every row had enough.
+
+    A ``False`` result may leave the rows that did have enough decremented, so
+    callers raise and let the enclosing transaction roll back.
+    """
+    if not amounts:
+        return True
+    amount = _amounts(amounts)
+    taken = model.objects.filter(pk__in=amounts, stock_count__gte=amount).update(
+        stock_count=F('stock_count') - amount)
+    if model is Product and taken and model.objects.filter(pk__in=amounts, stock_count=0).exists():
+        bump_catalog_version()  # sold out
+    return taken == len(amounts)
+
+
+def _give_back(model, amounts):
+    if amounts:
+        amount = _amounts(amounts)
+        model.objects.filter(pk__in=amounts).update(stock_count=F('stock_count') + amount)
+        # Holding exactly what was given back means the product was sold out
+        if model is Product and model.objects.filter(pk__in=amounts, stock_count=amount).exists():
+            bump_catalog_version()
+
+
+def _split(per_sku):
+    """``{(product_id, variant_id): units}`` -> product and variant amounts, dropping zeros."""
+    products, variants = Counter(), Counter()
+    for (product_id, variant_id), units in per_sku.items():
+        if units:
+            if variant_id:
+                variants[variant_id] += units
+            else:
+                products[product_id] += units
+    return products, variants
+
+
+def _adjust(per_sku):
+    """Apply signed stock changes (positive = take); raises :class:`OutOfStock` if stock is short.
+
+    Must run inside a transaction, which the exception rolls back.
+    """
+    short = {sku: units for sku, units in per_sku.items() if units > 0}
+    taken_products, taken_variants = _split(short)
+    if not (_take(Product, taken_products) and _take(ProductVariant, taken_variants)):
+        raise OutOfStock(short)
+    given_products, given_variants = _split({sku: -units for sku, units in per_sku.items() if units < 0})
+    _give_back(Product, given_products)
+    _give_back(ProductVariant, given_variants)
+
+
+def hold(item):
+    """Reserve ``item.quantity`` units for the cart line ``item``; ``False`` if they are not in stock.
+
+    Re-holding a line after its quantity changed takes or returns the difference
+    and restarts the timer.
+    """
+    try:
+        with transaction.atomic():
+            reservation = StockReservation.objects.select_for_update().filter(item=item).first()
+            held = reservation.quantity if reservation else 0
+            _adjust({(item.product_id, item.variant_id): item.quantity - held})
+            if reservation:
+                StockReservation.objects.filter(pk=reservation.pk).update(quantity=item.quantity, expires_at=_expiry())
+            else:
+                StockReservation.objects.create(item=item, product_id=item.product_id, variant_id=item.variant_id,
+                                                quantity=item.quantity, expires_at=_expiry())
+    except OutOfStock:
+        return False
+    return True
+
+
+def _release(reservations):
+    """Delete ``reservations`` and put their units back; returns how many were released."""
+    with transaction.atomic():
+        rows = list(reservations.select_for_update(skip_locked=True)
+                    .values_list('id', 'product_id', 'variant_id', 'quantity'))
+        if not rows:
+            return 0
+        StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+        returned = Counter()
+        for _id, product_id, variant_id, quantity in rows:
+            returned[(product_id, variant_id)] -= quantity
+        _adjust(returned)
+    return len(rows)
+
+
+def release(items):
+    """Return the units held for the cart lines ``items`` (a queryset or list) to stock."""
+    return _release(StockReservation.objects.filter(item__in=items))
+
+
+def commit(user, lines):
+    """Sell ``lines`` (``(product_id, variant_id, quantity)``), consuming the holds in ``user``'s cart.
+
+    Call inside the checkout transaction. Raises :class:`OutOfStock` without
+    changing any stock when a line cannot be covered.
+    """
+    wanted = Counter()
+    for product_id, variant_id, quantity in lines:
+        wanted[(product_id, variant_id)] += quantity
+    holds = list(StockReservation.objects.select_for_update(of=('self',)).filter(item__cart__user=user)
+                 .values_list('id', 'product_id', 'variant_id', 'quantity'))
+    for _id, product_id, variant_id, quantity in holds:
+        wanted[(product_id, variant_id)] -= quantity
+    _adjust(wanted)
+    if holds:
+        StockReservation.objects.filter(id__in=[row[0] for row in holds]).delete()
+
+
+def sweep(batch_size=500):
+    """Return expired holds, and holds whose cart line is gone, to stock; returns the number released."""
+    released = 0
+    while True:
+        expired = StockReservation.objects.filter(Q(expires_at__lte=timezone.now()) | Q(item__isnull=True))
+        count = _release(expired.order_by('expires_at')[:batch_size])
+        released += count
+        if count < batch_size:
+            return released
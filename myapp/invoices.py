@@ -0,0 +1,211 @@
+"""Invoice documents: rendering, a content-addressed PDF store and downloads.
+
+Rendering a PDF with WeasyPrint/xhtml2pdf costs hundreds of milliseconds,
+while the HTML it is made from is cheap to produce and an issued invoice
+never changes. So each PDF is rendered once and stored in the ``invoices``
+storage (``settings.STORAGES``) under the SHA-256 of its HTML and renderer.
+Identical documents share one file, a renderer upgrade gets fresh files, and
+the digest doubles as the download's ``ETag``.
+
+:func:`pdf_response` serves a stored PDF with ``If-None-Match`` (304) and
+single-range ``Range`` (206) support, so browsers revalidate for free and
+PDF viewers can fetch pages incrementally.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+from django.http import FileResponse, HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+
+# PDF libraries are optional; without either, invoices are sent as HTML
+try:
+    from xhtml2pdf import pisa
+    HAS_XHTML2PDF = True
+except Exception:
+    HAS_XHTML2PDF = False
+
+try:
+    import weasyprint
+    HAS_WEASY = True
+except Exception:
+    HAS_WEASY = False
+
+# Part of every digest, so switching renderer (or its version) re-renders documents
+if HAS_WEASY:
+    PDF_RENDERER = f'weasyprint-{weasyprint.__version__}'
+elif HAS_XHTML2PDF:
+    import xhtml2pdf
+    PDF_RENDERER = f'xhtml2pdf-{xhtml2pdf.__version__}'
+else:
+    PDF_RENDERER = None
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def render_invoice_html(invoice):
+    return render_to_string('invoice.html', {'invoice': invoice})
+
+
+def html_to_pdf(html):
+    """PDF bytes for ``html``, or ``None`` when no PDF library can render it."""
+    # WeasyPrint preferred
+    if HAS_WEASY:
+        try:
+            return weasyprint.HTML(string=html).write_pdf()
+        except Exception:
+            pass
+    # xhtml2pdf fallback
+    if HAS_XHTML2PDF:
+        try:
+            result = BytesIO()
+            if not pisa.CreatePDF(html, dest=result).err:
+                return result.getvalue()
+        except Exception:
+            pass
+    return None
+
+
+# --- CONTENT-ADDRESSED STORE ---
+def invoice_storage():
+    return storages['invoices']
+
+
+def pdf_name(digest):
+    return f'{digest[:2]}/{digest}.pdf'
+
+
+def _save_atomically(storage, name, content):
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Remote storages only publish an object once it is fully uploaded
+        storage.save(name, ContentFile(content))
+        return
+    # Write next to the target and rename, so a concurrent download never sees a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'wb') as handle:
+        handle.write(content)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+
+
+def store_pdf(html):
+    """Digest of the stored PDF for ``html``, rendering it only the first time.
+
+    Returns ``None`` when no PDF library is installed.
+    """
+    if PDF_RENDERER is None:
+        return None
+    digest = hashlib.sha256(f'{PDF_RENDERER}\n{html}'.encode('utf-8')).hexdigest()
+    storage = invoice_storage()
+    if not storage.exists(pdf_name(digest)):
+        pdf = html_to_pdf(html)
+        if pdf is None:
+            return None
+        _save_atomically(storage, pdf_name(digest), pdf)
+    return digest
+
+
+def stored_invoice_pdf(invoice):
+    """Digest of ``invoice``'s stored PDF; the HTML is not re-rendered once stored."""
+    if invoice.pdf_sha256 and invoice_storage().exists(pdf_name(invoice.pdf_sha256)):
+        return invoice.pdf_sha256
+    digest = store_pdf(render_invoice_html(invoice))
+    if digest and digest != invoice.pdf_sha256:
+        type(invoice).objects.filter(pk=invoice.pk).update(pdf_sha256=digest)
+        invoice.pdf_sha256 = digest
+    return digest
+
+
+def invoice_attachment(invoice):
+    """``(filename, content, mimetype)`` suitable for ``EmailMessage.attach``."""
+    digest = stored_invoice_pdf(invoice)
+    if digest:
+        with invoice_storage().open(pdf_name(digest), 'rb') as handle:
+            return f"{invoice.invoice_number}.pdf", handle.read(), 'application/pdf'
+    html = render_invoice_html(invoice)
+    return f"{invoice.invoice_number}.html", html.encode('utf-8'), 'text/html'
+
+
+# --- DOWNLOADS ---
+class _FileRange:
+    """Read at most ``length`` bytes of ``handle`` from ``start`` (for ``FileResponse``)."""
+
+    def __init__(self, handle, start, length):
+        handle.seek(start)
+        self.handle = handle
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.handle.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.handle.close()
+
+
+def _requested_range(request, size, etag):
+    """``(start, end)`` of a satisfiable single ``Range``, ``None`` for the whole file, or ``False``."""
+    header = request.headers.get('Range')
+    if not header or request.method != 'GET':
+        return None
+    # If-Range: only honour the range while the client's copy is still current
+    if_range = request.headers.get('If-Range')
+    if if_range and if_range != etag:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        # Multiple or malformed ranges: a full 200 response is always allowed
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def pdf_response(request, digest, filename, as_attachment=False):
+    """Serve the stored PDF ``digest`` with ETag, conditional and range support."""
+    etag = f'"{digest}"'
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': 'private, no-cache'}
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    storage = invoice_storage()
+    size = storage.size(pdf_name(digest))
+    byte_range = _requested_range(request, size, etag)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    handle = storage.open(pdf_name(digest), 'rb')
+    if byte_range:
+        start, end = byte_range
+        response = FileResponse(_FileRange(handle, start, end - start + 1), status=206,
+                                content_type='application/pdf', as_attachment=as_attachment, filename=filename)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(handle, content_type='application/pdf', as_attachment=as_attachment, filename=filename)
+        response['Content-Length'] = str(size)
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,216 @@
+"""Durable, database-backed background jobs.
+
+Slow work that must not run inside a request (rendering invoices, talking to
+SMTP) is registered with :func:`task` and queued with :func:`enqueue`, which
+only inserts a :class:`~myapp.models.Job` row. The insert joins the caller's
+transaction, so a job exists exactly when the data it refers to was committed.
+
+``manage.py worker`` claims due jobs and runs them:
+
+* a claim is a conditional ``UPDATE``, so two workers never win the same row;
+* a claimed job is leased for its task's ``timeout`` (the visibility timeout).
+  If the worker dies the lease expires and another worker picks the job up;
+* a failing job is retried with exponential backoff plus jitter until
+  ``max_attempts`` is used up, then left ``failed`` with its last traceback;
+* ``concurrency`` caps how many jobs of one task hold a lease at once across
+  all workers, e.g. to stay under an SMTP provider's connection limit.
+
+Delivery is at-least-once, so tasks must tolerate running twice.
+
+A job reads from the primary until ``REPLICA_PIN_SECONDS`` after it was
+queued, since a replica may not have the rows it refers to yet.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.db import close_old_connections, connections
+from django.db.models import Count, F, IntegerField, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import db_routers
+from .models import Job
+
+logger = logging.getLogger('myapp.jobs')
+
+MAX_BACKOFF = 3600
+
+_registry = {}
+
+
+class Task:
+    def __init__(self, func, name, queue, max_attempts, timeout, concurrency, backoff):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.backoff = backoff
+
+    def __call__(self, **payload):
+        return self.func(**payload)
+
+    def delay(self, **payload):
+        return enqueue(self.name, payload)
+
+    def retry_delay(self, attempts):
+        """Seconds to wait after the ``attempts``-th failure: doubling, capped, with jitter."""
+        delay = min(self.backoff * 2 ** (attempts - 1), MAX_BACKOFF)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def task(name=None, queue='default', max_attempts=5, timeout=300, concurrency=None, backoff=30):
+    """Register ``func`` as a background task; call ``func.delay(**payload)`` to queue it."""
+    def decorator(func):
+        registered = Task(func, name or func.__name__, queue, max_attempts, timeout, concurrency, backoff)
+        _registry[registered.name] = registered
+        return registered
+    return decorator
+
+
+def get_task(name):
+    return _registry[name]
+
+
+def registered_queues():
+    return sorted({registered.queue for registered in _registry.values()})
+
+
+def enqueue(name, payload=None, countdown=0):
+    """Queue task ``name`` with JSON-serialisable keyword arguments ``payload``."""
+    registered = get_task(name)
+    return Job.objects.create(
+        queue=registered.queue,
+        task=registered.name,
+        payload=payload or {},
+        max_attempts=registered.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=countdown),
+    )
+
+
+def _due(now):
+    return Q(status='queued', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def claim(worker, queues=None, limit=1):
+    """Lease up to ``limit`` due jobs to ``worker`` and return them."""
+    now = timezone.now()
+    # A job whose lease expired on its last attempt is not retried again
+    Job.objects.filter(status='running', locked_until__lt=now, attempts__gte=F('max_attempts')).update(
+        status='failed', finished_at=now, locked_until=None,
+        last_error='Visibility timeout expired on the final attempt',
+    )
+
+    candidates = Job.objects.filter(_due(now), task__in=list(_registry))
+    if queues:
+        candidates = candidates.filter(queue__in=queues)
+    claimed = []
+    for job_id, name in candidates.order_by('run_at', 'id').values_list('id', 'task')[:limit * 4]:
+        registered = _registry[name]
+        row = Job.objects.filter(_due(now), id=job_id)
+        if registered.concurrency:
+            running = (Job.objects.filter(task=name, status='running', locked_until__gte=now)
+                       .order_by().values('task').annotate(n=Count('id')).values('n'))
+            row = row.alias(running=Coalesce(Subquery(running), Value(0), output_field=IntegerField()))
+            row = row.filter(running__lt=registered.concurrency)
+        won = row.update(
+            status='running', locked_by=worker, attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=registered.timeout),
+        )
+        if won:
+            claimed.append(job_id)
+            if len(claimed) == limit:
+                break
+    return list(Job.objects.filter(id__in=claimed).order_by('run_at', 'id'))
+
+
+def run_job(job, worker):
+    """Run a claimed job and record the outcome; returns the job's new status."""
+    registered = _registry[job.task]
+    # Only the current lease holder may settle the job
+    lease = Job.objects.filter(id=job.id, status='running', locked_by=worker, attempts=job.attempts)
+    try:
+        with db_routers.scope(job.created_at.timestamp() + db_routers.pin_seconds()):
+            registered.func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            status, changes = 'failed', {'finished_at': timezone.now()}
+            logger.error('job %s %s failed permanently after %d attempts\n%s', job.id, job.task, job.attempts, error)
+        else:
+            delay = registered.retry_delay(job.attempts)
+            status, changes = 'queued', {'run_at': timezone.now() + timedelta(seconds=delay)}
+            logger.warning('job %s %s attempt %d failed, retrying in %.0fs\n%s',
+                           job.id, job.task, job.attempts, delay, error)
+        lease.update(status=status, locked_until=None, last_error=error, **changes)
+        return status
+    lease.update(status='done', locked_until=None, finished_at=timezone.now())
+    logger.info('job %s %s done (attempt %d)', job.id, job.task, job.attempts)
+    return 'done'
+
+
+class Worker:
+    """Poll for jobs and run up to ``concurrency`` of them at a time on threads."""
+
+    def __init__(self, queues=None, concurrency=1, poll_interval=1.0, name=None):
+        self.queues = queues or registered_queues()
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.processed = 0
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Finish the jobs in hand, then return from :meth:`run`."""
+        self._stopping.set()
+
+    def _run_in_thread(self, job):
+        try:
+            return run_job(job, self.name)
+        finally:
+            connections.close_all()
+
+    def run(self, burst=False, max_jobs=None):
+        """Work until stopped; with ``burst`` return as soon as no job is due."""
+        if self.concurrency == 1:
+            return self._run_inline(burst, max_jobs)
+        in_flight = set()
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='job') as pool:
+            while not self._stopping.is_set():
+                close_old_connections()
+                free = self.concurrency - len(in_flight)
+                if max_jobs is not None:
+                    free = min(free, max_jobs - self.processed - len(in_flight))
+                jobs = claim(self.name, self.queues, free) if free > 0 else []
+                in_flight.update(pool.submit(self._run_in_thread, job) for job in jobs)
+                if not in_flight:
+                    if burst or (max_jobs is not None and self.processed >= max_jobs):
+                        break
+                    self._stopping.wait(self.poll_interval)
+                    continue
+                done, in_flight = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                self.processed += len(done)
+            # Stopped: let the jobs in hand finish rather than waiting for their leases to expire
+            wait(in_flight)
+            self.processed += len(in_flight)
+        return self.processed
+
+    def _run_inline(self, burst, max_jobs):
+        while not self._stopping.is_set() and (max_jobs is None or self.processed < max_jobs):
+            close_old_connections()
+            jobs = claim(self.name, self.queues, 1)
+            if not jobs:
+                if burst:
+                    break
+                self._stopping.wait(self.poll_interval)
+                continue
+            run_job(jobs[0], self.name)
+            self.processed += 1
+        return self.processed
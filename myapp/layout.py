@@ -0,0 +1,44 @@
+"""Pre-rendered fragments of the page chrome shared by every page.
+
+The category navigation is rendered once per catalog version and kept in the
+cache as HTML. Its key also carries a digest of the template, so a deploy
+that edits the markup never serves the old copy.
+:mod:`myapp.context_processors` exposes it lazily.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.template.loader import get_template, render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Product
+from .versioning import CATALOG, fill_timeout, get_version
+
+FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+@lru_cache(maxsize=None)
+def _template_digest(name):
+    return hashlib.sha1(get_template(name).template.source.encode()).hexdigest()[:12]
+
+
+def _fragment(template_name, namespace, context):
+    key = f'layout:{template_name}:{_template_digest(template_name)}:{get_version(namespace)}'
+    html = cache.get(key)
+    if html is None:
+        html = render_to_string(template_name, context())
+        cache.set(key, html, fill_timeout(FRAGMENT_TIMEOUT, namespace))
+    return html
+
+
+def _categories():
+    counts = dict(Product.objects.order_by().values_list('category').annotate(n=Count('id')))
+    return [(value, label, counts[value]) for value, label in Product.CATEGORY_CHOICES if counts.get(value)]
+
+
+def category_nav():
+    """Links to every category that has products, with their product counts."""
+    return mark_safe(_fragment('partials/category_nav.html', CATALOG,
+                               lambda: {'categories': _categories()}))
@@ -0,0 +1,97 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import URLPattern, reverse
+
+from myapp import explain, urls
+from myapp.benchmarks import isolated_database, write_report
+from myapp.models import CartItem, CartOrder, Invoice, Product
+
+# Fresh in-memory caches, so every view runs its queries instead of serving a cached copy
+REPLAY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'advise-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'advise-shared'},
+}
+PERSONAS = ('anonymous', 'customer', 'seller')
+
+
+class Command(BaseCommand):
+    help = ("Replay every route in myapp/urls.py against a seeded copy of the database, EXPLAIN each distinct "
+            "statement and rank sequential scans, temporary sorts and missing indexes by cost x calls.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=10)
+        parser.add_argument('--customers', type=int, default=500)
+        parser.add_argument('--products', type=int, default=5_000)
+        parser.add_argument('--orders', type=int, default=5, help="Past orders per customer.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--min-rows', type=int, default=explain.DEFAULT_MIN_ROWS,
+                            help="Ignore scans of tables smaller than this.")
+        parser.add_argument('--top', type=int, default=15, help="Statements to print.")
+        parser.add_argument('--output', help="Optional path for the full JSON report.")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            raise CommandError(f"No EXPLAIN support for {connection.vendor}.")
+        with isolated_database():
+            call_command('generate_data', sellers=options['sellers'], customers=options['customers'],
+                         products=options['products'], orders=options['orders'], seed=options['seed'],
+                         stdout=StringIO())
+            with connection.cursor() as cursor:
+                # Give the planner row counts, as a long-running database would have
+                cursor.execute('ANALYZE')
+            log = explain.StatementLog()
+            with override_settings(CACHES=REPLAY_CACHES):
+                requests = self._replay(log)
+            advice = explain.advise(log.statements.values(), min_rows=options['min_rows'])
+
+        self.stdout.write(f"{requests} requests, {len(log.statements)} distinct statements, "
+                          f"{len(advice)} with findings")
+        for rank, entry in enumerate(advice[:options['top']], 1):
+            self.stdout.write(self.style.WARNING(
+                f"\n#{rank} score={entry['score']} (cost {entry['cost']} x {entry['calls']} calls) "
+                f"routes: {', '.join(entry['routes'])}"))
+            for finding in entry['findings']:
+                self.stdout.write(f"  {finding['kind']:<14} {finding['table'] or '':<24} {finding['detail']}")
+            self.stdout.write(f"  {entry['sql'][:300]}")
+        if options['output']:
+            write_report(options['output'], {'options': options, 'requests': requests, 'advice': advice})
+            self.stdout.write(self.style.SUCCESS(f"\nReport written to {options['output']}"))
+
+    def _fixtures(self):
+        """Route kwargs pointing at seeded rows of a customer with order history."""
+        order = CartOrder.objects.filter(product__isnull=False, invoices__isnull=False).order_by('id').first()
+        if order is None:
+            raise CommandError("The seeded dataset has no invoiced orders; raise --customers/--orders.")
+        customer = order.user
+        product = Product.objects.filter(seller__isnull=False).order_by('id').first()
+        item = CartItem.objects.filter(cart__user=customer).order_by('id').first()
+        invoice = Invoice.objects.filter(orders=order).first()
+        kwargs = {
+            'cat': product.category, 'id': product.id, 'p_id': product.id, 'product_id': product.id,
+            'item_id': item.id if item else 0, 'order_id': order.id, 'seller_id': product.seller_id,
+            'invoice_id': invoice.id, 'section': 'orders',
+        }
+        return {'anonymous': None, 'customer': customer, 'seller': User.objects.get(id=product.seller_id)}, kwargs
+
+    def _replay(self, log):
+        personas, kwargs = self._fixtures()
+        client = Client(HTTP_HOST='localhost', raise_request_exception=False)
+        requests = 0
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue  # included URLconfs (allauth)
+            url = reverse(pattern.name, kwargs={name: kwargs[name] for name in pattern.pattern.converters})
+            for persona in PERSONAS:
+                client.logout()
+                if personas[persona]:
+                    client.force_login(personas[persona])
+                with log.capture(f'{pattern.name}[{persona}]'):
+                    client.get(url, secure=True)
+                requests += 1
+        return requests
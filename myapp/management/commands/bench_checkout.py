@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from myapp.benchmarks import isolated_database, summarize, time_call, write_report
+from myapp.models import CartItem, Product
+from myapp.sqlbudget import QueryRecorder
+
+
+class Command(BaseCommand):
+    help = "Benchmark confirm_order (queries and latency) for carts of different sizes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 100],
+                            help="Cart sizes (line items) to benchmark (default: 1 10 100).")
+        parser.add_argument('--repeat', type=int, default=20, help="Checkouts per cart size.")
+        parser.add_argument('--output', help="Optional path for a JSON report.")
+
+    def handle(self, *args, **options):
+        report = {'runs': []}
+        # Mail is rendered by the job worker, but keep the benchmark from ever reaching SMTP
+        with isolated_database(), override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+            products = Product.objects.bulk_create([
+                Product(title=f"Bench product {i}", brand='PatilApx', price=100 + i, description='',
+                        category='tech', image_url=f"https://picsum.photos/seed/checkout{i}/800/600",
+                        stock_count=1_000_000)
+                for i in range(max(options['sizes']))
+            ])
+            user = User.objects.create_user('checkout-bench', 'checkout-bench@example.com', 'password')
+            # Django's test client sends Host: testserver, which ALLOWED_HOSTS rejects outside tests
+            client = Client(HTTP_HOST='localhost')
+            client.force_login(user)
+            for size in options['sizes']:
+                run = self._measure(client, user, products[:size], options['repeat'])
+                report['runs'].append(run)
+                self.stdout.write(
+                    f"{size:>4} items | queries={run['queries']} | p50={run['latency']['p50_ms']}ms "
+                    f"p95={run['latency']['p95_ms']}ms"
+                )
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _measure(self, client, user, products, repeat):
+        latencies, query_counts = [], set()
+        for _ in range(repeat):
+            CartItem.objects.bulk_create([CartItem(cart=user.cart, product=p, quantity=2) for p in products])
+            recorder = QueryRecorder()
+            with recorder.capture():
+                response, elapsed = time_call(client.post, reverse('confirm_order'),
+                                              {'address': '1 Bench Street', 'mobile': '9999999999'}, secure=True)
+            assert response.status_code == 200, response.status_code
+            query_counts.add(recorder.count)
+            latencies.append(elapsed)
+        return {
+            'items': len(products),
+            'queries': sorted(query_counts)[0] if len(query_counts) == 1 else sorted(query_counts),
+            'latency': summarize(latencies),
+        }
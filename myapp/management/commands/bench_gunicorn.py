@@ -0,0 +1,168 @@
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from myapp.benchmarks import isolated_database, write_report
+
+from .bench_load import DEFAULT_MIX, seed_catalog
+
+# Gunicorn arguments and environment of each configuration
+CONFIGS = {
+    # What the Procfile ran before gunicorn.conf.py: one sync worker, no preload or recycling
+    'bare': {'args': ['--config', os.devnull], 'env': {}},
+    'sync': {'args': ['--config', 'gunicorn.conf.py', '--worker-class', 'sync', '--threads', '1'], 'env': {}},
+    'gthread': {'args': ['--config', 'gunicorn.conf.py'], 'env': {}},
+    # Persistent per-thread connections instead of the pool (same as gthread on SQLite)
+    'gthread-no-pool': {'args': ['--config', 'gunicorn.conf.py'], 'env': {'DB_POOL': '0'}},
+}
+DEFAULT_CONFIGS = 'bare,sync,gthread,gthread-no-pool'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def database_env(settings_dict):
+    """Environment that points a server process at the database ``settings_dict`` describes."""
+    if connection.vendor == 'sqlite':
+        return {'SQLITE_PATH': str(settings_dict['NAME'])}
+    if connection.vendor == 'postgresql':
+        credentials = quote(settings_dict['USER'] or '')
+        if settings_dict['PASSWORD']:
+            credentials += ':' + quote(settings_dict['PASSWORD'])
+        host = f"{settings_dict['HOST'] or 'localhost'}:{settings_dict['PORT'] or 5432}"
+        return {'DATABASE_URL': f"postgres://{credentials}@{host}/{quote(settings_dict['NAME'])}"}
+    raise CommandError(f"Cannot hand a {connection.vendor} database to gunicorn.")
+
+
+class Command(BaseCommand):
+    help = ("Boot gunicorn once per configuration on a seeded copy of the database, drive each with "
+            "bench_load --url and compare throughput, latency percentiles and errors. Orders placed "
+            "while benchmarking one configuration stay in the database for the next.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--configs', default=DEFAULT_CONFIGS,
+                            help=f"Comma-separated configurations from: {', '.join(CONFIGS)}.")
+        parser.add_argument('--workers', type=int, help="WEB_CONCURRENCY for every configuration but bare.")
+        parser.add_argument('--threads', type=int, help="GUNICORN_THREADS for the gthread configurations.")
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent virtual users (default: 16).")
+        parser.add_argument('--duration', type=float, default=30.0, help="Recorded seconds per configuration.")
+        parser.add_argument('--warmup', type=float, default=3.0)
+        parser.add_argument('--mix', default=DEFAULT_MIX)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--boot-timeout', type=float, default=60.0,
+                            help="Seconds to wait for a server to answer.")
+        parser.add_argument('--output', default='bench_gunicorn.json', help="JSON report path.")
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['configs'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in CONFIGS]
+        if unknown:
+            raise CommandError(f"Unknown configuration(s): {', '.join(unknown)}")
+        results = {}
+        with tempfile.TemporaryDirectory() as tmp, \
+                isolated_database(test_name=os.path.join(tmp, 'bench_gunicorn.sqlite3')):
+            seed_catalog(options['products'], options['seed'])
+            env = self._env(tmp)
+            # The servers read the sessions bench_load creates, so both sides use the same cache
+            with override_settings(CACHES=self._caches(env)):
+                for name in names:
+                    results[name] = self._bench(name, env, tmp, options)
+                    connections.close_all()
+
+        write_report(options['output'], {
+            'configs': results,
+            'options': {key: options[key] for key in ('configs', 'workers', 'threads', 'clients', 'duration',
+                                                      'warmup', 'mix', 'products', 'seed')},
+            'database': connection.vendor,
+            'cpus': os.cpu_count(),
+        })
+        self.stdout.write(f"{'config':<16} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name, report in results.items():
+            latency = report['latency']
+            self.stdout.write(f"{name:<16} {report['throughput_rps']:>9} {latency['p50_ms']:>9} "
+                              f"{latency['p95_ms']:>9} {latency['p99_ms']:>9} {report['errors']:>7}")
+        self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _env(self, tmp):
+        env = dict(os.environ, **database_env(connection.settings_dict))
+        env.update({
+            # No replicas of the real database, and no order emails
+            'DATABASE_REPLICA_URLS': '', 'SQLITE_REPLICA': '',
+            'EMAIL_HOST': '', 'DJANGO_EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+            'SQL_BUDGET_HEADERS': '1', 'GUNICORN_ACCESS_LOG': '',
+        })
+        if not settings.REDIS_URL:
+            env['CACHE_DIR'] = os.path.join(tmp, 'cache')
+        return env
+
+    def _caches(self, env):
+        caches = {alias: dict(config) for alias, config in settings.CACHES.items()}
+        if 'CACHE_DIR' in env:
+            caches['shared']['LOCATION'] = env['CACHE_DIR']
+        return caches
+
+    def _bench(self, name, env, tmp, options):
+        config = CONFIGS[name]
+        env = dict(env, **config['env'])
+        if options['workers'] and name != 'bare':
+            env['WEB_CONCURRENCY'] = str(options['workers'])
+        if options['threads']:
+            env['GUNICORN_THREADS'] = str(options['threads'])
+        port = free_port()
+        command = [sys.executable, '-m', 'gunicorn', 'ECommerce.wsgi:application', *config['args'],
+                   '--bind', f'127.0.0.1:{port}']
+        log_path = os.path.join(tmp, f'{name}.log')
+        self.stdout.write(f"{name}: {' '.join(command[2:])}")
+        with open(log_path, 'w') as log:
+            server = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env, stdout=log, stderr=log)
+        try:
+            self._wait_until_up(server, port, log_path, options['boot_timeout'])
+            report_path = os.path.join(tmp, f'{name}.json')
+            call_command('bench_load', url=f'http://127.0.0.1:{port}', clients=options['clients'],
+                         duration=options['duration'], warmup=options['warmup'], mix=options['mix'],
+                         seed=options['seed'], output=report_path, stdout=StringIO())
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        with open(report_path, encoding='utf-8') as fh:
+            report = json.load(fh)
+        report['command'] = command[2:]
+        return report
+
+    def _wait_until_up(self, server, port, log_path, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                with open(log_path) as log:
+                    raise CommandError(f"gunicorn exited with {server.returncode}:\n{log.read()[-2000:]}")
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            try:
+                conn.request('GET', '/about/', headers={'Host': f'127.0.0.1:{port}', 'X-Forwarded-Proto': 'https'})
+                if conn.getresponse().status < 500:
+                    return
+            except OSError:
+                pass
+            finally:
+                conn.close()
+            time.sleep(0.2)
+        raise CommandError(f"gunicorn did not answer on port {port} within {timeout}s")
@@ -0,0 +1,297 @@
+import http.client
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from importlib import import_module
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler, get_internal_wsgi_application
+from django.db import connections, transaction
+from django.middleware.csrf import _get_new_csrf_string
+from django.utils import timezone
+
+from myapp import search
+from myapp.benchmarks import isolated_database, percentile, summarize, write_report
+from myapp.models import Product
+
+from .bench_search import ADJECTIVES, BRANDS, CATEGORIES, MODEL_NAMES, NOUNS
+
+DEFAULT_MIX = 'browse=50,search=25,cart=12,checkout=5,invoice=8'
+SORTS = ['-created_at', 'price_low', 'price_high', 'rating', 'popular']
+# Per-order and consolidated invoice download links
+INVOICE_LINK_RE = re.compile(r'/download-invoice/(?:invoice/)?\d+/')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class VirtualUser:
+    """One logged-in shopper with its own cookie jar."""
+
+    def __init__(self, harness, session_key, rng):
+        self.harness = harness
+        self.rng = rng
+        self.invoice_links = []
+        self.csrf_token = _get_new_csrf_string()
+        self.cookies = {settings.SESSION_COOKIE_NAME: session_key, settings.CSRF_COOKIE_NAME: self.csrf_token}
+
+    def request(self, label, method, path, form=None):
+        harness = self.harness
+        headers = {
+            'Host': harness.netloc,
+            # The app redirects plain HTTP; pretend to sit behind a TLS proxy
+            'X-Forwarded-Proto': 'https',
+            'Cookie': '; '.join(f'{name}={value}' for name, value in self.cookies.items()),
+        }
+        body = None
+        if method == 'POST':
+            body = urlencode(form or {})
+            headers.update({
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'X-CSRFToken': self.csrf_token,
+                'Referer': f'https://{harness.netloc}/',
+            })
+        conn = http.client.HTTPConnection(harness.host, harness.port, timeout=harness.timeout)
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            response, content, status = None, b'', 'error'
+        finally:
+            conn.close()
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+
+        queries = None
+        if response is not None:
+            queries = response.getheader('X-DB-Query-Count')
+            for raw in response.msg.get_all('Set-Cookie') or []:
+                for name, morsel in SimpleCookie(raw).items():
+                    self.cookies[name] = morsel.value
+        harness.record(label, status, elapsed_ms, int(queries) if queries else None)
+        return content
+
+    # --- scenarios ---
+    def browse(self):
+        data = self.harness.dataset
+        self.request('home', 'GET', '/')
+        params = {'category': self.rng.choice(CATEGORIES), 'sort': self.rng.choice(SORTS)}
+        self.request('product_list', 'GET', '/products/?' + urlencode(params))
+        product_id, category = self.rng.choice(data['products'])
+        self.request('product_detail', 'GET', f'/product/{category}/{product_id}/')
+
+    def search(self):
+        term = self.rng.choice(MODEL_NAMES)
+        self.request('autocomplete', 'GET', '/autocomplete/?' + urlencode({'q': term[:3]}))
+        self.request('search', 'GET', '/products/?' + urlencode({'search': f'{term} {self.rng.choice(NOUNS)}'}))
+
+    def cart(self):
+        product_id, _category = self.rng.choice(self.harness.dataset['products'])
+        self.request('add_to_cart', 'GET', f'/add-to-cart/{product_id}/')
+        self.request('cart', 'GET', '/cart/')
+
+    def checkout(self):
+        product_id, _category = self.rng.choice(self.harness.dataset['products'])
+        self.request('add_to_cart', 'GET', f'/add-to-cart/{product_id}/')
+        self.request('checkout', 'GET', '/checkout/')
+        content = self.request('confirm_order', 'POST', '/confirm-order/', {
+            'address': '221B Baker Street', 'mobile': '9999999999', 'payment_method': 'cod',
+        })
+        self._remember_invoices(content)
+
+    def invoice(self):
+        self._remember_invoices(self.request('invoice_list', 'GET', '/invoice/'))
+        if self.invoice_links:
+            self.request('invoice_download', 'GET', self.rng.choice(self.invoice_links))
+
+
+    def _remember_invoices(self, content):
+        found = set(INVOICE_LINK_RE.findall(content.decode('utf-8', 'replace')))
+        self.invoice_links = sorted(found | set(self.invoice_links))
+
+
+class LoadHarness:
+    def __init__(self, base_url, dataset, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.netloc = parts.netloc
+        self.dataset = dataset
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, label, status, elapsed_ms, queries):
+        with self._lock:
+            self.samples[label].append(elapsed_ms)
+            self.statuses[label][str(status)] += 1
+            if queries is not None:
+                self.queries[label].append(queries)
+
+    def report(self, elapsed):
+        endpoints = {}
+        for label in sorted(self.samples):
+            samples, queries = self.samples[label], self.queries[label]
+            endpoints[label] = dict(
+                summarize(samples),
+                throughput_rps=round(len(samples) / elapsed, 2),
+                status=dict(self.statuses[label]),
+                queries={
+                    'mean': round(sum(queries) / len(queries), 2) if queries else None,
+                    'p95': percentile(queries, 95) if queries else None,
+                    'max': max(queries) if queries else None,
+                },
+            )
+        total = sum(len(samples) for samples in self.samples.values())
+        errors = sum(n for statuses in self.statuses.values() for code, n in statuses.items()
+                     if code == 'error' or code.startswith('5'))
+        return {
+            'duration_s': round(elapsed, 3),
+            'requests': total,
+            'errors': errors,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'latency': summarize([ms for samples in self.samples.values() for ms in samples]),
+            'endpoints': endpoints,
+        }
+
+
+def parse_mix(raw):
+    mix = {}
+    for part in raw.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if not hasattr(VirtualUser, name) or name.startswith('_') or name == 'request':
+            raise CommandError(f"Unknown scenario {name!r} in --mix")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def seed_catalog(size, seed, chunk=5000):
+    """Bulk-create ``size`` in-stock products and index them for search."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    with transaction.atomic():
+        for start in range(0, size, chunk):
+            Product.objects.bulk_create([
+                Product(
+                    title=f"{rng.choice(ADJECTIVES).title()} {rng.choice(MODEL_NAMES).title()} "
+                          f"{rng.choice(NOUNS).title()}",
+                    brand=rng.choice(BRANDS),
+                    price=rng.randint(99, 99_999),
+                    description=' '.join(rng.choices(ADJECTIVES + NOUNS + MODEL_NAMES, k=12)),
+                    category=rng.choice(CATEGORIES),
+                    image_url=f"https://picsum.photos/seed/load{i}/800/600",
+                    stock_count=1_000_000,
+                    created_at=now,
+                )
+                for i in range(start, min(start + chunk, size))
+            ])
+    search.rebuild_index()
+
+
+class Command(BaseCommand):
+    help = ("Drive a concurrent browse/search/cart/checkout/invoice traffic mix against the WSGI app "
+            "and report per-endpoint latency percentiles, throughput and query counts as JSON.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help="Target an already running server (e.g. gunicorn) that uses the same "
+                                          "database settings, instead of booting one on a seeded copy.")
+        parser.add_argument('--clients', type=int, default=16, help="Concurrent virtual users (default: 16).")
+        parser.add_argument('--duration', type=float, default=30.0, help="Seconds to run after warm-up.")
+        parser.add_argument('--warmup', type=float, default=3.0, help="Seconds of unrecorded warm-up traffic.")
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX}).")
+        parser.add_argument('--products', type=int, default=5000, help="Catalog size to seed (booted mode only).")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', default='bench_load.json', help="JSON report path.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        mix = parse_mix(options['mix'])
+        if options['url']:
+            report = self._run(options['url'], self._load_dataset(), mix)
+        else:
+            with tempfile.TemporaryDirectory() as tmp, \
+                    isolated_database(test_name=os.path.join(tmp, 'bench_load.sqlite3')):
+                seed_catalog(options['products'], options['seed'])
+                server = self._boot()
+                try:
+                    report = self._run(f'http://127.0.0.1:{server.server_port}', self._load_dataset(), mix)
+                finally:
+                    server.shutdown()
+                    server.server_close()
+        report['config'] = {key: options[key] for key in ('url', 'clients', 'duration', 'warmup', 'mix',
+                                                           'products', 'seed')}
+        report['config']['database'] = connections['default'].vendor
+        write_report(options['output'], report)
+
+        for label, stats in report['endpoints'].items():
+            self.stdout.write(f"{label:>18} n={stats['count']:<6} p50={stats['p50_ms']:>8}ms "
+                              f"p95={stats['p95_ms']:>8}ms p99={stats['p99_ms']:>8}ms q={stats['queries']['mean']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['requests']} requests, {report['throughput_rps']} req/s, {report['errors']} errors "
+            f"-> {options['output']}"
+        ))
+
+    def _boot(self):
+        # Ask the SQL budget middleware for X-DB-* headers before the app loads,
+        # and keep the order-confirmation emails off the console
+        settings.SQL_BUDGET_HEADERS = True
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler, allow_reuse_address=False)
+        server.set_app(get_internal_wsgi_application())
+        threading.Thread(target=server.serve_forever, name='bench-load-server', daemon=True).start()
+        return server
+
+    def _load_dataset(self):
+        """Product ids and one logged-in session per virtual user, read from the target database."""
+        products = list(Product.objects.values_list('id', 'category').order_by('?')[:2000])
+        if not products:
+            raise CommandError("No products to browse; seed the database first.")
+        engine = import_module(settings.SESSION_ENGINE)
+        User = get_user_model()
+        sessions = []
+        for n in range(self.options['clients']):
+            user = (User.objects.filter(username=f'loadtest{n}').first()
+                    or User.objects.create_user(f'loadtest{n}', f'loadtest{n}@example.com'))
+            session = engine.SessionStore()
+            session[SESSION_KEY] = str(user.pk)
+            session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+            session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+            session.save()
+            sessions.append(session.session_key)
+        return {'products': products, 'sessions': sessions}
+
+    def _run(self, base_url, dataset, mix):
+        options = self.options
+        names, weights = list(mix), list(mix.values())
+        # Warm-up traffic (caches, autocomplete index, connections) goes to a
+        # throwaway harness so it doesn't skew the recorded percentiles
+        harness, warmup = LoadHarness(base_url, dataset), LoadHarness(base_url, dataset)
+        users = [VirtualUser(warmup, session_key, random.Random(options['seed'] + n))
+                 for n, session_key in enumerate(dataset['sessions'])]
+        record_from = time.monotonic() + options['warmup']
+        deadline = record_from + options['duration']
+
+        def drive(user):
+            while time.monotonic() < deadline:
+                if time.monotonic() >= record_from:
+                    user.harness = harness
+                getattr(user, user.rng.choices(names, weights)[0])()
+
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            list(pool.map(drive, users))
+        return harness.report(options['duration'])
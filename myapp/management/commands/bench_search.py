@@ -0,0 +1,85 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from myapp import search
+from myapp.benchmarks import isolated_database, summarize, time_call, write_report
+from myapp.models import Product
+
+ADJECTIVES = ['premium', 'wireless', 'organic', 'compact', 'leather', 'smart', 'portable',
+              'vintage', 'ergonomic', 'waterproof', 'classic', 'ultra', 'foldable', 'linen']
+NOUNS = ['jacket', 'headphones', 'lamp', 'serum', 'charger', 'boots', 'speaker', 'vacuum',
+         'shirt', 'watch', 'backpack', 'kettle', 'glasses', 'blender', 'skirt', 'router']
+BRANDS = ['PatilApx', 'Motorola', 'Roborock', 'Xreal', 'Solos', 'NanoBeam', 'VegaHome', 'Lumen']
+CATEGORIES = [key for key, _ in Product.CATEGORY_CHOICES]
+# A few thousand made-up model names so query terms are as selective as
+# real catalog searches instead of matching half the table.
+SYLLABLES = ['ka', 'zo', 'mi', 'tra', 'lex', 'nor', 'vi', 'qu', 'sen', 'dra', 'po', 'lum']
+MODEL_NAMES = [a + b + c for a in SYLLABLES for b in SYLLABLES for c in SYLLABLES]
+
+
+class Command(BaseCommand):
+    help = "Benchmark ranked product search against the legacy icontains scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100_000, 1_000_000],
+                            help="Catalog sizes to benchmark (default: 100000 1000000).")
+        parser.add_argument('--queries', type=int, default=200, help="Queries per size.")
+        parser.add_argument('--limit', type=int, default=24, help="Results fetched per query.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help="Optional path for a JSON report.")
+
+    def handle(self, *args, **options):
+        report = {'backend': None, 'runs': []}
+        for size in options['sizes']:
+            with isolated_database():
+                self._populate(size, options['seed'])
+                report['backend'] = search.backend()
+                run = self._measure(size, options['queries'], options['limit'], options['seed'])
+            report['runs'].append(run)
+            self.stdout.write(
+                f"{size:>9} products | fts p50={run['search']['p50_ms']}ms p95={run['search']['p95_ms']}ms"
+                f" | icontains p50={run['icontains']['p50_ms']}ms p95={run['icontains']['p95_ms']}ms"
+            )
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _populate(self, size, seed, chunk=5000):
+        rng = random.Random(seed)
+        now = timezone.now()
+        with transaction.atomic():
+            for start in range(0, size, chunk):
+                batch = []
+                for i in range(start, min(start + chunk, size)):
+                    adjective, noun = rng.choice(ADJECTIVES), rng.choice(NOUNS)
+                    batch.append(Product(
+                        title=f"{adjective.title()} {rng.choice(MODEL_NAMES).title()} {noun.title()}",
+                        brand=rng.choice(BRANDS),
+                        price=rng.randint(99, 99_999),
+                        description=' '.join(rng.choices(ADJECTIVES + NOUNS + MODEL_NAMES, k=12)),
+                        category=rng.choice(CATEGORIES),
+                        image_url=f"https://picsum.photos/seed/bench{i}/800/600",
+                        created_at=now,
+                    ))
+                Product.objects.bulk_create(batch)
+        # bulk_create skips the post_save signal, so build the index in one pass
+        search.rebuild_index()
+
+    def _measure(self, size, queries, limit, seed):
+        rng = random.Random(seed + 1)
+        terms = [f"{rng.choice(MODEL_NAMES)} {rng.choice(NOUNS)}" for _ in range(queries)]
+        search_ms, scan_ms = [], []
+        for term in terms:
+            _, elapsed = time_call(search.ranked_product_ids, term, limit)
+            search_ms.append(elapsed)
+            words = term.split()
+            scan = Product.objects.filter(
+                Q(title__icontains=words[0]) | Q(brand__icontains=words[0]) | Q(description__icontains=words[0])
+            ).order_by('-created_at').values_list('id', flat=True)[:limit]
+            _, elapsed = time_call(list, scan)
+            scan_ms.append(elapsed)
+        return {'size': size, 'search': summarize(search_ms), 'icontains': summarize(scan_ms)}
@@ -0,0 +1,117 @@
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from myapp import carts, sessions
+from myapp.benchmarks import isolated_database, write_report
+from myapp.models import Product
+from myapp.sqlbudget import QueryRecorder
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached-db': 'django.contrib.sessions.backends.cached_db',
+    'cache-write-behind': 'myapp.sessions',
+}
+# One process drives every visitor, so an in-memory cache (atomic add()/incr()) stands in for Redis
+BENCH_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-sessions-default'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bench-sessions-shared'},
+}
+
+
+class Command(BaseCommand):
+    help = ("Count django_session reads and writes caused by anonymous browsing (page views and guest "
+            "cart changes) with the database session engine and with myapp.sessions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--visitors', type=int, default=50)
+        parser.add_argument('--adds', type=int, default=10, help="Cart changes per visitor.")
+        parser.add_argument('--views-per-add', type=int, default=3, help="Page views between cart changes.")
+        parser.add_argument('--think-time', type=float, default=5.0,
+                            help="Simulated seconds between a visitor's requests.")
+        parser.add_argument('--output', help="Optional path for a JSON report.")
+
+    def handle(self, *args, **options):
+        report = {'options': {k: options[k] for k in ('visitors', 'adds', 'views_per_add', 'think_time')},
+                  'engines': {}}
+        with isolated_database():
+            self.products = Product.objects.bulk_create([
+                Product(title=f"Bench product {i}", brand='PatilApx', price=100 + i, description='',
+                        category='tech', image_url=f"https://picsum.photos/seed/session{i}/800/600")
+                for i in range(20)
+            ])
+            for label, engine in ENGINES.items():
+                with override_settings(CACHES=BENCH_CACHES, SESSION_CACHE_ALIAS='shared'):
+                    result = self._run(engine, options)
+                report['engines'][label] = result
+                self.stdout.write(
+                    f"{label:>18} | requests={result['requests']} session reads={result['reads']} "
+                    f"writes={result['writes']} ({result['writes_per_cart_change']:.2f} per cart change)"
+                )
+        db_writes = report['engines']['db']['writes']
+        cached_writes = report['engines']['cache-write-behind']['writes']
+        if db_writes:
+            report['write_reduction'] = round(1 - cached_writes / db_writes, 4)
+            self.stdout.write(self.style.SUCCESS(
+                f"DB session writes: {db_writes} -> {cached_writes} ({report['write_reduction']:.1%} fewer)"))
+        if options['output']:
+            write_report(options['output'], report)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+
+    def _run(self, engine, options):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+        factory = RequestFactory()
+        cookie_name = settings.SESSION_COOKIE_NAME
+        # The clock advances by the think time each round, so flush intervals close as they would live
+        now = [time.time()]
+        clock = SimpleNamespace(time=lambda: now[0], monotonic=time.monotonic, sleep=time.sleep)
+
+        def page(request):
+            # A page that shows the cart badge: reads the session, changes nothing
+            request.session.get(carts.SESSION_CART_KEY)
+            return HttpResponse()
+
+        def add(request):
+            carts.CartService(request).add(self.products[request.product_index % len(self.products)])
+            return HttpResponse()
+
+        recorder = QueryRecorder()
+        requests = 0
+        with override_settings(SESSION_ENGINE=engine), mock.patch.object(sessions, 'time', clock), \
+                recorder.capture():
+            # Visitors browse side by side: everyone takes a step, then the clock moves on
+            cookies = [None] * options['visitors']
+            for step in range(options['adds'] * (options['views_per_add'] + 1)):
+                is_add = step % (options['views_per_add'] + 1) == options['views_per_add']
+                for visitor in range(options['visitors']):
+                    request = factory.post('/cart/') if is_add else factory.get('/')
+                    request.user = AnonymousUser()
+                    request.product_index = visitor + step
+                    if cookies[visitor]:
+                        request.COOKIES[cookie_name] = cookies[visitor]
+                    response = SessionMiddleware(add if is_add else page)(request)
+                    if cookie_name in response.cookies:
+                        cookies[visitor] = response.cookies[cookie_name].value
+                    requests += 1
+                now[0] += options['think_time']
+            if engine == ENGINES['cache-write-behind']:
+                sessions.flush(include_current=True)
+
+        shapes = [shape.lstrip().split(None, 1)[0].upper() for shape, _duration in recorder.queries
+                  if 'django_session' in shape]
+        writes = sum(1 for verb in shapes if verb in ('INSERT', 'UPDATE', 'DELETE'))
+        return {
+            'requests': requests,
+            'reads': shapes.count('SELECT'),
+            'writes': writes,
+            'writes_per_cart_change': writes / max(1, options['visitors'] * options['adds']),
+        }
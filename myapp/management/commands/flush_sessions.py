@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp import sessions
+
+
+class Command(BaseCommand):
+    help = "Copy sessions changed in the cache to the database (myapp.sessions write-behind)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float,
+                            help="Keep running and flush every N seconds instead of once.")
+        parser.add_argument('--all', action='store_true',
+                            help="Also write the interval still open (use before stopping the cache).")
+
+    def handle(self, *args, **options):
+        if settings.SESSION_ENGINE != sessions.__name__:
+            self.stdout.write(f"SESSION_ENGINE is {settings.SESSION_ENGINE}; sessions are already in the database.")
+            return
+        while True:
+            written = sessions.flush(include_current=options['all'])
+            if written or not options['every']:
+                self.stdout.write(f"Wrote {written} session(s) to the database.")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
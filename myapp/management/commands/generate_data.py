@@ -0,0 +1,309 @@
+import argparse
+import contextlib
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from multiprocessing import get_context
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Permission, User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from myapp import sales, search
+from myapp.models import (Cart, CartItem, CartOrder, Invoice, Product, ProductImage, ProductReview,
+                          ProductVariant, Profile, SellerAnalytics, WishlistItem)
+from myapp.versioning import bump_catalog_version
+
+from .bench_search import ADJECTIVES, BRANDS, CATEGORIES, MODEL_NAMES, NOUNS
+
+VARIANTS = [('Size', ['S', 'M', 'L', 'XL']), ('Color', ['Black', 'White', 'Blue', 'Red']),
+            ('Storage', ['64GB', '128GB', '256GB'])]
+RATING_WEIGHTS = [4, 6, 15, 35, 40]  # 1..5 stars, skewed positive like real catalogs
+ORDER_STATUSES = ['packed', 'shipped', 'delivered', 'delivered']
+SELLER_PERMISSIONS = ['add_product', 'change_product', 'delete_product', 'view_cartorder']
+HISTORY_DAYS = 365
+
+# Fields whose auto_now/auto_now_add would overwrite the generated timestamps
+TIMESTAMP_FIELDS = [(CartOrder, 'ordered_date'), (Invoice, 'issued_at'), (ProductReview, 'created_at'),
+                    (ProductReview, 'updated_at'), (ProductImage, 'uploaded_at'), (WishlistItem, 'added_at'),
+                    (Cart, 'created_at'), (Cart, 'updated_at'), (CartItem, 'added_at')]
+
+
+@contextlib.contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the generated dates instead of stamping "now"."""
+    fields = [model._meta.get_field(name) for model, name in TIMESTAMP_FIELDS]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _rng(plan, phase, n):
+    # One generator per row, seeded from a string (which hashes
+    # deterministically), so row n is identical whatever the chunk size or
+    # number of worker processes.
+    return random.Random(f"{plan['seed']}:{phase}:{n}")
+
+
+def _past(plan, rng):
+    return plan['now'] - timedelta(seconds=rng.randrange(HISTORY_DAYS * 86400))
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise argparse.ArgumentTypeError(f"not an ISO 8601 date and time: {value!r}")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def _customer_id(plan, index):
+    return plan['user_base'] + plan['sellers'] + index
+
+
+def _product_price(plan, product_index):
+    return Decimal(_rng(plan, 'price', product_index).randint(99, 99_999))
+
+
+# --- PHASES ---
+def generate_users(plan, start, stop):
+    """Sellers first, then customers, with their profiles, carts and seller analytics."""
+    users, profiles, carts, analytics, permissions = [], [], [], [], []
+    for n in range(start, stop):
+        user_id = plan['user_base'] + n
+        is_seller = n < plan['sellers']
+        username = f"{'seller' if is_seller else 'customer'}{user_id}"
+        users.append(User(id=user_id, username=username, email=f'{username}@example.com',
+                          password=plan['password'], is_staff=is_seller,
+                          first_name=username.title(), date_joined=plan['now']))
+        profiles.append(Profile(user_id=user_id, user_type='seller' if is_seller else 'customer',
+                                company_name=f'{username.title()} Traders' if is_seller else None))
+        if is_seller:
+            analytics.append(SellerAnalytics(seller_id=user_id))
+            permissions.extend(User.user_permissions.through(user_id=user_id, permission_id=permission_id)
+                               for permission_id in plan['seller_permissions'])
+        else:
+            carts.append(Cart(user_id=user_id, created_at=plan['now'], updated_at=plan['now']))
+    chunk = plan['chunk_size']
+    with transaction.atomic(), explicit_timestamps():
+        User.objects.bulk_create(users, batch_size=chunk)
+        Profile.objects.bulk_create(profiles, batch_size=chunk)
+        Cart.objects.bulk_create(carts, batch_size=chunk)
+        SellerAnalytics.objects.bulk_create(analytics, batch_size=chunk)
+        User.user_permissions.through.objects.bulk_create(permissions, batch_size=chunk)
+    return {'users': len(users)}
+
+
+def generate_products(plan, start, stop):
+    """Products with images, variants and reviews; rating rollups are filled in directly."""
+    products, images, variants, reviews = [], [], [], []
+    for n in range(start, stop):
+        rng = _rng(plan, 'products', n)
+        product_id = plan['product_base'] + n
+        created = _past(plan, rng)
+        product = Product(
+            id=product_id,
+            seller_id=plan['user_base'] + rng.randrange(plan['sellers']),
+            title=f"{rng.choice(ADJECTIVES).title()} {rng.choice(MODEL_NAMES).title()} {rng.choice(NOUNS).title()}",
+            brand=rng.choice(BRANDS),
+            price=_product_price(plan, n),
+            description=' '.join(rng.choices(ADJECTIVES + NOUNS + MODEL_NAMES, k=24)),
+            category=rng.choice(CATEGORIES),
+            image_url=f'https://picsum.photos/seed/p{product_id}/800/600',
+            stock_count=rng.randint(0, 500),
+            created_at=created,
+        )
+        for i in range(rng.randint(0, plan['images'])):
+            images.append(ProductImage(product_id=product_id, image_url=f'https://picsum.photos/seed/p{product_id}-{i}/800/600',
+                                       alt_text=product.title, is_primary=i == 0, uploaded_at=created))
+        for variant_type, values in rng.sample(VARIANTS, rng.randint(0, min(plan['variants'], len(VARIANTS)))):
+            for value in rng.sample(values, 2):
+                variants.append(ProductVariant(product_id=product_id, variant_type=variant_type, variant_value=value,
+                                               price_adjustment=rng.choice([0, 0, 50, 100, 250])))
+
+        stars = Counter()
+        review_count = min(rng.randint(0, 2 * plan['reviews']), plan['customers'])
+        for customer in rng.sample(range(plan['customers']), review_count):
+            rating = rng.choices(range(1, 6), RATING_WEIGHTS)[0]
+            stars[rating] += 1
+            reviewed = _past(plan, rng)
+            reviews.append(ProductReview(product_id=product_id, user_id=_customer_id(plan, customer), rating=rating,
+                                         title=f'{rating} star review', review_text=' '.join(rng.choices(NOUNS, k=12)),
+                                         verified_purchase=rng.random() < 0.6, created_at=reviewed,
+                                         updated_at=reviewed))
+        product.review_count = review_count
+        for rating in range(1, 6):
+            setattr(product, f'rating_{rating}_count', stars[rating])
+        if review_count:
+            product.avg_rating = (Decimal(sum(r * c for r, c in stars.items())) / review_count).quantize(
+                Decimal('0.01'), ROUND_HALF_UP)
+        products.append(product)
+
+    chunk = plan['chunk_size']
+    with transaction.atomic(), explicit_timestamps():
+        Product.objects.bulk_create(products, batch_size=chunk)
+        ProductImage.objects.bulk_create(images, batch_size=chunk)
+        ProductVariant.objects.bulk_create(variants, batch_size=chunk)
+        ProductReview.objects.bulk_create(reviews, batch_size=chunk)
+    return {'products': len(products), 'images': len(images), 'variants': len(variants), 'reviews': len(reviews)}
+
+
+def generate_activity(plan, start, stop):
+    """Per-customer wishlists, cart items, past orders and one consolidated invoice each."""
+    wishlist, cart_items, orders, invoices, invoice_orders = [], [], [], [], []
+    carts = dict(Cart.objects.filter(
+        user__gte=_customer_id(plan, start), user__lte=_customer_id(plan, stop - 1),
+    ).values_list('user_id', 'id'))
+    for n in range(start, stop):
+        rng = _rng(plan, 'activity', n)
+        user_id = _customer_id(plan, n)
+        for product in rng.sample(range(plan['products']), min(plan['wishlist'], plan['products'])):
+            wishlist.append(WishlistItem(user_id=user_id, product_id=plan['product_base'] + product,
+                                         added_at=_past(plan, rng)))
+        for product in rng.sample(range(plan['products']), min(plan['cart_items'], plan['products'])):
+            cart_items.append(CartItem(cart_id=carts[user_id], product_id=plan['product_base'] + product,
+                                       quantity=rng.randint(1, 3), added_at=plan['now']))
+        if not plan['orders']:
+            continue
+        invoice_id = plan['invoice_base'] + n
+        ordered = _past(plan, rng)
+        subtotal = Decimal(0)
+        for j in range(plan['orders']):
+            product = rng.randrange(plan['products'])
+            price, quantity = _product_price(plan, product), rng.randint(1, 3)
+            order_id = plan['order_base'] + n * plan['orders'] + j
+            orders.append(CartOrder(
+                id=order_id, user_id=user_id, product_id=plan['product_base'] + product,
+                product_name=f'Product {plan["product_base"] + product}', price=price, quantity=quantity,
+                ordered_date=ordered, status=rng.choice(ORDER_STATUSES), shipping_address='Generated address',
+                mobile='9000000000', payment_method=rng.choice(['cod', 'razorpay', 'upi_qr']),
+                payment_status='paid',
+            ))
+            invoice_orders.append(Invoice.orders.through(invoice_id=invoice_id, cartorder_id=order_id))
+            subtotal += price * quantity
+        invoices.append(Invoice(id=invoice_id, invoice_number=f'GEN{invoice_id}', subtotal=subtotal, total=subtotal,
+                                issued_at=ordered))
+
+    chunk = plan['chunk_size']
+    with transaction.atomic(), explicit_timestamps():
+        WishlistItem.objects.bulk_create(wishlist, batch_size=chunk)
+        CartItem.objects.bulk_create(cart_items, batch_size=chunk)
+        CartOrder.objects.bulk_create(orders, batch_size=chunk)
+        Invoice.objects.bulk_create(invoices, batch_size=chunk)
+        Invoice.orders.through.objects.bulk_create(invoice_orders, batch_size=chunk)
+    return {'wishlist': len(wishlist), 'cart_items': len(cart_items), 'orders': len(orders),
+            'invoices': len(invoices)}
+
+
+def _run_chunk(phase, plan, start, stop):
+    result = PHASES[phase](plan, start, stop)
+    connection.close()
+    return result
+
+
+PHASES = {'users': generate_users, 'products': generate_products, 'activity': generate_activity}
+
+
+class Command(BaseCommand):
+    help = ("Generate a deterministic synthetic dataset (sellers, customers, products with images, variants "
+            "and reviews, wishlists, carts, orders and invoices) with chunked bulk_create, optionally in "
+            "parallel processes. The same --seed and --now give the same rows, except that user, product, "
+            "order and invoice ids start after the highest id already in the database: identical ids need "
+            "the same starting database, e.g. an empty one.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=50)
+        parser.add_argument('--customers', type=int, default=5_000)
+        parser.add_argument('--products', type=int, default=20_000)
+        parser.add_argument('--reviews', type=int, default=5, help="Average reviews per product.")
+        parser.add_argument('--images', type=int, default=3, help="Maximum gallery images per product.")
+        parser.add_argument('--variants', type=int, default=2, help="Maximum variant types per product.")
+        parser.add_argument('--wishlist', type=int, default=3, help="Wishlist items per customer.")
+        parser.add_argument('--cart-items', type=int, default=2, help="Open cart items per customer.")
+        parser.add_argument('--orders', type=int, default=3, help="Past orders per customer.")
+        parser.add_argument('--chunk-size', type=int, default=5_000, help="Rows generated per chunk/transaction.")
+        parser.add_argument('--workers', type=int, default=1, help="Parallel generator processes.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--now', type=_datetime,
+                            help="ISO 8601 time the generated history ends at (default: the current time).")
+
+    def handle(self, *args, **options):
+        if options['sellers'] < 1 or options['products'] < 1:
+            raise CommandError("--sellers and --products must be at least 1.")
+        if options['workers'] > 1 and connection.vendor == 'sqlite':
+            self.stderr.write("SQLite serializes writers; extra workers mostly wait on the database lock.")
+
+        plan = self._plan(options)
+        started = time.perf_counter()
+        totals = Counter()
+        customer_chunks = max(1, options['chunk_size'] // max(1, options['orders'] + options['wishlist']
+                                                              + options['cart_items']))
+        product_chunks = max(1, options['chunk_size'] // max(1, 1 + options['reviews'] + options['images']))
+        for phase, count, step in (('users', plan['sellers'] + plan['customers'], options['chunk_size']),
+                                   ('products', plan['products'], product_chunks),
+                                   ('activity', plan['customers'], customer_chunks)):
+            totals.update(self._run_phase(phase, plan, count, step, options['workers']))
+            self.stdout.write(f"{phase}: done after {time.perf_counter() - started:.1f}s")
+
+        self._finish()
+        summary = ', '.join(f'{n} {name}' for name, n in sorted(totals.items()))
+        self.stdout.write(self.style.SUCCESS(f"Generated {summary} in {time.perf_counter() - started:.1f}s"))
+
+    def _plan(self, options):
+        def base(model):
+            return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+        return {
+            'seed': options['seed'],
+            'now': (options['now'] or timezone.now()).replace(microsecond=0),
+            'chunk_size': options['chunk_size'],
+            'sellers': options['sellers'],
+            'customers': options['customers'],
+            'products': options['products'],
+            **{key: options[key] for key in ('reviews', 'images', 'variants', 'wishlist', 'cart_items', 'orders')},
+            'user_base': base(User),
+            'product_base': base(Product),
+            'order_base': base(CartOrder),
+            'invoice_base': base(Invoice),
+            # Hashing is deliberately slow; every generated account shares one hash, salted from the seed
+            'password': make_password('password', salt=f"generated{options['seed']}"),
+            'seller_permissions': list(Permission.objects.filter(
+                content_type__app_label='myapp', codename__in=SELLER_PERMISSIONS).values_list('id', flat=True)),
+        }
+
+    def _run_phase(self, phase, plan, count, step, workers):
+        ranges = [(start, min(start + step, count)) for start in range(0, count, step)]
+        totals = Counter()
+        if workers <= 1:
+            for start, stop in ranges:
+                totals.update(PHASES[phase](plan, start, stop))
+            return totals
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('fork')) as pool:
+            for result in pool.map(_run_chunk, [phase] * len(ranges), [plan] * len(ranges),
+                                   *zip(*ranges)):
+                totals.update(result)
+        return totals
+
+    def _finish(self):
+        # Rows were inserted with explicit ids; move the sequences past them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Product, CartOrder, Invoice]):
+                cursor.execute(sql)
+        # bulk_create skips the model signals that maintain these
+        search.rebuild_index()
+        sales.rebuild_all()
+        bump_catalog_version()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from myapp import sales
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-product daily sales rollups and every seller's SellerAnalytics totals from the orders."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1_000,
+                            help="Products (and then sellers) rebuilt per transaction (default: 1000).")
+
+    def handle(self, *args, **options):
+        rows, sellers = sales.rebuild_all(max(1, options['chunk_size']))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} sales rollups and refreshed {sellers} sellers."))
@@ -0,0 +1,75 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from myapp import invoices
+from myapp.models import Invoice
+
+
+def _render_chunk(invoice_ids, force):
+    """Store the PDFs for ``invoice_ids``; returns ``(rendered, skipped)``."""
+    rendered = skipped = 0
+    for invoice in Invoice.objects.filter(id__in=invoice_ids).prefetch_related('orders'):
+        if force:
+            invoice.pdf_sha256 = ''
+        if invoices.stored_invoice_pdf(invoice):
+            rendered += 1
+        else:
+            skipped += 1
+    return rendered, skipped
+
+
+def _run_chunk(invoice_ids, force):
+    result = _render_chunk(invoice_ids, force)
+    connection.close()
+    return result
+
+
+class Command(BaseCommand):
+    help = "Pre-render historical invoices into the content-addressed invoice PDF store."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help="Parallel rendering processes (default: one per CPU).")
+        parser.add_argument('--chunk-size', type=int, default=100, help="Invoices handed to a worker at a time.")
+        parser.add_argument('--force', action='store_true',
+                            help="Re-check every invoice, not only those without a stored PDF.")
+
+    def handle(self, *args, **options):
+        if invoices.PDF_RENDERER is None:
+            raise CommandError("No PDF renderer installed (install WeasyPrint or xhtml2pdf).")
+        queryset = Invoice.objects.order_by('id')
+        if not options['force']:
+            queryset = queryset.filter(pdf_sha256='')
+        ids = list(queryset.values_list('id', flat=True))
+        step = max(1, options['chunk_size'])
+        chunks = [ids[start:start + step] for start in range(0, len(ids), step)]
+        started = time.perf_counter()
+        rendered = skipped = 0
+
+        # PDF rendering is CPU-bound, so parallelism comes from processes rather than threads
+        if options['workers'] <= 1:
+            results = (_render_chunk(chunk, options['force']) for chunk in chunks)
+            pool = None
+        else:
+            # Forked workers must not share the parent's database connection
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=options['workers'], mp_context=get_context('fork'))
+            results = pool.map(_run_chunk, chunks, [options['force']] * len(chunks))
+        try:
+            for done, (chunk_rendered, chunk_skipped) in enumerate(results, 1):
+                rendered += chunk_rendered
+                skipped += chunk_skipped
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{done}/{len(chunks)} chunks")
+        finally:
+            if pool:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored PDFs for {rendered} invoice(s), {skipped} failed to render, "
+            f"in {time.perf_counter() - started:.1f}s."))
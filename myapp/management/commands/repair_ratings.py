@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from myapp import ratings
+from myapp.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored review rollups (avg_rating, review_count, histogram) for every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10_000,
+                            help="Products updated per transaction (default: 10000).")
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        last_id = Product.objects.aggregate(last=Max('id'))['last'] or 0
+        updated = 0
+        # Walk the primary key in fixed ranges so each UPDATE is a short
+        # transaction that holds row locks on at most ``chunk_size`` products.
+        for start in range(0, last_id + 1, chunk_size):
+            with transaction.atomic():
+                updated += ratings.recompute(Product.objects.filter(id__gte=start, id__lt=start + chunk_size))
+        self.stdout.write(self.style.SUCCESS(f"Recomputed ratings for {updated} products."))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, NotSupportedError, connections
+
+from myapp import db_routers
+
+
+class Command(BaseCommand):
+    help = ("Copy the SQLite primary over a SQLite replica alias every --lag seconds, so the replica "
+            "trails the primary like a lagging streaming replica (run the server with SQLITE_REPLICA=1).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', default='replica', help="Database alias to copy into.")
+        parser.add_argument('--lag', type=float, default=3.0, help="Seconds between copies.")
+        parser.add_argument('--once', action='store_true', help="Copy once and exit.")
+
+    def handle(self, *args, **options):
+        if options['replica'] not in connections.settings or options['replica'] == DEFAULT_DB_ALIAS:
+            raise CommandError(f"No replica alias {options['replica']!r}; set SQLITE_REPLICA=1.")
+        while True:
+            try:
+                db_routers.replicate(DEFAULT_DB_ALIAS, options['replica'])
+            except NotSupportedError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f"Replicated {DEFAULT_DB_ALIAS} -> {options['replica']}")
+            if options['once']:
+                return
+            time.sleep(options['lag'])
@@ -0,0 +1,123 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import Sum
+from django.test.utils import override_settings
+
+from myapp import inventory
+from myapp.benchmarks import isolated_database
+from myapp.models import CartItem, Product, StockReservation
+
+
+class Command(BaseCommand):
+    help = ("Hammer one SKU from many threads (hold, checkout, abandon, sweep) and verify that no unit "
+            "is ever oversold or lost.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32)
+        parser.add_argument('--stock', type=int, default=2000, help="Units of the SKU at the start.")
+        parser.add_argument('--abandon', type=float, default=0.2,
+                            help="Share of carts abandoned with their hold left for the sweeper.")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        # Threads need a file-backed copy so each gets its own connection to the same database;
+        # a zero TTL makes every hold immediately sweepable, the worst case for races
+        with tempfile.TemporaryDirectory() as tmp, \
+                isolated_database(test_name=os.path.join(tmp, 'stress_inventory.sqlite3')), \
+                override_settings(STOCK_RESERVATION_TTL=0):
+            product = Product.objects.create(title='Contended SKU', brand='PatilApx', price=1, description='',
+                                             category='tech', image_url='https://example.com/sku.jpg',
+                                             stock_count=options['stock'])
+            users = [User.objects.create_user(f'stress{n}', '', None) for n in range(options['threads'])]
+            connections.close_all()
+
+            stats = Counter()
+            lock = threading.Lock()
+            running = threading.Event()
+            running.set()
+            start = threading.Barrier(options['threads'] + 1)
+
+            def shopper(user, rng):
+                try:
+                    start.wait()
+                    local = Counter()
+                    while True:
+                        quantity = rng.randint(1, 3)
+                        item = CartItem.objects.create(cart_id=user.cart.id, product=product, quantity=quantity)
+                        held = inventory.hold(item)
+                        if rng.random() < options['abandon']:
+                            # Walk away: the hold stays behind for the sweeper
+                            item.delete()
+                            local['abandoned'] += 1
+                            continue
+                        try:
+                            with transaction.atomic():
+                                inventory.commit(user, [(product.id, None, quantity)])
+                                CartItem.objects.filter(id=item.id).delete()
+                            local['sold'] += quantity
+                            local['checkouts'] += 1
+                        except inventory.OutOfStock:
+                            inventory.release([item])
+                            item.delete()
+                            local['rejected'] += 1
+                            if not held:
+                                break
+                    with lock:
+                        stats.update(local)
+                except OperationalError as exc:
+                    with lock:
+                        stats['errors'] += 1
+                    self.stderr.write(f"{user.username}: {exc}")
+                finally:
+                    connections.close_all()
+
+            def sweeper():
+                try:
+                    while running.is_set():
+                        released = inventory.sweep()
+                        with lock:
+                            stats['swept'] += released
+                        time.sleep(0.01)
+                finally:
+                    connections.close_all()
+
+            workers = [threading.Thread(target=shopper, args=(user, random.Random(options['seed'] + n)))
+                       for n, user in enumerate(users)]
+            sweep_thread = threading.Thread(target=sweeper)
+            for thread in workers:
+                thread.start()
+            sweep_thread.start()
+            start.wait()
+            started = time.perf_counter()
+            for thread in workers:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            running.clear()
+            sweep_thread.join()
+            stats['swept'] += inventory.sweep()
+
+            product.refresh_from_db()
+            # With a zero TTL the final sweep returns every hold, so this should be 0
+            held = StockReservation.objects.aggregate(units=Sum('quantity'))['units'] or 0
+            operations = stats['checkouts'] + stats['rejected'] + stats['abandoned']
+            self.stdout.write(
+                f"{options['threads']} threads, {operations} cart operations in {elapsed:.1f}s "
+                f"({operations / elapsed:.0f}/s): sold={stats['sold']} checkouts={stats['checkouts']} "
+                f"rejected={stats['rejected']} abandoned={stats['abandoned']} swept={stats['swept']} "
+                f"errors={stats['errors']}"
+            )
+            self.stdout.write(f"stock left={product.stock_count} still held={held}")
+            if stats['errors']:
+                raise CommandError(f"{stats['errors']} shopper thread(s) failed")
+            if stats['sold'] + product.stock_count + held != options['stock'] or stats['sold'] > options['stock']:
+                raise CommandError(f"Stock accounting is off: sold {stats['sold']} + left {product.stock_count} "
+                                   f"+ held {held} != {options['stock']}")
+            self.stdout.write(self.style.SUCCESS("No unit oversold or lost."))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import inventory
+
+
+class Command(BaseCommand):
+    help = "Return expired cart stock reservations to stock."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--every', type=float,
+                            help="Keep running and sweep every N seconds instead of once.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Holds released per transaction.")
+
+    def handle(self, *args, **options):
+        while True:
+            released = inventory.sweep(batch_size=max(1, options['batch_size']))
+            if released or not options['every']:
+                self.stdout.write(f"Released {released} expired reservation(s).")
+            if not options['every']:
+                return
+            time.sleep(options['every'])
@@ -0,0 +1,36 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from myapp import jobs
+
+
+class Command(BaseCommand):
+    help = "Run background jobs (invoice emails, etc.) from the database queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help='Queue to work (repeatable); defaults to every registered queue.')
+        parser.add_argument('--concurrency', type=int, default=2, help='Jobs run at once by this worker.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when no job is due.')
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due instead of polling.')
+        parser.add_argument('--max-jobs', type=int, help='Exit after this many jobs (lets a supervisor recycle the process).')
+
+    def handle(self, *args, **options):
+        worker = jobs.Worker(
+            queues=options['queues'],
+            concurrency=max(1, options['concurrency']),
+            poll_interval=options['poll_interval'],
+        )
+
+        def shutdown(signum, frame):
+            self.stdout.write('Finishing running jobs, then exiting...')
+            worker.stop()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        self.stdout.write(f"Worker {worker.name} on queues {', '.join(worker.queues)} "
+                          f"(concurrency {worker.concurrency})")
+        processed = worker.run(burst=options['burst'], max_jobs=options['max_jobs'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} job(s)'))
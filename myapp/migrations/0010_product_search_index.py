@@ -0,0 +1,63 @@
+# Full-text search index for Product (see myapp/search.py).
+
+from django.db import migrations, OperationalError
+
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE myapp_product ADD COLUMN search_document tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(brand, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX myapp_product_search_gin ON myapp_product USING gin (search_document)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS myapp_product_search_gin",
+    "ALTER TABLE myapp_product DROP COLUMN IF EXISTS search_document",
+]
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE myapp_product_fts USING fts5(title, brand, description, tokenize='porter unicode61')",
+    "INSERT INTO myapp_product_fts (rowid, title, brand, description) SELECT id, title, brand, description FROM myapp_product",
+]
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS myapp_product_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for sql in POSTGRES_FORWARD:
+            schema_editor.execute(sql)
+    elif vendor == 'sqlite':
+        try:
+            for sql in SQLITE_FORWARD:
+                schema_editor.execute(sql)
+        except OperationalError:
+            # SQLite built without FTS5: search falls back to icontains.
+            pass
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        for sql in POSTGRES_BACKWARD:
+            schema_editor.execute(sql)
+    elif vendor == 'sqlite':
+        for sql in SQLITE_BACKWARD:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_cartorder_payment_method_cartorder_payment_status_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Avg, Count, DecimalField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Round
+
+
+def backfill_ratings(apps, schema_editor):
+    Product = apps.get_model('myapp', 'Product')
+    ProductReview = apps.get_model('myapp', 'ProductReview')
+    reviews = ProductReview.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+    def count(condition=None):
+        return Coalesce(Subquery(reviews.annotate(n=Count('id', filter=condition)).values('n')), Value(0))
+
+    updates = {
+        'review_count': count(),
+        'avg_rating': Coalesce(Subquery(reviews.annotate(avg=Round(Avg('rating'), 2)).values('avg')), Value(0),
+                               output_field=DecimalField(max_digits=3, decimal_places=2)),
+    }
+    for stars in range(1, 6):
+        updates[f'rating_{stars}_count'] = count(Q(rating=stars))
+    Product.objects.filter(id__in=ProductReview.objects.values('product')).update(**updates)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_product_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='avg_rating',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=3),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['avg_rating', 'id'], name='product_rating_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['review_count', 'id'], name='product_reviews_id_idx'),
+        ),
+        migrations.RunPython(backfill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:20
+
+from collections import Counter
+
+from django.db import migrations
+
+
+def fold_pending_orders(apps, schema_editor):
+    """Move un-invoiced pending CartOrder rows (the old cart) into each user's Cart."""
+    Cart = apps.get_model('myapp', 'Cart')
+    CartItem = apps.get_model('myapp', 'CartItem')
+    CartOrder = apps.get_model('myapp', 'CartOrder')
+    pending = CartOrder.objects.filter(status='pending', product__isnull=False, invoices__isnull=True)
+    wanted, folded = Counter(), []
+    for order_id, user_id, product_id, quantity in pending.values_list('id', 'user_id', 'product_id', 'quantity'):
+        wanted[(user_id, product_id)] += quantity
+        folded.append(order_id)
+    if not wanted:
+        return
+    user_ids = {user_id for user_id, _product_id in wanted}
+    existing_carts = set(Cart.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids - existing_carts])
+    cart_ids = dict(Cart.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+    existing = {}
+    for item in CartItem.objects.filter(cart_id__in=cart_ids.values(), variant__isnull=True):
+        existing[(item.cart_id, item.product_id)] = item
+    new_items = []
+    for (user_id, product_id), quantity in wanted.items():
+        item = existing.get((cart_ids[user_id], product_id))
+        if item:
+            item.quantity += quantity
+        else:
+            new_items.append(CartItem(cart_id=cart_ids[user_id], product_id=product_id, quantity=quantity))
+    CartItem.objects.bulk_update(existing.values(), ['quantity'])
+    CartItem.objects.bulk_create(new_items)
+    CartOrder.objects.filter(id__in=folded).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.RunPython(fold_pending_orders, migrations.RunPython.noop),
+    ]
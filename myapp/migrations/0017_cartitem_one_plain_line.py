@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+def merge_duplicate_plain_lines(apps, schema_editor):
+    """Fold repeated variant-less lines of one product into the oldest line of the cart."""
+    CartItem = apps.get_model('myapp', 'CartItem')
+    keep, grown, extra = {}, {}, []
+    for item in CartItem.objects.filter(variant__isnull=True).order_by('id'):
+        first = keep.setdefault((item.cart_id, item.product_id), item)
+        if first is not item:
+            first.quantity += item.quantity
+            grown[first.id] = first
+            extra.append(item.id)
+    if extra:
+        # Holds of the dropped lines lose their item and are returned by sweep_reservations
+        CartItem.objects.bulk_update(grown.values(), ['quantity'])
+        CartItem.objects.filter(id__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_fold_pending_orders_into_carts'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_plain_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(condition=models.Q(('variant__isnull', True)), fields=('cart', 'product'), name='cartitem_one_plain_line'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+from myapp.db_operations import AddForeignIndexConcurrently, AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    atomic = False
+
+    dependencies = [
+        ('myapp', '0018_seller_sales_rollups'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='cartorder',
+            index=models.Index(fields=['user', 'status', 'ordered_date'], name='cartorder_user_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cartorder',
+            index=models.Index(fields=['user', 'product', 'status'], name='cartorder_user_product_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cartorder',
+            index=models.Index(fields=['user', 'ordered_date', 'id'], name='cartorder_user_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cartorder',
+            index=models.Index(condition=models.Q(('payment_status', 'pending')), fields=['user', 'ordered_date'], name='cartorder_unpaid_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cartorder',
+            index=models.Index(condition=models.Q(('transaction_id__isnull', False)), fields=['transaction_id', 'user'], name='cartorder_txn_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='cartorder',
+            index=models.Index(fields=['product', 'ordered_date'], name='cartorder_product_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='invoice',
+            index=models.Index(fields=['issued_at', 'id'], name='invoice_issued_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stock_count__gt', 0)), fields=['created_at', 'id'], name='product_instock_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stock_count__gt', 0)), fields=['price', 'id'], name='product_instock_price_idx'),
+        ),
+        # login_user looks accounts up by email
+        AddForeignIndexConcurrently(
+            app_label='auth',
+            model_name='user',
+            index=models.Index(fields=['email'], name='auth_user_email_idx'),
+        ),
+    ]
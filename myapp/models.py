@@ -4,6 +4,7 @@ from django.contrib.contenttypes.models import ContentType
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.functional import cached_property
 
 # --- 1. USER PROFILE ---
 class Profile(models.Model):
@@ -37,6 +38,29 @@ class Product(models.Model):
     image_url = models.URLField(max_length=500)
     stock_count = models.PositiveIntegerField(default=10)
     created_at = models.DateTimeField(default=timezone.now)
+    # Review rollups, maintained by myapp.ratings (repair: manage.py repair_ratings)
+    avg_rating = models.DecimalField(max_digits=3, decimal_places=2, default=0)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (sort key, id) for each listing sort
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['category', 'created_at', 'id'], name='product_cat_created_id_idx'),
+            models.Index(fields=['avg_rating', 'id'], name='product_rating_id_idx'),
+            models.Index(fields=['review_count', 'id'], name='product_reviews_id_idx'),
+            # The "in stock only" listing filter; out-of-stock rows stay out of these
+            models.Index(fields=['created_at', 'id'], condition=models.Q(stock_count__gt=0),
+                         name='product_instock_created_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(stock_count__gt=0),
+                         name='product_instock_price_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -46,6 +70,16 @@ class Product(models.Model):
         """Check if product is in stock"""
         return self.stock_count > 0
 
+    @property
+    def rating_histogram(self):
+        """Star breakdown (5 down to 1) with the share of reviews for each."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}_count')
+            percent = round(100 * count / self.review_count) if self.review_count else 0
+            histogram.append({'stars': stars, 'count': count, 'percent': percent})
+        return histogram
+
 # --- 3. CART ORDER MODEL ---
 class CartOrder(models.Model):
     STATUS_CHOICES = [
@@ -77,6 +111,24 @@ class CartOrder(models.Model):
     payment_status = models.CharField(max_length=20, choices=PAYMENT_STATUS_CHOICES, default='pending')
     transaction_id = models.CharField(max_length=100, blank=True, null=True, help_text="UTR or transaction ID from payment")
 
+    class Meta:
+        indexes = [
+            # A customer's orders by status (order success page)
+            models.Index(fields=['user', 'status', 'ordered_date'], name='cartorder_user_status_idx'),
+            # Verified-purchase check before a review
+            models.Index(fields=['user', 'product', 'status'], name='cartorder_user_product_idx'),
+            # Customer dashboard pages, newest first
+            models.Index(fields=['user', 'ordered_date', 'id'], name='cartorder_user_date_idx'),
+            # Orders still awaiting payment
+            models.Index(fields=['user', 'ordered_date'], condition=models.Q(payment_status='pending'),
+                         name='cartorder_unpaid_idx'),
+            # Payment callbacks look orders up by gateway id; most orders have none
+            models.Index(fields=['transaction_id', 'user'], condition=models.Q(transaction_id__isnull=False),
+                         name='cartorder_txn_idx'),
+            # A product's orders by day: seller sales rollups (myapp/sales.py)
+            models.Index(fields=['product', 'ordered_date'], name='cartorder_product_date_idx'),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} - {self.user.username} (x{self.quantity})"
 
@@ -134,6 +186,14 @@ class ProductReview(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.product.title} ({self.rating}★)"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the Product rollups currently count for this review,
+        # so myapp.ratings can apply an edit as a delta without re-reading it
+        instance._counted_as = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+
 # --- 7. WISHLIST ---
 class WishlistItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="wishlist")
@@ -176,21 +236,23 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart for {self.user.username}"
 
+    @cached_property
+    def pricing(self):
+        """Lines, subtotal, discount and total from one query (``del cart.pricing`` to recompute)."""
+        from .pricing import price_cart
+        return price_cart(self)
+
     @property
     def subtotal(self):
-        return sum(item.total_price for item in self.items.all())
+        return self.pricing.subtotal
 
     @property
     def discount_amount(self):
-        if self.coupon and self.coupon.is_valid():
-            if self.coupon.discount_flat:
-                return self.coupon.discount_flat
-            return (self.subtotal * self.coupon.discount_percentage) / 100
-        return 0
+        return self.pricing.discount
 
     @property
     def total(self):
-        return max(0, self.subtotal - self.discount_amount)
+        return self.pricing.total
 
 # --- 10. CART ITEMS ---
 class CartItem(models.Model):
@@ -202,16 +264,30 @@ class CartItem(models.Model):
 
     class Meta:
         unique_together = ('cart', 'product', 'variant')
+        constraints = [
+            # NULLs never collide in unique_together, so lines without a variant
+            # need their own index; it is also the conflict target of the
+            # guest-cart merge upsert in carts.py
+            models.UniqueConstraint(fields=['cart', 'product'], condition=models.Q(variant__isnull=True),
+                                    name='cartitem_one_plain_line'),
+        ]
 
     def __str__(self):
         return f"{self.product.title} x{self.quantity}"
 
     @property
-    def total_price(self):
+    def unit_price(self):
         base_price = self.product.price
         if self.variant:
             base_price += self.variant.price_adjustment
-        return base_price * self.quantity
+        return base_price
+
+    @property
+    def total_price(self):
+        if 'line_total' in self.__dict__:
+            # Annotated by pricing.price_cart
+            return self.line_total
+        return self.unit_price * self.quantity
 
 # --- 11. REFUND REQUEST ---
 class RefundRequest(models.Model):
@@ -248,9 +324,18 @@ class Invoice(models.Model):
     orders = models.ManyToManyField(CartOrder, related_name="invoices", blank=True)
     invoice_number = models.CharField(max_length=50, unique=True)
     subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    # Cart coupon taken off the subtotal at checkout
+    discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     tax = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     issued_at = models.DateTimeField(auto_now_add=True)
+    # SHA-256 of the rendered PDF in the invoice store (myapp/invoices.py); blank until first rendered
+    pdf_sha256 = models.CharField(max_length=64, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['issued_at', 'id'], name='invoice_issued_id_idx'),
+        ]
 
     def __str__(self):
         return self.invoice_number
@@ -302,6 +387,73 @@ class ContactMessage(models.Model):
     def __str__(self):
         return f"Message from {self.name}"
 
+# --- 17. BACKGROUND JOB QUEUE (see myapp/jobs.py) ---
+class Job(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    queue = models.CharField(max_length=50, default='default')
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    # Visibility timeout: a running job whose lock has expired is handed to another worker
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['queue', 'status', 'run_at'], name='job_claim_idx'),
+            models.Index(fields=['task', 'status', 'locked_until'], name='job_running_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+# --- 18. STOCK RESERVATIONS (see myapp/inventory.py) ---
+class StockReservation(models.Model):
+    """Units taken out of stock_count while a cart line waits for checkout."""
+    # SET_NULL: a hold outlives its cart line until the sweeper returns it to stock
+    item = models.OneToOneField(CartItem, on_delete=models.SET_NULL, null=True, blank=True, related_name="reservation")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="reservations")
+    variant = models.ForeignKey(ProductVariant, on_delete=models.CASCADE, null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} held until {self.expires_at:%Y-%m-%d %H:%M}"
+
+# --- 19. SELLER SALES ROLLUPS (see myapp/sales.py) ---
+class SellerSalesRollup(models.Model):
+    """One product's sales on one day (TIME_ZONE), counted from its sold CartOrder rows."""
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sales_rollups")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="sales_rollups")
+    day = models.DateField()
+    revenue = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    units = models.PositiveIntegerField(default=0)
+    orders = models.PositiveIntegerField(default=0)
+    customers = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='salesrollup_product_day'),
+        ]
+        indexes = [
+            # The dashboard's reads: one seller, a range of days
+            models.Index(fields=['seller', 'day'], name='salesrollup_seller_day'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} on {self.day}: {self.units} units"
+
 # --- 5. SIGNALS (The "Glue") ---
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
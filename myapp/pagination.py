@@ -0,0 +1,147 @@
+"""Keyset ("cursor") pagination for the product listings.
+
+Instead of ``OFFSET n`` the next page is fetched with a ``WHERE`` clause
+that seeks past the last row already shown, e.g. for newest-first::
+
+    WHERE created_at < :last_created OR (created_at = :last_created AND id < :last_id)
+    ORDER BY created_at DESC, id DESC LIMIT 25
+
+With a matching ``(created_at, id)`` index that is an index seek, so page
+500 costs the same as page 1. ``id`` is always the final sort key so rows
+with equal sort values never repeat or go missing between pages.
+
+Cursors are signed with ``SECRET_KEY`` so they stay opaque to the client
+and can't be forged into arbitrary filters.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.db.models import Q
+
+CURSOR_SALT = 'myapp.pagination'
+DEFAULT_PER_PAGE = 24
+
+
+class Page:
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return ['dt', value.isoformat()]
+    if isinstance(value, Decimal):
+        return ['dec', str(value)]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        kind, raw = value
+        return datetime.fromisoformat(raw) if kind == 'dt' else Decimal(raw)
+    return value
+
+
+def encode_cursor(payload):
+    return signing.dumps(payload, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    """Return the cursor payload, or ``None`` for a missing or tampered cursor."""
+    if not cursor:
+        return None
+    try:
+        return signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+
+
+def _with_tiebreak(ordering):
+    """Append ``id`` (in the direction of the last key) unless already present."""
+    ordering = list(ordering)
+    if not ordering or ordering[-1][0] != 'id':
+        ordering.append(('id', ordering[-1][1] if ordering else True))
+    return ordering
+
+
+def _order_by(ordering, reverse=False):
+    return [('-' if descending != reverse else '') + field for field, descending in ordering]
+
+
+def _seek(ordering, values, reverse=False):
+    """``Q`` for "strictly after ``values``" in ``ordering`` (before, if ``reverse``)."""
+    condition = Q()
+    for position, (field, descending) in enumerate(ordering):
+        lookup = 'lt' if descending != reverse else 'gt'
+        step = Q(**{f'{field}__{lookup}': values[position]})
+        for earlier, (earlier_field, _descending) in enumerate(ordering[:position]):
+            step &= Q(**{earlier_field: values[earlier]})
+        condition |= step
+    return condition
+
+
+def _key_values(obj, ordering):
+    return [_encode_value(getattr(obj, field)) for field, _ in ordering]
+
+
+def paginate(queryset, ordering, cursor=None, per_page=DEFAULT_PER_PAGE):
+    """Return one :class:`Page` of ``queryset`` in ``ordering``.
+
+    ``ordering`` is a list of ``(field, descending)`` pairs; fields may be
+    annotations. Pass ``ordering=None`` to keep the queryset's own order
+    (used for relevance-ranked search results, which are bounded in size
+    and paged by offset instead).
+    """
+    payload = decode_cursor(cursor) or {}
+    if ordering is None:
+        return _paginate_by_offset(queryset, payload, per_page)
+
+    ordering = _with_tiebreak(ordering)
+    sort_key = _order_by(ordering)
+    backwards = payload.get('d') == 'prev'
+    values = [_decode_value(v) for v in payload.get('v', [])]
+    if payload.get('k') != sort_key or len(values) != len(ordering):
+        # Cursor from another sort order (or none at all): start at page one
+        values, backwards = [], False
+
+    rows = queryset.order_by(*_order_by(ordering, reverse=backwards))
+    if values:
+        rows = rows.filter(_seek(ordering, values, reverse=backwards))
+    rows = list(rows[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    next_cursor = previous_cursor = None
+    if rows:
+        if has_more or backwards:
+            next_cursor = encode_cursor({'k': sort_key, 'v': _key_values(rows[-1], ordering), 'd': 'next'})
+        if values and (has_more or not backwards):
+            previous_cursor = encode_cursor({'k': sort_key, 'v': _key_values(rows[0], ordering), 'd': 'prev'})
+    return Page(rows, next_cursor, previous_cursor)
+
+
+def _paginate_by_offset(queryset, payload, per_page):
+    offset = max(0, int(payload.get('o', 0) or 0))
+    rows = list(queryset[offset:offset + per_page + 1])
+    next_cursor = encode_cursor({'o': offset + per_page}) if len(rows) > per_page else None
+    previous_cursor = encode_cursor({'o': max(0, offset - per_page)}) if offset else None
+    return Page(rows[:per_page], next_cursor, previous_cursor)
@@ -0,0 +1,66 @@
+"""Cart pricing computed by the database in a single query.
+
+:func:`price_cart` fetches a cart's lines with their product, variant and the
+cart's coupon joined in. Each line is annotated with ``line_total``, which is
+(product price + variant adjustment) x quantity. A window ``SUM`` over those
+lines puts the subtotal on every row, so pricing a cart costs one query
+whatever its size. ``Cart.subtotal``/``discount_amount``/``total`` and the cart
+views all read from it.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value, Window
+from django.db.models.functions import Coalesce
+
+from .models import CartItem
+
+CENT = Decimal('0.01')
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def line_total_expression():
+    unit_price = F('product__price') + Coalesce(F('variant__price_adjustment'), Value(Decimal('0')), output_field=MONEY)
+    return ExpressionWrapper(unit_price * F('quantity'), output_field=MONEY)
+
+
+def coupon_discount(coupon, subtotal):
+    """Discount ``coupon`` gives on ``subtotal``: flat amounts are capped at the subtotal."""
+    if not coupon or not coupon.is_valid() or not subtotal:
+        return Decimal('0')
+    if coupon.max_uses is not None and coupon.used_count >= coupon.max_uses:
+        return Decimal('0')
+    if coupon.discount_flat:
+        return min(coupon.discount_flat, subtotal)
+    return (subtotal * coupon.discount_percentage / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def split_discount(discount, amounts):
+    """``discount`` shared out over ``amounts`` in proportion; the shares add up to it exactly."""
+    total = sum(amounts, Decimal('0'))
+    if not discount or not total:
+        return [Decimal('0')] * len(amounts)
+    shares = [(discount * amount / total).quantize(CENT, rounding=ROUND_HALF_UP) for amount in amounts[:-1]]
+    return shares + [discount - sum(shares, Decimal('0'))]
+
+
+class CartPricing:
+    def __init__(self, items, subtotal, coupon):
+        self.items = items
+        self.subtotal = subtotal
+        self.coupon = coupon
+        self.discount = coupon_discount(coupon, subtotal)
+        self.total = max(Decimal('0'), subtotal - self.discount)
+
+
+def price_cart(cart):
+    """Lines (annotated with ``line_total``), subtotal, discount and total for ``cart``."""
+    items = list(
+        CartItem.objects.filter(cart=cart)
+        .select_related('product', 'variant', 'cart__coupon')
+        .annotate(line_total=line_total_expression())
+        .annotate(cart_subtotal=Window(Sum('line_total'), output_field=MONEY))
+        .order_by('added_at', 'id')
+    )
+    if not items:
+        return CartPricing([], Decimal('0'), None)
+    return CartPricing(items, items[0].cart_subtotal, items[0].cart.coupon)
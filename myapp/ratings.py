@@ -0,0 +1,106 @@
+"""Review rollups stored on ``Product``.
+
+``avg_rating``, ``review_count`` and the ``rating_N_count`` histogram are
+kept current by the ``ProductReview`` signals below. Every review change is
+applied as a delta in a single ``UPDATE ... SET col = col + 1`` statement,
+so concurrent reviews on the same product never lose an update and nothing
+re-aggregates the reviews table on the read path.
+
+Bulk changes that bypass model signals (``QuerySet.update``, raw SQL,
+fixtures loaded without signals) can be reconciled with
+``manage.py repair_ratings``, which recomputes the columns set-based.
+"""
+from django.db import transaction
+from django.db.models import Avg, Case, Count, DecimalField, F, FloatField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product, ProductReview
+
+STARS = range(1, 6)
+AVERAGE_FIELD = DecimalField(max_digits=3, decimal_places=2)
+
+
+def _weighted_total():
+    """Sum of all star ratings, read from the histogram columns."""
+    total = F('rating_1_count')
+    for stars in STARS[1:]:
+        total = total + F(f'rating_{stars}_count') * stars
+    return total
+
+
+def apply_deltas(product_id, deltas):
+    """Add ``deltas`` (``{stars: +n/-n}``) to one product's rollups in one statement.
+
+    Every right-hand side is evaluated against the row as it was before the
+    UPDATE, so the new average is derived from the old histogram plus the
+    delta rather than from the half-updated row.
+    """
+    deltas = {stars: delta for stars, delta in deltas.items() if delta and stars in STARS}
+    if not deltas:
+        return
+    count_delta = sum(deltas.values())
+    weighted_delta = sum(stars * delta for stars, delta in deltas.items())
+
+    updates = {
+        f'rating_{stars}_count': Greatest(F(f'rating_{stars}_count') + delta, Value(0))
+        for stars, delta in deltas.items()
+    }
+    new_count = F('review_count') + count_delta
+    if count_delta:
+        updates['review_count'] = Greatest(new_count, Value(0))
+    updates['avg_rating'] = Case(
+        When(review_count__lte=-count_delta, then=Value(0)),
+        default=Round(Cast(_weighted_total() + weighted_delta, FloatField()) / Cast(new_count, FloatField()), 2),
+        output_field=AVERAGE_FIELD,
+    )
+    Product.objects.filter(pk=product_id).update(**updates)
+
+
+def recompute(queryset=None):
+    """Recompute the rollups for ``queryset`` (default: every product) in one UPDATE."""
+    reviews = ProductReview.objects.filter(product=OuterRef('pk')).order_by().values('product')
+
+    def count(condition=None):
+        return Coalesce(Subquery(reviews.annotate(n=Count('id', filter=condition)).values('n')), Value(0))
+
+    updates = {
+        'review_count': count(),
+        'avg_rating': Coalesce(
+            Subquery(reviews.annotate(avg=Round(Avg('rating'), 2)).values('avg')),
+            Value(0), output_field=AVERAGE_FIELD,
+        ),
+    }
+    for stars in STARS:
+        updates[f'rating_{stars}_count'] = count(Q(rating=stars))
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.update(**updates)
+
+
+@receiver(post_save, sender=ProductReview)
+def count_review(sender, instance, created, **kwargs):
+    current = (instance.product_id, instance.rating)
+    previous = None if created else getattr(instance, '_counted_as', None)
+    if previous == current:
+        return
+
+    with transaction.atomic():
+        if not created and previous is None:
+            # Saved from an instance that wasn't loaded from the database, so
+            # we can't know what it replaced: recount this product instead
+            recompute(Product.objects.filter(pk=instance.product_id))
+        elif previous and previous[0] == instance.product_id:
+            apply_deltas(instance.product_id, {previous[1]: -1, instance.rating: +1})
+        else:
+            if previous:
+                apply_deltas(previous[0], {previous[1]: -1})
+            apply_deltas(instance.product_id, {instance.rating: +1})
+    instance._counted_as = current
+
+
+@receiver(post_delete, sender=ProductReview)
+def uncount_review(sender, instance, **kwargs):
+    product_id, rating = getattr(instance, '_counted_as', (instance.product_id, instance.rating))
+    apply_deltas(product_id, {rating: -1})
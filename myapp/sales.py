@@ -0,0 +1,205 @@
+"""Per-seller sales rollups.
+
+``SellerSalesRollup`` holds one row per product and day (in ``TIME_ZONE``)
+with the revenue, units, order lines and distinct customers of the sold
+``CartOrder`` rows, i.e. every status but ``pending``. The seller dashboard
+and ``SellerAnalytics`` read these rows instead of the orders.
+
+The rows are kept current as orders are written. Checkout bulk-creates its
+orders, which skips model signals, so it calls :func:`record`; the
+``CartOrder`` signals below cover orders saved or deleted one at a time,
+such as status changes in the admin. Either way each touched (product, day)
+is recomputed from its orders in one grouped query and upserted, which keeps
+the distinct customer count exact and makes a repeated refresh harmless. The
+sellers' ``SellerAnalytics`` sales and order totals are then recomputed from
+the rollups in one ``UPDATE``. A refresh costs the same handful of statements
+however many lines or sellers a checkout has.
+
+A refresh first locks the touched products' rows until the transaction
+commits. Otherwise two checkouts of one product would each aggregate without
+the other's uncommitted orders, and the later upsert would overwrite the
+counts with its partial totals. Once a refresh holds the lock, every earlier
+refresh of those products has committed, and its aggregate sees their orders.
+
+Changes that bypass the signals (``QuerySet.update``, raw SQL, bulk loads, a
+product moving to another seller) are reconciled with ``manage.py
+rebuild_sales_rollups``, which rebuilds in product id ranges. It also
+recounts the sellers' distinct customers, which checkouts leave alone
+because the count scans all of a seller's orders.
+"""
+from datetime import datetime, time, timedelta
+from functools import reduce
+from operator import or_
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import CartOrder, Product, SellerAnalytics, SellerSalesRollup
+
+SOLD_STATUSES = ('packed', 'shipped', 'delivered')
+# Saving any other CartOrder field leaves the rollups as they were
+COUNTED_FIELDS = {'product', 'user', 'price', 'quantity', 'status', 'ordered_date'}
+MONEY_FIELD = DecimalField(max_digits=15, decimal_places=2)
+ROLLUP_FIELDS = ['seller', 'revenue', 'units', 'orders', 'customers']
+
+
+def sold_orders():
+    return CartOrder.objects.filter(status__in=SOLD_STATUSES, product__seller__isnull=False)
+
+
+def order_day(order):
+    """The rollup day of ``order``, matching ``TruncDate`` in the current time zone."""
+    return timezone.localtime(order.ordered_date).date()
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def aggregate(orders):
+    """Unsaved ``SellerSalesRollup`` rows for ``orders``, one per product and day."""
+    rows = (orders.annotate(day=TruncDate('ordered_date'))
+            .values('product_id', 'product__seller_id', 'day')
+            .annotate(revenue=Sum(F('price') * F('quantity'), output_field=MONEY_FIELD),
+                      units=Sum('quantity'), orders=Count('id'), customers=Count('user_id', distinct=True))
+            .order_by())
+    return [SellerSalesRollup(seller_id=row['product__seller_id'], product_id=row['product_id'], day=row['day'],
+                              revenue=row['revenue'], units=row['units'], orders=row['orders'],
+                              customers=row['customers'])
+            for row in rows]
+
+
+def _upsert(rows):
+    SellerSalesRollup.objects.bulk_create(rows, update_conflicts=True, unique_fields=['product', 'day'],
+                                          update_fields=ROLLUP_FIELDS, batch_size=1000)
+
+
+def refresh(keys):
+    """Recompute the rollups of ``keys`` (``(product_id, day)`` pairs) and their sellers' totals."""
+    keys = {(product_id, day) for product_id, day in keys if product_id is not None}
+    if not keys:
+        return
+    product_ids = {product_id for product_id, _day in keys}
+    days = {day for _product_id, day in keys}
+    with transaction.atomic(savepoint=False):
+        if connection.features.has_select_for_update:
+            # Held until commit; in id order, so two refreshes cannot deadlock
+            list(Product.objects.select_for_update().filter(id__in=product_ids).order_by('id')
+                 .values_list('id', flat=True))
+        # A plain range on ordered_date, so the cartorder_product_date_idx index can serve it
+        orders = sold_orders().filter(product_id__in=product_ids, ordered_date__gte=_day_start(min(days)),
+                                      ordered_date__lt=_day_start(max(days) + timedelta(days=1)))
+        rows = [row for row in aggregate(orders) if (row.product_id, row.day) in keys]
+        sellers = {row.seller_id for row in rows}
+        emptied = keys - {(row.product_id, row.day) for row in rows}
+        if emptied:
+            # Every order of these days was cancelled back to pending or deleted
+            stale = SellerSalesRollup.objects.filter(
+                reduce(or_, (Q(product_id=product_id, day=day) for product_id, day in emptied)))
+            sellers.update(stale.values_list('seller_id', flat=True))
+            stale.delete()
+        if rows:
+            _upsert(rows)
+        refresh_analytics(sellers)
+
+
+def record(orders):
+    """Count freshly created ``orders`` (e.g. from ``bulk_create``) in the rollups."""
+    refresh({(order.product_id, order_day(order)) for order in orders if order.status in SOLD_STATUSES})
+
+
+def refresh_analytics(seller_ids, customers=False):
+    """Recompute ``SellerAnalytics`` sales totals of ``seller_ids`` in one ``UPDATE``.
+
+    Sales and order counts are summed from the rollups, so their cost does
+    not grow with the sellers' order history. Distinct customers cannot be
+    added up across products and days; only with ``customers`` are they
+    counted from all of the seller's sold orders. Sellers get their
+    ``SellerAnalytics`` row with their seller profile; :func:`rebuild_all`
+    creates any that are missing.
+    """
+    seller_ids = sorted(seller_ids)
+    if not seller_ids:
+        return 0
+    rollups = SellerSalesRollup.objects.filter(seller=OuterRef('seller')).order_by().values('seller')
+    totals = {
+        'total_sales': Coalesce(Subquery(rollups.annotate(total=Sum('revenue')).values('total')), Value(0),
+                                output_field=MONEY_FIELD),
+        'total_orders': Coalesce(Subquery(rollups.annotate(total=Sum('orders')).values('total')), Value(0),
+                                 output_field=IntegerField()),
+    }
+    if customers:
+        distinct = (sold_orders().filter(product__seller=OuterRef('seller')).order_by().values('product__seller')
+                    .annotate(n=Count('user_id', distinct=True)).values('n'))
+        totals['total_customers'] = Coalesce(Subquery(distinct), Value(0), output_field=IntegerField())
+    return SellerAnalytics.objects.filter(seller_id__in=seller_ids).update(**totals, last_updated=timezone.now())
+
+
+def rebuild(products=None):
+    """Rebuild the rollups of ``products`` (default: every product) from their orders.
+
+    Returns the number of rollup rows written. Sellers' analytics are not
+    refreshed here; see :func:`refresh_analytics`.
+    """
+    if products is None:
+        products = Product.objects.all()
+    SellerSalesRollup.objects.filter(product__in=products).delete()
+    rows = aggregate(sold_orders().filter(product__in=products))
+    SellerSalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_all(chunk_size=1000):
+    """Rebuild every rollup, then every seller's totals and customers; returns ``(rows, sellers)``.
+
+    Walks the primary keys in fixed ranges so each transaction locks at most
+    ``chunk_size`` products or sellers.
+    """
+    rows = 0
+    last_product = Product.objects.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_product + 1, chunk_size):
+        with transaction.atomic():
+            rows += rebuild(Product.objects.filter(id__gte=start, id__lt=start + chunk_size))
+    sellers = User.objects.filter(profile__user_type='seller')
+    refreshed = 0
+    last_seller = sellers.aggregate(last=Max('id'))['last'] or 0
+    for start in range(0, last_seller + 1, chunk_size):
+        chunk = list(sellers.filter(id__gte=start, id__lt=start + chunk_size).values_list('id', flat=True))
+        with transaction.atomic():
+            SellerAnalytics.objects.bulk_create([SellerAnalytics(seller_id=seller_id) for seller_id in chunk],
+                                                ignore_conflicts=True)
+            refreshed += refresh_analytics(chunk, customers=True)
+    return rows, refreshed
+
+
+def daily(seller, since):
+    """``[{'day', 'revenue', 'units', 'orders'}]`` for ``seller`` from ``since`` on, oldest first."""
+    return list(SellerSalesRollup.objects.filter(seller=seller, day__gte=since).values('day')
+                .annotate(revenue=Sum('revenue'), units=Sum('units'), orders=Sum('orders')).order_by('day'))
+
+
+def top_products(seller, since, limit=5):
+    """``seller``'s best-selling products by revenue from ``since`` on."""
+    return list(SellerSalesRollup.objects.filter(seller=seller, day__gte=since)
+                .values('product_id', 'product__title')
+                .annotate(revenue=Sum('revenue'), units=Sum('units')).order_by('-revenue', 'product_id')[:limit])
+
+
+@receiver(post_save, sender=CartOrder)
+def count_order(sender, instance, created, update_fields=None, **kwargs):
+    if created and instance.status not in SOLD_STATUSES:
+        return
+    if update_fields is not None and not COUNTED_FIELDS & set(update_fields):
+        return
+    refresh([(instance.product_id, order_day(instance))])
+
+
+@receiver(post_delete, sender=CartOrder)
+def uncount_order(sender, instance, **kwargs):
+    if instance.status in SOLD_STATUSES:
+        refresh([(instance.product_id, order_day(instance))])
@@ -0,0 +1,152 @@
+"""Ranked full-text search over the product catalog.
+
+PostgreSQL keeps a generated ``search_document`` tsvector column on
+``myapp_product`` behind a GIN index, so it never needs to be refreshed by
+hand. SQLite keeps a separate FTS5 table (``myapp_product_fts``) that the
+``Product`` signals at the bottom of this module keep in sync. Any other
+database (or a SQLite build without FTS5) falls back to the old
+``icontains`` scan so search keeps working, just unranked.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Product
+
+FTS_TABLE = 'myapp_product_fts'
+SEARCH_CONFIG = 'english'
+
+# Column weights: a hit in the title beats a hit in the brand, which beats
+# a hit somewhere in the description.
+SQLITE_WEIGHTS = (10.0, 5.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Per-process cache of "does this database have the FTS5 table?"
+_fts_available = {}
+
+
+def _tokens(query):
+    return _TOKEN_RE.findall((query or '').lower())
+
+
+def _sqlite_match(query):
+    """Build a safe FTS5 MATCH expression; the last term is a prefix match."""
+    terms = _tokens(query)
+    if not terms:
+        return ''
+    quoted = ['"%s"' % term for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def backend():
+    """Return the search backend in use for the default database."""
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite' and has_fts_table():
+        return 'sqlite'
+    return 'fallback'
+
+
+def has_fts_table():
+    db_name = str(connection.settings_dict['NAME'])
+    if db_name not in _fts_available:
+        with connection.cursor() as cursor:
+            _fts_available[db_name] = FTS_TABLE in connection.introspection.table_names(cursor)
+    return _fts_available[db_name]
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` to products matching ``query``.
+
+    Matching rows are annotated with ``search_rank`` (higher is better) and
+    ordered by it, with ``id`` as a stable tie-breaker.
+    """
+    engine = backend()
+    if engine == 'postgresql':
+        if not _tokens(query):
+            return queryset.none()
+        tsquery = "websearch_to_tsquery('%s', %%s)" % SEARCH_CONFIG
+        return queryset.filter(
+            RawSQL('myapp_product.search_document @@ ' + tsquery, [query], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL('ts_rank_cd(myapp_product.search_document, ' + tsquery + ')', [query],
+                               output_field=FloatField())
+        ).order_by('-search_rank', 'id')
+
+    if engine == 'sqlite':
+        match = _sqlite_match(query)
+        if not match:
+            return queryset.none()
+        # Join the FTS table on rowid so SQLite drives the query from the
+        # MATCH and scores each hit once. bm25() is "lower is better", so it
+        # is negated to keep a single sort direction across backends.
+        weights = ', '.join(str(w) for w in SQLITE_WEIGHTS)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=['%s.rowid = myapp_product.id' % FTS_TABLE, '%s MATCH %%s' % FTS_TABLE],
+            params=[match],
+            select={'search_rank': '-bm25(%s, %s)' % (FTS_TABLE, weights)},
+        ).order_by('-search_rank', 'id')
+
+    if not query:
+        return queryset.none()
+    return queryset.filter(
+        Q(title__icontains=query) | Q(brand__icontains=query) | Q(description__icontains=query)
+    ).order_by('-created_at', 'id')
+
+
+def ranked_product_ids(query, limit=50):
+    """Return up to ``limit`` product IDs for ``query``, best match first."""
+    return list(search_products(Product.objects.all(), query).values_list('id', flat=True)[:limit])
+
+
+# --- INDEX MAINTENANCE ---
+def index_product(product):
+    if connection.vendor != 'sqlite' or not has_fts_table():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product.pk])
+        cursor.execute(
+            'INSERT INTO %s (rowid, title, brand, description) VALUES (%%s, %%s, %%s, %%s)' % FTS_TABLE,
+            [product.pk, product.title, product.brand, product.description],
+        )
+
+
+def unindex_product(product_id):
+    if connection.vendor != 'sqlite' or not has_fts_table():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % FTS_TABLE, [product_id])
+
+
+def rebuild_index():
+    """Re-populate the SQLite FTS table from ``myapp_product`` in one statement.
+
+    Needed after ``bulk_create``/``QuerySet.update`` imports, which bypass the
+    model signals. PostgreSQL's generated column never needs rebuilding.
+    """
+    _fts_available.clear()
+    if connection.vendor != 'sqlite' or not has_fts_table():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM %s' % FTS_TABLE)
+        cursor.execute(
+            'INSERT INTO {table} (rowid, title, brand, description) '
+            'SELECT id, title, brand, description FROM myapp_product'.format(table=FTS_TABLE)
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    unindex_product(instance.pk)
@@ -0,0 +1,290 @@
+"""Cache-first session engine with coalesced write-behind to the database.
+
+``SESSION_ENGINE = 'myapp.sessions'``. Sessions live in the
+``SESSION_CACHE_ALIAS`` cache. A save writes only the cache and marks the
+session dirty in the current ``SESSION_FLUSH_INTERVAL`` bucket. :func:`flush`
+then copies each dirty session's latest data to ``django_session`` with one
+bulk upsert per batch. However often a visitor's session changes within an
+interval, the database sees at most one write for it.
+
+The first save after an interval closes runs the flush inline, and a cache
+lock makes sure only one request per interval does so. ``manage.py
+flush_sessions`` covers quiet periods and shutdown. Cache misses, such as
+evictions or a cache restart, fall back to the database copy, so the worst
+case loses the changes of the last unflushed interval. Deleting a session
+(logout, key rotation) removes it from both stores at once, and leaves a
+short-lived tombstone so a flush that read the session just before cannot
+write it back.
+
+Concurrent requests of one visitor do not lose updates. ``save`` merges the
+keys this request changed into the latest cached copy while holding a
+per-session cache lock. :meth:`SessionStore.update_value` does a locked
+read-modify-write of one key for values that two requests may both change,
+such as the guest cart.
+
+The lock and the dirty marks rely on the cache's ``add()`` and ``incr()``
+being atomic, as they are on Redis, Memcached and (within one process)
+locmem. The file and database caches read and then write. With them two
+sessions saved at once could take the same dirty slot, and one would never
+reach the database. The engine therefore refuses them with
+``ImproperlyConfigured``; the settings fall back to Django's ``cached_db``
+engine when there is no Redis.
+"""
+import logging
+import secrets
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+from django.core.cache.backends.db import DatabaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+logger = logging.getLogger('myapp.sessions')
+
+KEY_PREFIX = 'myapp.sessions:'
+DEFAULT_FLUSH_INTERVAL = 30
+# Closed buckets a flush still looks at; older dirty marks have expired
+BACKLOG_BUCKETS = 20
+FLUSH_BATCH_SIZE = 500
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 2.0
+# Outlives any flush that read a session before it was deleted
+TOMBSTONE_TIMEOUT = 300
+# Their add() and incr() are not atomic
+UNSAFE_CACHES = (FileBasedCache, DatabaseCache)
+
+
+def session_cache():
+    alias = getattr(settings, 'SESSION_CACHE_ALIAS', 'default')
+    cache = caches[alias]
+    if isinstance(cache, UNSAFE_CACHES):
+        raise ImproperlyConfigured(
+            f"myapp.sessions needs atomic add()/incr(); the {alias!r} cache is a {type(cache).__name__}. "
+            "Use Redis, or SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'.")
+    return cache
+
+
+def flush_interval():
+    return getattr(settings, 'SESSION_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+
+
+def _bucket(now=None):
+    return int((time.time() if now is None else now) // flush_interval())
+
+
+def _marks_timeout():
+    return flush_interval() * (BACKLOG_BUCKETS + 2)
+
+
+@contextmanager
+def _locked(cache, key):
+    """Hold ``key``'s cache lock; after ``LOCK_WAIT`` seconds carry on without it."""
+    lock_key, token = f'{KEY_PREFIX}lock:{key}', secrets.token_hex(8)
+    deadline = time.monotonic() + LOCK_WAIT
+    locked = cache.add(lock_key, token, LOCK_TIMEOUT)
+    while not locked and time.monotonic() < deadline:
+        time.sleep(0.002)
+        locked = cache.add(lock_key, token, LOCK_TIMEOUT)
+    if not locked:
+        logger.warning('Session %s: lock wait timed out, writing unlocked', key[:8])
+    try:
+        yield
+    finally:
+        if locked and cache.get(lock_key) == token:
+            cache.delete(lock_key)
+
+
+def mark_dirty(session_key, cache=None):
+    """Queue ``session_key`` for the flush of the current interval (once per interval)."""
+    cache = cache or session_cache()
+    bucket = _bucket()
+    timeout = _marks_timeout()
+    if cache.add(f'{KEY_PREFIX}dirty:{bucket}:{session_key}', 1, timeout):
+        counter = f'{KEY_PREFIX}dirty:{bucket}'
+        cache.add(counter, 0, timeout)
+        cache.set(f'{counter}#{cache.incr(counter)}', session_key, timeout)
+
+
+def _dirty_keys(cache, bucket):
+    counter = f'{KEY_PREFIX}dirty:{bucket}'
+    count = cache.get(counter) or 0
+    return list(dict.fromkeys(cache.get_many([f'{counter}#{n}' for n in range(1, count + 1)]).values()))
+
+
+def _tombstone(session_key):
+    return f'{KEY_PREFIX}deleted:{session_key}'
+
+
+def _write(cache, session_keys):
+    """Upsert the cached copies of ``session_keys`` into the database; returns rows written."""
+    model = DBStore.get_model_class()
+    written = 0
+    for start in range(0, len(session_keys), FLUSH_BATCH_SIZE):
+        batch = session_keys[start:start + FLUSH_BATCH_SIZE]
+        stored = cache.get_many([KEY_PREFIX + key for key in batch])
+        rows = [model(session_key=key[len(KEY_PREFIX):], session_data=data, expire_date=expire_date)
+                for key, (data, expire_date) in stored.items()]
+        if not rows:
+            continue
+        model.objects.bulk_create(rows, update_conflicts=True, unique_fields=['session_key'],
+                                  update_fields=['session_data', 'expire_date'])
+        # A session deleted since the read above may have just been written back
+        tombstones = cache.get_many([_tombstone(row.session_key) for row in rows])
+        deleted = [row.session_key for row in rows if _tombstone(row.session_key) in tombstones]
+        if deleted:
+            model.objects.filter(session_key__in=deleted).delete()
+        written += len(rows) - len(deleted)
+    return written
+
+
+def flush(include_current=False, cache=None):
+    """Write every session dirtied in a closed interval to the database; returns rows written.
+
+    ``include_current`` also writes the open interval, without marking it
+    done, so it is written again when it closes.
+    """
+    cache = cache or session_cache()
+    current = _bucket()
+    last = cache.get(f'{KEY_PREFIX}flushed')
+    first = current - BACKLOG_BUCKETS if last is None else max(last + 1, current - BACKLOG_BUCKETS)
+    written = 0
+    for bucket in range(first, current):
+        written += _write(cache, _dirty_keys(cache, bucket))
+        cache.set(f'{KEY_PREFIX}flushed', bucket, None)
+    if include_current:
+        written += _write(cache, _dirty_keys(cache, current))
+    return written
+
+
+def maybe_flush(cache=None):
+    """Flush closed intervals, unless some request already did so this interval."""
+    cache = cache or session_cache()
+    if cache.get(f'{KEY_PREFIX}flushed') == _bucket() - 1:
+        return 0
+    if not cache.add(f'{KEY_PREFIX}flushing', 1, flush_interval()):
+        return 0
+    try:
+        return flush(cache=cache)
+    finally:
+        cache.delete(f'{KEY_PREFIX}flushing')
+
+
+class SessionStore(DBStore):
+    def __init__(self, session_key=None):
+        self._cache = session_cache()
+        # What was loaded, to tell this request's changes from other requests'
+        self._snapshot = {}
+        super().__init__(session_key)
+
+    def _cache_key(self, session_key=None):
+        return KEY_PREFIX + (session_key or self._get_or_create_session_key())
+
+    def _stored(self, data):
+        """What the cache holds: the encoded session and its expiry."""
+        expiry = data.get('_session_expiry')
+        return self.encode(data), self.get_expiry_date(expiry=expiry)
+
+    def _timeout(self, data):
+        return self.get_expiry_age(expiry=data.get('_session_expiry'))
+
+    def _read(self):
+        stored = self._cache.get(self._cache_key())
+        if stored is None:
+            row = self._get_session_from_db()
+            if row is None:
+                return None
+            stored = (row.session_data, row.expire_date)
+            self._cache.set(self._cache_key(), stored, max(0, (row.expire_date - timezone.now()).total_seconds()))
+        if stored[1] <= timezone.now():
+            return None
+        return stored
+
+    def load(self):
+        stored = self._read() if self.session_key else None
+        if stored is None:
+            self._session_key = None
+            self._snapshot = {}
+            return {}
+        self._snapshot = self.decode(stored[0])
+        return self.decode(stored[0])
+
+    def exists(self, session_key):
+        return self._cache.has_key(self._cache_key(session_key)) or super().exists(session_key)
+
+    def _merge(self, latest):
+        """Apply the keys this request set or deleted to ``latest``, the current stored copy."""
+        for key, value in self._session.items():
+            if key not in self._snapshot or self._snapshot[key] != value:
+                latest[key] = value
+        for key in self._snapshot.keys() - self._session.keys():
+            latest.pop(key, None)
+        return latest
+
+    def _put(self, data):
+        self._cache.set(self._cache_key(), self._stored(data), self._timeout(data))
+        self._session_cache = data
+        self._snapshot = self.decode(self.encode(data))
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        if must_create:
+            data = self._get_session(no_load=True)
+            if not self._cache.add(self._cache_key(), self._stored(data), self._timeout(data)):
+                raise CreateError
+            self._snapshot = self.decode(self.encode(data))
+        else:
+            with _locked(self._cache, self.session_key):
+                stored = self._cache.get(self._cache_key())
+                self._put(self._merge(self.decode(stored[0]) if stored else {}))
+        mark_dirty(self.session_key, self._cache)
+        maybe_flush(self._cache)
+
+    def update_value(self, key, change):
+        """Atomically set ``self[key] = change(current)``; a ``None`` result deletes the key.
+
+        ``current`` is read from the cache under the session lock, so
+        concurrent requests of one visitor each apply their change on top of
+        the other's. Returns the new value.
+        """
+        if self.session_key is None or not self._cache.has_key(self._cache_key()):
+            value = change(self.get(key))
+            self._set_or_pop(self._session, key, value)
+            self.modified = True
+            return value
+        with _locked(self._cache, self.session_key):
+            stored = self._cache.get(self._cache_key())
+            latest = self._merge(self.decode(stored[0]) if stored else {})
+            value = change(latest.get(key))
+            self._set_or_pop(latest, key, value)
+            self._put(latest)
+        mark_dirty(self.session_key, self._cache)
+        return value
+
+    @staticmethod
+    def _set_or_pop(data, key, value):
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self._cache.set(_tombstone(session_key), 1, TOMBSTONE_TIMEOUT)
+        self._cache.delete(self._cache_key(session_key))
+        self.model.objects.filter(session_key=session_key).delete()
+
+    # The shop runs under WSGI; the async API just wraps the sync one
+    aload = sync_to_async(load)
+    aexists = sync_to_async(exists)
+    asave = sync_to_async(save)
+    adelete = sync_to_async(delete)
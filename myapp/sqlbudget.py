@@ -0,0 +1,124 @@
+"""Per-request SQL instrumentation.
+
+``SQLBudgetMiddleware`` wraps every database connection for the duration of
+a request and records the number of queries, the total time spent in the
+database and how often each query *shape* (the SQL with literals and
+``IN (...)`` lists collapsed) was repeated. A shape that repeats many times
+in one request is almost always an N+1: a relation touched per row instead
+of being fetched with ``select_related``/``prefetch_related``.
+
+Every request gets a ``myapp.sqlbudget`` log line; it is logged as a
+warning when the view exceeds its budget or repeats a query shape. With
+``SQL_BUDGET_HEADERS`` on (the default when ``DEBUG`` is on) the numbers
+are also sent as ``X-DB-*`` response headers.
+
+Views declare a budget with :func:`query_budget`; undecorated views fall
+back to ``SQL_BUDGET_DEFAULT``. The route-walking test in ``myapp/tests.py``
+uses the same recorder to fail the build on regressions.
+"""
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('myapp.sqlbudget')
+
+DEFAULT_BUDGET = 20
+DEFAULT_REPEAT_THRESHOLD = 5
+
+_IN_LIST_RE = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def query_shape(sql):
+    """Normalise ``sql`` so queries that differ only by their values compare equal."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('IN (...)', sql)
+
+
+def query_budget(limit):
+    """Declare the maximum number of queries a view may run per request."""
+    def decorator(view_func):
+        view_func.query_budget = limit
+        return view_func
+    return decorator
+
+
+def budget_for(view_func):
+    default = getattr(settings, 'SQL_BUDGET_DEFAULT', DEFAULT_BUDGET)
+    return getattr(view_func, 'query_budget', default)
+
+
+class QueryRecorder:
+    """``execute_wrapper`` that records the shape and duration of each query."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((query_shape(sql), time.perf_counter() - start))
+
+    @contextmanager
+    def capture(self):
+        """Record queries on every configured database alias."""
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def total_time(self):
+        return sum(duration for _shape, duration in self.queries)
+
+    def repeated(self, threshold=None):
+        """``[(shape, times)]`` for shapes run at least ``threshold`` times."""
+        if threshold is None:
+            threshold = getattr(settings, 'SQL_BUDGET_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)
+        counts = Counter(shape for shape, _duration in self.queries)
+        return [(shape, times) for shape, times in counts.most_common() if times >= threshold]
+
+
+class SQLBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.send_headers = getattr(settings, 'SQL_BUDGET_HEADERS', settings.DEBUG)
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.capture():
+            response = self.get_response(request)
+
+        budget = getattr(request, '_query_budget', None)
+        repeated = recorder.repeated()
+        over_budget = budget is not None and recorder.count > budget
+        if self.send_headers:
+            response['X-DB-Query-Count'] = str(recorder.count)
+            response['X-DB-Time-Ms'] = '%.1f' % (recorder.total_time * 1000)
+            response['X-DB-Repeated-Queries'] = str(sum(times for _shape, times in repeated))
+            if budget is not None:
+                response['X-DB-Query-Budget'] = str(budget)
+
+        level = logging.WARNING if over_budget or repeated else logging.INFO
+        logger.log(
+            level, '%s %s status=%s queries=%d budget=%s db_ms=%.1f repeated=%s',
+            request.method, request.path, response.status_code, recorder.count, budget,
+            recorder.total_time * 1000, '; '.join(f'{times}x {shape[:120]}' for shape, times in repeated) or '-',
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = budget_for(view_func)
@@ -0,0 +1,34 @@
+// Header search suggestions (served by /autocomplete/)
+(function () {
+    const input = document.querySelector("[data-autocomplete-url]");
+    if (!input) return;
+
+    const list = document.getElementById(input.getAttribute("list"));
+    const url = input.dataset.autocompleteUrl;
+    let timer = null;
+    let controller = null;
+
+    input.addEventListener("input", () => {
+        clearTimeout(timer);
+        const query = input.value.trim();
+        if (!query) {
+            list.innerHTML = "";
+            return;
+        }
+        timer = setTimeout(() => {
+            if (controller) controller.abort();
+            controller = new AbortController();
+            fetch(`${url}?q=${encodeURIComponent(query)}`, { signal: controller.signal })
+                .then((response) => response.json())
+                .then((data) => {
+                    list.innerHTML = "";
+                    data.suggestions.forEach((suggestion) => {
+                        const option = document.createElement("option");
+                        option.value = suggestion.text;
+                        list.appendChild(option);
+                    });
+                })
+                .catch(() => {});
+        }, 120);
+    });
+})();
@@ -0,0 +1,28 @@
+"""Background tasks run by ``manage.py worker`` (see myapp/jobs.py)."""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import EmailMessage
+
+from . import jobs
+from .invoices import invoice_attachment
+from .models import Invoice
+
+
+@jobs.task(queue='mail', timeout=120, concurrency=4, backoff=60)
+def send_invoice_email(user_id, invoice_ids):
+    """Render the checkout's invoices and email them to the customer."""
+    # A missing row fails the attempt, so the job is retried rather than mailed short
+    user = User.objects.get(id=user_id)
+    if not user.email:
+        return
+    invoices = list(Invoice.objects.filter(id__in=invoice_ids).prefetch_related('orders').order_by('id'))
+    missing = set(invoice_ids) - {invoice.id for invoice in invoices}
+    if missing:
+        raise Invoice.DoesNotExist(f"Invoice(s) {sorted(missing)} not found")
+    subject = f"Your Invoice(s) from {getattr(settings, 'DEFAULT_FROM_EMAIL', 'Our Store')}"
+    body = "Thank you for your order. Attached are your invoice(s)."
+    email = EmailMessage(subject=subject, body=body, from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None), to=[user.email])
+    for invoice in invoices:
+        email.attach(*invoice_attachment(invoice))
+    # Let SMTP errors propagate so the job is retried with backoff
+    email.send()
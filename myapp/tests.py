@@ -1,8 +1,33 @@
-from django.test import TestCase, Client
+import re
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.test import (TestCase, TransactionTestCase, Client, RequestFactory, override_settings,
+                         skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from django.urls import reverse
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.sessions.models import Session
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.urls import URLPattern, reverse
+from django.utils import timezone
 
-from .models import CartOrder, Product
+from . import (autocomplete, cache_backends, carts, db_routers, explain, facets, inventory, invoices, jobs,
+               pagination, ratings, sales, search, layout, sessions, sqlbudget, tasks, urls)
+from .models import (Cart, CartItem, CartOrder, Coupon, Invoice, Job, Product, ProductImage, ProductReview,
+                     ProductVariant, SellerAnalytics, SellerSalesRollup, StockReservation, WishlistItem)
 
 
 class AdminLoginTest(TestCase):
@@ -51,7 +76,7 @@ class SessionCartTest(TestCase):
         self.assertFalse(CartOrder.objects.exists())
         self.assertNotIn('guest_cart', self.client.session)
 
-    def test_login_merges_session_cart_into_pending_orders(self):
+    def test_login_merges_session_cart_into_the_database_cart(self):
         session = self.client.session
         session['guest_cart'] = {str(self.product.id): 3}
         session.save()
@@ -63,11 +88,1097 @@ class SessionCartTest(TestCase):
 
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.headers['Location'], '/')
-        order = CartOrder.objects.get(user=self.user, product=self.product, status='pending')
-        self.assertEqual(order.quantity, 3)
+        item = CartItem.objects.get(cart__user=self.user, product=self.product)
+        self.assertEqual(item.quantity, 3)
+        self.assertFalse(CartOrder.objects.exists())
         self.assertNotIn('guest_cart', self.client.session)
 
     def test_checkout_redirects_anonymous_user_to_auth(self):
         response = self.client.get(reverse('checkout'), secure=True)
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.headers['Location'], reverse('auth'))
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        defaults = {'price': '10.00', 'category': 'tech', 'image_url': 'https://example.com/p.jpg'}
+        self.title_hit = Product.objects.create(title='Wireless Speaker', brand='Lumen',
+                                                description='Loud and clear.', **defaults)
+        self.description_hit = Product.objects.create(title='Desk Lamp', brand='Lumen',
+                                                      description='Pairs with any wireless dock.', **defaults)
+        Product.objects.create(title='Linen Shirt', brand='PatilApx', description='Breathable.', **defaults)
+
+    def test_results_are_ranked_by_relevance(self):
+        self.assertEqual(search.ranked_product_ids('wireless'), [self.title_hit.id, self.description_hit.id])
+
+    def test_index_follows_product_saves_and_deletes(self):
+        self.title_hit.title = 'Bluetooth Speaker'
+        self.title_hit.save()
+        self.assertEqual(search.ranked_product_ids('bluetooth'), [self.title_hit.id])
+
+        self.description_hit.delete()
+        self.assertEqual(search.ranked_product_ids('dock'), [])
+
+    def test_product_list_uses_search_backend(self):
+        response = self.client.get(reverse('product_list'), {'search': 'wirel'}, secure=True)
+        self.assertEqual(list(response.context['products']), [self.title_hit, self.description_hit])
+        self.assertEqual(response.context['sort_by'], 'relevance')
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        defaults = {'price': '10.00', 'category': 'tech', 'image_url': 'https://example.com/p.jpg',
+                    'description': 'x'}
+        self.speaker = Product.objects.create(title='Wireless Speaker', brand='Lumen', **defaults)
+        Product.objects.create(title='Lumen Desk Lamp', brand='Lumen', **defaults)
+        autocomplete.warm_index()
+
+    def test_completions_rank_by_product_count(self):
+        texts = [s['text'] for s in autocomplete.complete('lum')]
+        self.assertEqual(texts, ['Lumen', 'Lumen Desk Lamp'])
+
+    def test_signals_update_index_incrementally(self):
+        self.speaker.title = 'Wired Speaker'
+        self.speaker.save()
+        self.assertEqual([s['text'] for s in autocomplete.complete('wire')], ['Wired Speaker'])
+
+        self.speaker.delete()
+        self.assertEqual(autocomplete.complete('wire'), [])
+
+    def test_endpoint_returns_json(self):
+        response = self.client.get(reverse('autocomplete'), {'q': 'wi', 'limit': 5}, secure=True)
+        self.assertEqual(response.json()['suggestions'], [{'text': 'Wireless Speaker', 'kind': 'title'}])
+
+
+class FacetCountsTest(TestCase):
+    def setUp(self):
+        defaults = {'category': 'tech', 'image_url': 'https://example.com/p.jpg', 'description': 'x'}
+        self.phone = Product.objects.create(title='Phone', brand='Motorola', price='15000.00', **defaults)
+        Product.objects.create(title='Charger', brand='Motorola', price='799.00', **defaults)
+        Product.objects.create(title='Shirt', brand='PatilApx', price='299.00',
+                               **dict(defaults, category='fashion'))
+        reviewer = get_user_model().objects.create_user(username='reviewer', password='Pass@123')
+        ProductReview.objects.create(product=self.phone, user=reviewer, rating=4, title='Good', review_text='Good')
+
+    def test_counts_for_selection(self):
+        counts = facets.facet_counts(Product.objects.all(), category='tech')
+        self.assertEqual(counts['total'], 2)
+        # The category facet ignores its own selection
+        self.assertEqual({c['value']: c['count'] for c in counts['categories']}, {'tech': 2, 'fashion': 1})
+        self.assertEqual({b['value']: b['count'] for b in counts['brands']}, {'Motorola': 2})
+        self.assertEqual({p['value']: p['count'] for p in counts['prices']}, {'500-1000': 1, '5000-20000': 1})
+        self.assertEqual(counts['ratings'][0], {'value': 4, 'count': 1})
+
+    def test_unfiltered_snapshot_is_cached_until_catalog_changes(self):
+        facets.facet_counts(Product.objects.all(), {})
+        with self.assertNumQueries(0):
+            facets.facet_counts(Product.objects.all(), {}, brand='PatilApx')
+
+        with self.captureOnCommitCallbacks(execute=True):  # the catalog version moves on commit
+            Product.objects.create(title='Lamp', brand='Lumen', price='450.00', category='home',
+                                   image_url='https://example.com/p.jpg', description='x')
+        with self.assertNumQueries(1):
+            counts = facets.facet_counts(Product.objects.all(), {})
+        self.assertEqual(counts['total'], 4)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        created = timezone.now()
+        for i in range(7):
+            # Repeated prices and timestamps exercise the id tie-breaker
+            Product.objects.create(title=f'Item {i}', brand='B', price=100 + (i % 3), category='tech',
+                                   image_url='https://example.com/p.jpg', description='x', created_at=created)
+
+    def _walk(self, ordering):
+        seen, cursor = [], None
+        while True:
+            page = pagination.paginate(Product.objects.all(), ordering, cursor, per_page=3)
+            seen.extend(p.id for p in page)
+            if not page.has_next:
+                return seen, page
+            cursor = page.next_cursor
+
+    def test_walks_every_row_once_in_order(self):
+        seen, _ = self._walk([('price', False)])
+        expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+        seen, _ = self._walk([('created_at', True)])
+        self.assertEqual(seen, list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_previous_cursor_returns_prior_page(self):
+        first = pagination.paginate(Product.objects.all(), [('price', True)], per_page=3)
+        second = pagination.paginate(Product.objects.all(), [('price', True)], first.next_cursor, per_page=3)
+        back = pagination.paginate(Product.objects.all(), [('price', True)], second.previous_cursor, per_page=3)
+        self.assertEqual([p.id for p in back], [p.id for p in first])
+        self.assertFalse(first.has_previous)
+
+    def test_deep_page_is_a_single_query(self):
+        page = pagination.paginate(Product.objects.all(), [('price', False)], per_page=3)
+        page = pagination.paginate(Product.objects.all(), [('price', False)], page.next_cursor, per_page=3)
+        with self.assertNumQueries(1):
+            pagination.paginate(Product.objects.all(), [('price', False)], page.next_cursor, per_page=3)
+
+    def test_tampered_cursor_starts_from_first_page(self):
+        page = pagination.paginate(Product.objects.all(), [('price', False)], 'not-a-cursor', per_page=3)
+        self.assertFalse(page.has_previous)
+        self.assertEqual(len(page), 3)
+
+
+class RatingRollupTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(title='Phone', brand='Motorola', price='15000.00', category='tech',
+                                              image_url='https://example.com/p.jpg', description='x')
+        User = get_user_model()
+        self.alice = User.objects.create_user(username='alice', password='Pass@123')
+        self.bob = User.objects.create_user(username='bob', password='Pass@123')
+
+    def _review(self, user, rating):
+        return ProductReview.objects.create(product=self.product, user=user, rating=rating,
+                                            title='Review', review_text='Review')
+
+    def test_reviews_update_stored_rollups(self):
+        self._review(self.alice, 5)
+        review = self._review(self.bob, 2)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, str(self.product.avg_rating)), (2, '3.50'))
+        self.assertEqual((self.product.rating_5_count, self.product.rating_2_count), (1, 1))
+
+        review = ProductReview.objects.get(pk=review.pk)
+        review.rating = 3
+        review.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, str(self.product.avg_rating)), (2, '4.00'))
+        self.assertEqual((self.product.rating_2_count, self.product.rating_3_count), (0, 1))
+
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, str(self.product.avg_rating)), (1, '5.00'))
+
+    def test_repair_command_recomputes_drifted_rollups(self):
+        self._review(self.alice, 4)
+        self._review(self.bob, 1)
+        Product.objects.filter(pk=self.product.pk).update(review_count=9, avg_rating=0, rating_4_count=0)
+
+        call_command('repair_ratings', chunk_size=1, stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.review_count, str(self.product.avg_rating)), (2, '2.50'))
+        self.assertEqual([row['count'] for row in self.product.rating_histogram], [0, 1, 0, 0, 1])
+
+
+class ProductDetailFragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(title='Phone', brand='Motorola', price='15000.00', category='tech',
+                                              image_url='https://example.com/p.jpg', description='x')
+        self.url = reverse('product_detail', args=['tech', self.product.id])
+
+    def test_cached_page_costs_one_query_until_a_review_changes_it(self):
+        self.client.get(self.url, secure=True)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, secure=True)
+        self.assertNotContains(response, 'Battery lasts all day')
+
+        reviewer = get_user_model().objects.create_user(username='reviewer', password='Pass@123')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductReview.objects.create(product=self.product, user=reviewer, rating=5, title='Great',
+                                         review_text='Battery lasts all day')
+        response = self.client.get(self.url, secure=True)
+        self.assertContains(response, 'Battery lasts all day')
+
+
+class QueryBudgetHarnessTest(TestCase):
+    """Walk every named route in myapp/urls.py and enforce its SQL budget."""
+    ROWS = 6  # above SQL_BUDGET_REPEAT_THRESHOLD, so a per-row query shows up as repeated
+
+    def setUp(self):
+        cache.clear()
+        User = get_user_model()
+        self.seller = User.objects.create_user(username='seller', password='Pass@123')
+        self.seller.profile.user_type = 'seller'
+        self.seller.profile.save()
+        self.customer = User.objects.create_user(username='customer', password='Pass@123')
+        products = [
+            Product.objects.create(seller=self.seller, title=f'Item {i}', brand='Brand', price='100.00',
+                                   category='tech', image_url='https://example.com/p.jpg', description='x')
+            for i in range(self.ROWS)
+        ]
+        cart = Cart.objects.get(user=self.customer)
+        items = [CartItem.objects.create(cart=cart, product=product, quantity=2) for product in products]
+        orders = [CartOrder.objects.create(user=self.customer, product=product, price=product.price)
+                  for product in products]
+        for i, product in enumerate(products):
+            ProductImage.objects.create(product=product, image_url='https://example.com/i.jpg')
+            WishlistItem.objects.create(user=self.customer, product=product)
+            reviewer = User.objects.create_user(username=f'reviewer{i}', password='Pass@123')
+            ProductReview.objects.create(product=products[0], user=reviewer, rating=4, title='Ok', review_text='Ok')
+        invoice = Invoice.objects.create(invoice_number='INV-1', subtotal=600, total=600)
+        invoice.orders.set(orders)
+        self.kwargs = {
+            'cat': 'tech', 'id': products[0].id, 'p_id': products[0].id, 'item_id': items[0].id,
+            'product_id': products[1].id, 'order_id': orders[0].id, 'seller_id': self.seller.id,
+            'invoice_id': invoice.id, 'section': 'orders',
+        }
+
+    def test_every_route_stays_within_its_budget(self):
+        client = Client(raise_request_exception=False)
+        failures = []
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern):
+                continue  # included URLconfs (allauth)
+            url = reverse(pattern.name, kwargs={name: self.kwargs[name] for name in pattern.pattern.converters})
+            client.force_login(self.customer)
+            recorder = sqlbudget.QueryRecorder()
+            with recorder.capture():
+                client.get(url, secure=True)
+            budget = sqlbudget.budget_for(pattern.callback)
+            if recorder.count > budget:
+                failures.append(f'{pattern.name}: {recorder.count} queries (budget {budget})')
+            for shape, times in recorder.repeated():
+                failures.append(f'{pattern.name}: N+1, {times}x {shape}')
+        self.assertEqual(failures, [])
+
+    def test_admin_user_list_has_no_n_plus_one(self):
+        admin_user = get_user_model().objects.create_superuser('root', 'root@example.com', 'Pass@123')
+        self.client.force_login(admin_user)
+        recorder = sqlbudget.QueryRecorder()
+        with recorder.capture():
+            response = self.client.get(reverse('admin:auth_user_changelist'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(recorder.repeated(), [])
+
+    @override_settings(SQL_BUDGET_HEADERS=True)
+    def test_middleware_reports_query_headers(self):
+        response = Client().get(reverse('product_list'), secure=True)
+        self.assertEqual(response['X-DB-Query-Budget'], '6')
+        self.assertLessEqual(int(response['X-DB-Query-Count']), 6)
+
+
+class GenerateDataCommandTest(TestCase):
+    def test_generates_consistent_related_rows(self):
+        call_command('generate_data', sellers=2, customers=5, products=12, reviews=2, orders=2,
+                     chunk_size=4, stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 12)
+        self.assertEqual(CartOrder.objects.count(), 10)
+        self.assertEqual(Invoice.objects.count(), 5)
+        # Stored rating rollups match the generated reviews
+        expected = list(Product.objects.order_by('id').values_list('avg_rating', 'review_count'))
+        ratings.recompute()
+        self.assertEqual(list(Product.objects.order_by('id').values_list('avg_rating', 'review_count')), expected)
+        # Generated products are searchable without a manual reindex
+        title = Product.objects.order_by('id').first().title
+        self.assertIn(Product.objects.order_by('id').first().id, search.ranked_product_ids(title))
+
+
+    def test_same_seed_and_now_generate_the_same_rows(self):
+        def generate():
+            call_command('generate_data', '--now=2026-01-01T12:00:00+00:00', sellers=2, customers=4, products=6,
+                         seed=7, chunk_size=3, stdout=StringIO())
+            rows = [list(model.objects.order_by('id').values())
+                    for model in (get_user_model(), Product, CartOrder, Invoice)]
+            # Rows without generated ids are compared by content
+            rows.append(list(CartItem.objects.order_by('id').values('cart__user', 'product', 'quantity', 'added_at')))
+            rows.append(list(ProductReview.objects.order_by('id').values('product', 'user', 'rating', 'created_at',
+                                                                         'updated_at')))
+            # Ids start after the rows already there, so start both runs from an empty database
+            get_user_model().objects.all().delete()
+            Product.objects.all().delete()
+            Invoice.objects.all().delete()
+            return rows
+
+        self.assertEqual(generate(), generate())
+
+@jobs.task(name='tests.flaky', max_attempts=2, timeout=60, concurrency=1, backoff=10)
+def flaky_task(fail):
+    if fail:
+        raise RuntimeError('boom')
+
+
+class JobQueueTest(TestCase):
+    def test_checkout_enqueues_invoice_email_for_the_worker(self):
+        user = get_user_model().objects.create_user('buyer', 'buyer@example.com', 'pass12345')
+        product = Product.objects.create(title='Desk Lamp', price='25.00', category='home', stock_count=5)
+        CartItem.objects.create(cart=user.cart, product=product, quantity=2)
+        self.client.force_login(user)
+
+        response = self.client.post(reverse('confirm_order'), {'address': '1 Main St', 'mobile': '9999999999'}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        job = Job.objects.get(task='send_invoice_email')
+        self.assertEqual(job.payload['invoice_ids'], list(Invoice.objects.values_list('id', flat=True)))
+
+        call_command('worker', burst=True, concurrency=1, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertEqual(len(mail.outbox[0].attachments), 1)
+
+    def test_failures_back_off_then_fail(self):
+        job = flaky_task.delay(fail=True)
+        with self.assertLogs('myapp.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_job(jobs.claim('w1')[0], 'w1'), 'queued')
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('boom', job.last_error)
+        self.assertGreaterEqual(job.run_at, timezone.now() + timedelta(seconds=4))
+        self.assertEqual(jobs.claim('w1'), [])
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        with self.assertLogs('myapp.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_job(jobs.claim('w1')[0], 'w1'), 'failed')
+        self.assertEqual(jobs.claim('w1'), [])
+
+    def test_concurrency_limit_and_visibility_timeout(self):
+        first, second = flaky_task.delay(fail=False), flaky_task.delay(fail=False)
+        self.assertEqual(jobs.claim('w1', limit=2), [first])
+        # The task allows one lease at a time, so a second worker gets nothing
+        self.assertEqual(jobs.claim('w2'), [])
+
+        # w1 dies: once its lease expires the job is handed to w2, and w1 can no longer settle it
+        Job.objects.filter(id=first.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+        stale = Job.objects.get(id=first.id)
+        self.assertEqual(jobs.claim('w2'), [first])
+        jobs.run_job(stale, 'w1')
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.locked_by, first.attempts), ('running', 'w2', 2))
+
+
+class InvoicePdfStoreTest(TestCase):
+    def setUp(self):
+        storage_dir = TemporaryDirectory()
+        self.addCleanup(storage_dir.cleanup)
+        storages = {'invoices': {'BACKEND': 'django.core.files.storage.FileSystemStorage',
+                                 'OPTIONS': {'location': storage_dir.name}}}
+        override = override_settings(STORAGES={**settings.STORAGES, **storages})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.html_to_pdf = mock.Mock(return_value=b'%PDF-1.4 test invoice')
+        patcher = mock.patch.multiple(invoices, PDF_RENDERER='test', html_to_pdf=self.html_to_pdf)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        user = get_user_model().objects.create_user('payer', 'payer@example.com', 'pass12345')
+        order = CartOrder.objects.create(user=user, product_name='Kettle', price='40.00', status='packed')
+        self.invoice = Invoice.objects.create(invoice_number='INV-T1', subtotal='40.00', total='40.00')
+        self.invoice.orders.add(order)
+        self.url = reverse('download_invoice_consolidated', args=[self.invoice.id])
+        self.client.force_login(user)
+
+    def test_pdf_rendered_once_and_served_conditionally(self):
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4 test invoice')
+        self.invoice.refresh_from_db()
+        self.assertEqual(response['ETag'], f'"{self.invoice.pdf_sha256}"')
+
+        response = self.client.get(self.url, secure=True, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.url, secure=True, headers={'Range': 'bytes=0-3'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-3/21')
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+        response = self.client.get(self.url, secure=True, headers={'Range': 'bytes=100-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(self.html_to_pdf.call_count, 1)
+
+    def test_backfill_command_stores_missing_pdfs(self):
+        call_command('render_invoices', workers=1, stdout=StringIO())
+        self.invoice.refresh_from_db()
+        self.assertTrue(invoices.invoice_storage().exists(invoices.pdf_name(self.invoice.pdf_sha256)))
+        call_command('render_invoices', workers=1, stdout=StringIO())
+        self.assertEqual(self.html_to_pdf.call_count, 1)
+
+
+class CheckoutWritePathTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('shopper', 'shopper@example.com', 'pass12345')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Item {i}', price=10 + i, category='tech', image_url='https://example.com/i.jpg')
+            for i in range(20)
+        ])
+        self.client.force_login(self.user)
+
+    def checkout(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('confirm_order'), {'address': '2 High St'}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_round_trips_do_not_grow_with_the_cart(self):
+        CartItem.objects.create(cart=self.user.cart, product=self.products[0], quantity=3)
+        single = self.checkout()
+        CartItem.objects.bulk_create([CartItem(cart=self.user.cart, product=p, quantity=2) for p in self.products])
+        self.assertEqual(self.checkout(), single)
+
+        self.assertFalse(CartItem.objects.exists())
+        invoice = Invoice.objects.latest('id')
+        self.assertEqual(invoice.orders.count(), 20)
+        self.assertEqual(invoice.total, sum(2 * p.price for p in self.products))
+        self.assertEqual(Job.objects.filter(task='send_invoice_email').count(), 2)
+
+    def test_orders_are_packed_and_invoiced(self):
+        CartItem.objects.create(cart=self.user.cart, product=self.products[0], quantity=2)
+        self.checkout()
+        order = CartOrder.objects.get(user=self.user)
+        self.assertEqual((order.status, order.shipping_address), ('packed', '2 High St'))
+        self.assertEqual(order.invoices.get().total, 20)
+
+    def test_the_coupon_shown_at_checkout_is_invoiced_and_used_up(self):
+        now = timezone.now()
+        coupon = Coupon.objects.create(code='TENOFF', discount_percentage=0, discount_flat=5, max_uses=1,
+                                       valid_from=now - timedelta(days=1), valid_till=now + timedelta(days=1))
+        Cart.objects.filter(user=self.user).update(coupon=coupon)
+        CartItem.objects.create(cart=self.user.cart, product=self.products[0], quantity=2)
+        page = self.client.get(reverse('checkout'), secure=True)
+        self.assertEqual((page.context['discount'], page.context['total']), (5, 15))
+
+        self.checkout()
+        invoice = Invoice.objects.get()
+        self.assertEqual((invoice.subtotal, invoice.discount, invoice.total), (20, 5, 15))
+        coupon.refresh_from_db()
+        self.assertEqual(coupon.used_count, 1)
+        self.assertIsNone(Cart.objects.get(user=self.user).coupon)
+
+    def test_a_coupon_used_up_meanwhile_stops_the_order(self):
+        now = timezone.now()
+        coupon = Coupon.objects.create(code='LAST', discount_percentage=10, max_uses=1, used_count=1,
+                                       valid_from=now - timedelta(days=1), valid_till=now + timedelta(days=1))
+        Cart.objects.filter(user=self.user).update(coupon=coupon)
+        CartItem.objects.create(cart=self.user.cart, product=self.products[0], quantity=2)
+        # Another shopper took the last use after this cart was priced with the discount
+        with mock.patch('myapp.pricing.coupon_discount', return_value=Decimal('2')):
+            response = self.client.post(reverse('confirm_order'), {'address': '2 High St'}, secure=True)
+        self.assertEqual(response.context['coupon_error'], 'LAST')
+        self.assertFalse(CartOrder.objects.exists())
+        self.assertTrue(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertIsNone(Cart.objects.get(user=self.user).coupon)
+
+
+class CartPricingTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('pricer', 'pricer@example.com', 'pass12345')
+        phone = Product.objects.create(title='Phone', price='199.99', category='tech',
+                                       image_url='https://example.com/p.jpg')
+        case = Product.objects.create(title='Case', price='15.50', category='tech',
+                                      image_url='https://example.com/c.jpg')
+        large = ProductVariant.objects.create(product=phone, variant_type='Storage', variant_value='256GB',
+                                              price_adjustment='50.00')
+        CartItem.objects.create(cart=self.user.cart, product=phone, variant=large, quantity=2)
+        CartItem.objects.create(cart=self.user.cart, product=case, quantity=3)
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(code='SAVE12', discount_percentage='12.5',
+                                            valid_from=now - timedelta(days=1), valid_till=now + timedelta(days=1))
+
+    def test_one_query_prices_the_whole_cart(self):
+        Cart.objects.filter(user=self.user).update(coupon=self.coupon)
+        cart = Cart.objects.get(user=self.user)
+        with self.assertNumQueries(1):
+            pricing = cart.pricing
+            self.assertEqual([item.total_price for item in pricing.items], [Decimal('499.98'), Decimal('46.50')])
+            self.assertEqual(cart.subtotal, Decimal('546.48'))
+            self.assertEqual(cart.discount_amount, Decimal('68.31'))
+            self.assertEqual(cart.total, Decimal('478.17'))
+
+    def test_cart_view_uses_the_priced_lines(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('cart_view_new'), secure=True)
+        self.assertEqual(response.context['subtotal'], Decimal('546.48'))
+        self.assertEqual(response.context['total'], Decimal('546.48'))
+        self.assertContains(response, '499.98')
+
+    def test_flat_discount_never_goes_below_zero(self):
+        self.coupon.discount_flat = Decimal('1000')
+        self.coupon.save()
+        Cart.objects.filter(user=self.user).update(coupon=self.coupon)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual((cart.discount_amount, cart.total), (Decimal('546.48'), Decimal('0')))
+
+
+class CartServiceTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('merger', 'merger@example.com', 'pass12345')
+        self.products = Product.objects.bulk_create([
+            Product(title=f'Item {i}', price=10 + i, category='tech', image_url='https://example.com/i.jpg')
+            for i in range(30)
+        ])
+
+    def guest_request(self):
+        request = RequestFactory().get('/')
+        SessionMiddleware(lambda r: None).process_request(request)
+        request.user = AnonymousUser()
+        return request
+
+    def test_guest_backends_share_one_api(self):
+        for backend in ('session', 'cache'):
+            with self.subTest(backend=backend), override_settings(CART_GUEST_BACKEND=backend):
+                cache.clear()
+                cart = carts.CartService(self.guest_request())
+                cart.add(self.products[0], 2)
+                cart.add(self.products[0], 1)
+                cart.add(self.products[1])
+                cart.remove(self.products[1].id)
+                pricing = cart.pricing()
+                self.assertEqual([(line.product_name, line.quantity) for line in pricing.items], [('Item 0', 3)])
+                self.assertEqual(pricing.total, 30)
+                self.assertEqual('guest_cart' in cart.request.session, backend == 'session')
+
+    def test_merge_on_login_is_a_fixed_number_of_queries(self):
+        def merge(count):
+            request = self.guest_request()
+            guest = carts.CartService(request)
+            for product in self.products[:count]:
+                guest.add(product, 2)
+            with CaptureQueriesContext(connection) as queries:
+                carts.merge_guest_cart(request, self.user)
+            self.assertFalse(guest.lines())
+            return [query['sql'].split()[0] for query in queries]
+
+        CartItem.objects.create(cart=self.user.cart, product=self.products[0], quantity=1)
+        # The cart, the products still on sale, then one upsert
+        self.assertEqual(merge(3), ['SELECT', 'SELECT', 'INSERT'])
+        self.assertEqual(merge(30), ['SELECT', 'SELECT', 'INSERT'])
+        self.assertEqual(CartItem.objects.get(product=self.products[0]).quantity, 5)
+        self.assertEqual(CartItem.objects.get(product=self.products[29]).quantity, 2)
+        with self.assertNumQueries(0):
+            carts.merge_guest_cart(self.guest_request(), self.user)
+
+    def test_cart_urls_share_the_database_cart(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('add_to_cart', args=[self.products[0].id]), secure=True)
+        self.client.get(reverse('move_to_cart', args=[self.products[0].id]), secure=True)
+        item = CartItem.objects.get(cart__user=self.user)
+        self.assertEqual(item.quantity, 2)
+        response = self.client.get(reverse('cart_view'), secure=True)
+        self.assertEqual(response.context['total'], 20)
+        self.client.get(reverse('remove_from_cart', args=[item.id]), secure=True)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(CartOrder.objects.exists())
+
+
+class TwoTierCacheTest(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def worker(self, name, **options):
+        """A two-tier cache with its own local tier, as another process would have."""
+        return cache_backends.TwoTierCache(name, {'OPTIONS': {'SHARED': 'shared', **options}})
+
+    def test_local_tier_is_a_bounded_lru_over_the_shared_tier(self):
+        tiers = self.worker('lru', LOCAL_MAX_ENTRIES=2)
+        for key in 'abc':
+            tiers.set(key, key.upper())
+        self.assertEqual(len(tiers.local), 2)
+        self.assertEqual(tiers.get('c'), 'C')  # local
+        self.assertEqual(tiers.get('a'), 'A')  # evicted locally, still shared
+        self.assertIsNone(tiers.get('missing'))
+        self.assertEqual(tiers.get_many(['a', 'b', 'c', 'missing']), {'a': 'A', 'b': 'B', 'c': 'C'})
+        stats = tiers.stats()
+        self.assertEqual((stats['sets'], stats['evictions'], stats['local_entries']), (3, 3, 2))
+        self.assertEqual((stats['local_hits'], stats['shared_hits'], stats['misses']), (3, 2, 2))
+
+    def test_version_bumps_reach_other_workers(self):
+        one, two = self.worker('one', VERSION_LOCAL_TIMEOUT=0), self.worker('two', VERSION_LOCAL_TIMEOUT=0)
+        one.set('version:catalog', 1, None)
+        one.set('facets:v1:', ['old'])
+        self.assertEqual(two.get('version:catalog'), 1)
+        two.incr('version:catalog')
+        two.set('facets:v2:', ['new'])
+        self.assertEqual(one.get(f"facets:v{one.get('version:catalog')}:"), ['new'])
+
+    def test_staff_can_read_the_counters(self):
+        staff = get_user_model().objects.create_user('ops', password='pass12345', is_staff=True)
+        self.client.force_login(staff)
+        cache.set('warm', 1)
+        cache.get('warm')
+        response = self.client.get(reverse('cache_stats'), secure=True)
+        self.assertGreaterEqual(response.json()['caches']['default']['local_hits'], 1)
+
+
+class WriteBehindSessionTest(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def session_writes(self, queries):
+        return [q['sql'] for q in queries if 'django_session' in q['sql'] and not q['sql'].startswith('SELECT')]
+
+    def test_refuses_a_cache_without_atomic_add_and_incr(self):
+        with TemporaryDirectory() as tmp, override_settings(CACHES={
+                'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tmp}}):
+            with self.assertRaises(ImproperlyConfigured):
+                sessions.SessionStore()
+
+    def test_saves_coalesce_into_one_database_write(self):
+        store = sessions.SessionStore()
+        with CaptureQueriesContext(connection) as queries:
+            for n in range(5):
+                store['visits'] = n
+                store.save()
+        self.assertEqual(self.session_writes(queries), [])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sessions.flush(include_current=True), 1)
+        self.assertEqual(len(self.session_writes(queries)), 1)
+
+        caches['shared'].clear()  # evicted: the database copy takes over
+        self.assertEqual(sessions.SessionStore(store.session_key)['visits'], 4)
+
+    def test_a_flush_does_not_bring_back_a_deleted_session(self):
+        store = sessions.SessionStore()
+        store['theme'] = 'dark'
+        store.save()
+        shared = caches['shared']
+        read = shared.get_many
+
+        def logout_after_read(keys, **kwargs):
+            found = read(keys, **kwargs)
+            if sessions.KEY_PREFIX + store.session_key in keys:
+                sessions.SessionStore(store.session_key).delete()
+            return found
+
+        with mock.patch.object(shared, 'get_many', logout_after_read):
+            self.assertEqual(sessions.flush(include_current=True), 0)
+        self.assertFalse(Session.objects.filter(session_key=store.session_key).exists())
+
+    def test_concurrent_requests_do_not_lose_updates(self):
+        store = sessions.SessionStore()
+        store['theme'] = 'dark'
+        store.save()
+        product = Product.objects.create(title='Mug', price=5, category='home', image_url='https://example.com/m.jpg')
+
+        def shopper():
+            for _ in range(10):
+                request = SimpleNamespace(session=sessions.SessionStore(store.session_key), user=AnonymousUser())
+                carts.SessionCart(request).add(product)
+                request.session.save()
+
+        threads = [threading.Thread(target=shopper) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # A request that loaded the session before the others wrote it keeps their changes
+        stale = sessions.SessionStore(store.session_key)
+        self.assertEqual(stale['theme'], 'dark')
+        fresh = sessions.SessionStore(store.session_key)
+        fresh['seen'] = True
+        fresh.save()
+        stale['theme'] = 'light'
+        stale.save()
+
+        latest = sessions.SessionStore(store.session_key)
+        self.assertEqual(latest['guest_cart'], {str(product.id): 40})
+        self.assertEqual((latest['theme'], latest['seen']), ('light', True))
+
+    def test_delete_reaches_both_stores(self):
+        store = sessions.SessionStore()
+        store['user'] = 1
+        store.save()
+        sessions.flush(include_current=True)
+        store.delete()
+        self.assertFalse(store.exists(store.session_key))
+
+
+class LayoutContextTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Product.objects.create(title='Lamp', price=20, category='home', image_url='https://example.com/l.jpg')
+
+    def test_unused_layout_context_is_never_built(self):
+        with mock.patch('myapp.context_processors.SellerSignUpForm') as form, \
+                mock.patch.object(layout, 'category_nav') as nav:
+            self.client.get(reverse('product_list'), secure=True)
+        form.assert_not_called()
+        nav.assert_not_called()
+
+    def test_category_nav_is_cached_per_catalog_version(self):
+        self.assertContains(self.client.get('/', secure=True), 'Home &amp; Living <span class="text-muted small">1')
+        with self.assertNumQueries(0):
+            layout.category_nav()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(title='Rug', price=30, category='home', image_url='https://example.com/r.jpg')
+        self.assertIn('Home &amp; Living <span class="text-muted small">2', layout.category_nav())
+
+
+class CustomerDashboardTest(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('regular', 'regular@example.com', 'pass12345')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pass12345')
+        self.product = Product.objects.create(title='Lamp', price='40.00', category='home',
+                                              image_url='https://example.com/l.jpg')
+        self.client.force_login(self.user)
+
+    def place(self, count, user=None):
+        orders = CartOrder.objects.bulk_create([
+            CartOrder(user=user or self.user, product=self.product, product_name='Lamp', price='40.00',
+                      quantity=1 + n % 3, status='delivered')
+            for n in range(count)
+        ])
+        invoice = Invoice.objects.create(invoice_number=f'INV-{orders[0].id}', subtotal=0, total=0)
+        invoice.orders.set(orders)
+        return orders
+
+    def dashboard_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('customer_dashboard'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_totals_come_from_one_aggregate_whatever_the_history(self):
+        self.place(3)
+        _response, few = self.dashboard_queries()
+        self.place(60)
+        self.place(5, user=self.other)
+        response, many = self.dashboard_queries()
+        self.assertEqual(few, many)
+        self.assertLess(many, 10)
+        self.assertEqual(response.context['total_orders'], 63)
+        self.assertEqual(response.context['total_spent'], Decimal('40.00') * (21 * 1 + 21 * 2 + 21 * 3))
+
+    def test_sections_page_through_the_customers_rows(self):
+        orders = self.place(23)
+        self.place(4, user=self.other)
+        url = reverse('customer_dashboard_section', args=['orders'])
+        seen, cursor = [], None
+        while True:
+            # The signed-in user and one keyset page; the session comes from the cache
+            with self.assertNumQueries(2):
+                page = self.client.get(url, {'cursor': cursor} if cursor else {}, secure=True).json()
+            seen += [int(n) for n in re.findall(r'Order #(\d+)', page['html'])]
+            cursor = page['next']
+            if not cursor:
+                break
+        self.assertEqual(seen, sorted((o.id for o in orders), reverse=True))
+
+        invoices = self.client.get(reverse('customer_dashboard_section', args=['invoices']), secure=True).json()
+        self.assertEqual(invoices['html'].count('Download'), 1)
+        self.assertIsNone(invoices['next'])
+        response = self.client.get(reverse('customer_dashboard_section', args=['secrets']), secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class SellerSalesRollupTest(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.seller = User.objects.create_user('vendor', 'vendor@example.com', 'pass12345')
+        self.seller.profile.user_type = 'seller'
+        self.seller.profile.save()
+        self.buyers = [User.objects.create_user(f'buyer{n}', f'buyer{n}@example.com', 'pass12345') for n in range(2)]
+        self.phone, self.case = [
+            Product.objects.create(seller=self.seller, title=title, price=price, category='tech',
+                                   image_url='https://example.com/p.jpg', stock_count=100)
+            for title, price in (('Phone', '200.00'), ('Case', '15.00'))
+        ]
+
+    def order(self, buyer, product, quantity=1, status='packed'):
+        return CartOrder.objects.create(user=buyer, product=product, product_name=product.title,
+                                        price=product.price, quantity=quantity, status=status)
+
+    def rollups(self):
+        return {row.product_id: (row.revenue, row.units, row.orders, row.customers)
+                for row in SellerSalesRollup.objects.all()}
+
+    def totals(self):
+        analytics = SellerAnalytics.objects.get(seller=self.seller)
+        return analytics.total_sales, analytics.total_orders, analytics.total_customers
+
+    def test_checkout_counts_quantity_and_distinct_customers(self):
+        self.client.force_login(self.buyers[0])
+        CartItem.objects.create(cart=self.buyers[0].cart, product=self.phone, quantity=2)
+        CartItem.objects.create(cart=self.buyers[0].cart, product=self.case, quantity=3)
+        self.client.post(reverse('confirm_order'), {'address': '1 Main St'}, secure=True)
+        self.order(self.buyers[0], self.phone)
+        self.order(self.buyers[1], self.phone)
+
+        self.assertEqual(self.rollups(), {self.phone.id: (Decimal('800.00'), 4, 3, 2),
+                                          self.case.id: (Decimal('45.00'), 3, 1, 1)})
+        # Distinct customers across the seller's orders are recounted by the rebuild, not per checkout
+        self.assertEqual(self.totals(), (Decimal('845.00'), 4, 0))
+        sales.rebuild_all()
+        self.assertEqual(self.totals(), (Decimal('845.00'), 4, 2))
+
+    def test_status_changes_and_deletes_update_the_rollups(self):
+        first = self.order(self.buyers[0], self.phone)
+        second = self.order(self.buyers[1], self.phone, quantity=2)
+        self.order(self.buyers[1], self.case, status='pending')
+        self.assertEqual(self.rollups(), {self.phone.id: (Decimal('600.00'), 3, 2, 2)})
+
+        second.payment_status = 'paid'
+        with self.assertNumQueries(1):
+            second.save(update_fields=['payment_status'])
+        second.status = 'pending'
+        second.save()
+        self.assertEqual(self.rollups(), {self.phone.id: (Decimal('200.00'), 1, 1, 1)})
+        first.delete()
+        self.assertEqual(self.rollups(), {})
+        self.assertEqual(self.totals()[:2], (0, 0))
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_refresh_locks_the_products_before_aggregating(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.order(self.buyers[0], self.phone)
+        statements = [q['sql'] for q in queries]
+        lock = next(n for n, sql in enumerate(statements) if 'FOR UPDATE' in sql)
+        self.assertIn(Product._meta.db_table, statements[lock])
+        self.assertTrue(any('SUM' in sql for sql in statements[lock + 1:]))
+
+    def test_rebuild_command_repairs_changes_that_skipped_the_signals(self):
+        self.order(self.buyers[0], self.phone)
+        self.order(self.buyers[1], self.case, quantity=4)
+        expected = self.rollups()
+        CartOrder.objects.filter(product=self.case).update(status='pending')
+        SellerSalesRollup.objects.filter(product=self.phone).update(units=99)
+
+        call_command('rebuild_sales_rollups', chunk_size=1, stdout=StringIO())
+        del expected[self.case.id]
+        self.assertEqual(self.rollups(), expected)
+        self.assertEqual(self.totals(), (Decimal('200.00'), 1, 1))
+
+    def test_dashboard_reads_the_rollups_not_the_orders(self):
+        for n in range(12):
+            self.order(self.buyers[n % 2], self.phone if n % 3 else self.case, quantity=2)
+        self.client.force_login(self.seller)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('seller_dashboard'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q['sql'] for q in queries if CartOrder._meta.db_table in q['sql']])
+        self.assertEqual(response.context['total_sales'], Decimal('3320.00'))
+        self.assertEqual(response.context['recent_units'], 24)
+        self.assertEqual([p['product__title'] for p in response.context['top_products']], ['Phone', 'Case'])
+
+
+class HotPathIndexTest(TestCase):
+    """The hot lookups are planned on the indexes declared for them."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('indexed', 'indexed@example.com', 'pass12345')
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are cheapest to scan; make the planner show its index choice
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+
+    def test_hot_queries_use_their_indexes(self):
+        now = timezone.now()
+        orders = CartOrder.objects.filter(user=self.user)
+        hot = [
+            (orders.filter(product_id=1, status__in=['shipped', 'delivered']), 'cartorder_user_product_idx'),
+            (orders.filter(status='packed').order_by('-ordered_date'), 'cartorder_user_status_idx'),
+            (orders.filter(payment_status='pending').order_by('-ordered_date'), 'cartorder_unpaid_idx'),
+            (orders.order_by('-ordered_date', '-id')[:11], 'cartorder_user_date_idx'),
+            (orders.filter(transaction_id='order_123', payment_method='razorpay'), 'cartorder_txn_idx'),
+            (CartOrder.objects.filter(product_id__in=[1, 2], ordered_date__gte=now,
+                                      ordered_date__lt=now + timedelta(days=1)), 'cartorder_product_date_idx'),
+            (get_user_model().objects.filter(email='indexed@example.com'), 'auth_user_email_idx'),
+            (Product.objects.filter(stock_count__gt=0).order_by('-created_at', '-id')[:24],
+             'product_instock_created_idx'),
+            (Product.objects.filter(stock_count__gt=0).order_by('price', 'id')[:24], 'product_instock_price_idx'),
+            (Invoice.objects.order_by('-issued_at', '-id')[:10], 'invoice_issued_id_idx'),
+        ]
+        for queryset, index in hot:
+            with self.subTest(index=index):
+                self.assertUsesIndex(queryset, index)
+
+
+class IndexAdvisorTest(TestCase):
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(title=f'Item {i}', brand=f'Brand {i % 3}', price=i + 1, category='tech', description=f'{i}',
+                    image_url='https://example.com/i.jpg')
+            for i in range(30)
+        ])
+
+    def test_ranks_scans_and_sorts_by_cost_times_calls(self):
+        log = explain.StatementLog()
+        with log.capture('listing'):
+            for _ in range(3):
+                list(Product.objects.filter(brand='Brand 1').order_by('description'))
+            Product.objects.filter(pk=1).first()
+        with log.capture('detail'):
+            list(Product.objects.filter(brand='Brand 2').order_by('description'))
+
+        advice = explain.advise(log.statements.values(), min_rows=10)
+        self.assertEqual(len(advice), 1)
+        entry = advice[0]
+        self.assertEqual((entry['calls'], entry['routes']), (4, ['detail', 'listing']))
+        self.assertAlmostEqual(entry['score'], entry['cost'] * 4, places=1)
+        kinds = {finding['kind'] for finding in entry['findings']}
+        if connection.vendor == 'sqlite':
+            self.assertEqual(kinds, {'seq_scan', 'temp_sort'})
+        self.assertIn('seq_scan', kinds)
+        self.assertEqual(explain.advise(log.statements.values(), min_rows=1000), [])
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('holder', 'holder@example.com', 'pass12345')
+        self.product = Product.objects.create(title='Last Lamp', price='30.00', category='home',
+                                              image_url='https://example.com/l.jpg', stock_count=5)
+        self.item = CartItem.objects.create(cart=self.user.cart, product=self.product, quantity=3)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock_count
+
+    def test_hold_takes_stock_and_follows_quantity(self):
+        self.assertTrue(inventory.hold(self.item))
+        self.assertEqual(self.stock(), 2)
+        self.item.quantity = 1
+        self.assertTrue(inventory.hold(self.item))
+        self.assertEqual(self.stock(), 4)
+        self.item.quantity = 6
+        self.assertFalse(inventory.hold(self.item))
+        self.assertEqual((self.stock(), StockReservation.objects.get(item=self.item).quantity), (4, 1))
+
+    def test_selling_out_refreshes_the_in_stock_facets(self):
+        cache.clear()
+
+        def in_stock():
+            return facets.facet_counts(Product.objects.filter(stock_count__gt=0), {'in_stock': '1'})['total']
+
+        self.assertEqual(in_stock(), 1)
+        self.item.quantity = 5
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(inventory.hold(self.item))
+        self.assertEqual(in_stock(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.release([self.item])
+        self.assertEqual(in_stock(), 1)
+
+    def test_checkout_sells_held_units_once_and_rejects_oversell(self):
+        inventory.hold(self.item)
+        self.client.force_login(self.user)
+        self.client.post(reverse('confirm_order'), {'address': '3 Elm St'}, secure=True)
+        self.assertEqual(self.stock(), 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+        CartItem.objects.create(cart=self.user.cart, product=self.product, quantity=4)
+        response = self.client.post(reverse('confirm_order'), {'address': '3 Elm St'}, secure=True)
+        self.assertContains(response, 'Not enough stock left for: Last Lamp')
+        self.assertEqual(self.stock(), 2)
+        self.assertEqual(CartOrder.objects.count(), 1)
+        self.assertTrue(CartItem.objects.exists())
+
+    def test_sweeper_returns_expired_and_orphaned_holds(self):
+        inventory.hold(self.item)
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(inventory.sweep(), 1)
+        self.assertEqual(self.stock(), 5)
+
+        inventory.hold(self.item)
+        self.item.delete()
+        self.assertEqual(inventory.sweep(), 1)
+        self.assertEqual(self.stock(), 5)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class StockContentionTest(TransactionTestCase):
+    """Many threads racing for one SKU never oversell it (needs a server database; see stress_inventory)."""
+
+    def test_no_oversell_under_contention(self):
+        product = Product.objects.create(title='Hot SKU', price='1.00', category='tech',
+                                         image_url='https://example.com/h.jpg', stock_count=40)
+        users = [get_user_model().objects.create_user(f'racer{n}', '', None) for n in range(16)]
+        items = [CartItem.objects.create(cart=user.cart, product=product, quantity=1) for user in users]
+
+        def race(item):
+            try:
+                for quantity in range(1, 6):
+                    item.quantity = quantity
+                    inventory.hold(item)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=race, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        product.refresh_from_db()
+        reserved = sum(StockReservation.objects.values_list('quantity', flat=True))
+        self.assertGreaterEqual(product.stock_count, 0)
+        self.assertEqual(product.stock_count + reserved, 40)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReadReplicaRouterTest(TransactionTestCase):
+    """Reads go to a lagging replica, except where a visitor has to see their own writes."""
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest("The lag simulation copies SQLite databases.")
+        self.user = get_user_model().objects.create_user('reader', password='Pass@123')
+        self.product = Product.objects.create(title='Replicated Lamp', price='20.00', category='home',
+                                              image_url='https://example.com/l.jpg')
+        db_routers.replicate()  # the replica has caught up with the fixtures
+
+    def new_product(self):
+        return Product.objects.create(title='Late Lamp', price='25.00', category='home',
+                                      image_url='https://example.com/k.jpg')
+
+    def test_unpinned_reads_lag_behind_the_primary(self):
+        with db_routers.scope():
+            late = self.new_product()
+            self.assertTrue(Product.objects.filter(id=late.id).exists())
+        with db_routers.scope():  # someone who did not write it
+            self.assertFalse(Product.objects.filter(id=late.id).exists())
+            with transaction.atomic():
+                self.assertTrue(Product.objects.filter(id=late.id).exists())
+            db_routers.replicate()
+            self.assertTrue(Product.objects.filter(id=late.id).exists())
+
+    def test_a_write_pins_the_visitor_to_the_primary(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('add_to_wishlist', args=[self.product.id]), secure=True)
+        self.assertIn(db_routers.PIN_COOKIE, self.client.cookies)
+        self.assertContains(self.client.get(reverse('wishlist_view'), secure=True), 'Replicated Lamp')
+
+        del self.client.cookies[db_routers.PIN_COOKIE]
+        self.assertNotContains(self.client.get(reverse('wishlist_view'), secure=True), 'Replicated Lamp')
+
+    def test_fragments_filled_from_a_lagging_replica_expire_once_it_catches_up(self):
+        url = reverse('product_detail', args=['home', self.product.id])
+        with db_routers.scope():  # a seller edits the product
+            self.product.description = 'Now with a dimmer'
+            self.product.save()
+        # A visitor renders the page from the replica, which has not seen the edit yet
+        self.assertNotContains(self.client.get(url, secure=True), 'Now with a dimmer')
+
+        db_routers.replicate()
+        later = db_routers.pin_seconds() + 1
+        with mock.patch('time.time', return_value=time.time() + later), \
+                mock.patch('time.monotonic', return_value=time.monotonic() + later):
+            self.assertContains(self.client.get(url, secure=True), 'Now with a dimmer')
+
+    def test_jobs_read_their_rows_from_the_primary(self):
+        with db_routers.scope():  # checkout, on another request
+            self.user.email = 'reader@example.com'
+            self.user.save()
+            order = CartOrder.objects.create(user=self.user, product_name='Replicated Lamp', price='20.00')
+            invoice = Invoice.objects.create(invoice_number='INV-R1', subtotal='20.00', total='20.00')
+            invoice.orders.add(order)
+            job = tasks.send_invoice_email.delay(user_id=self.user.id, invoice_ids=[invoice.id])
+
+        claimed = jobs.claim('w1')[0]
+        with db_routers.scope():  # a worker thread starts unpinned
+            jobs.run_job(claimed, 'w1')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(len(mail.outbox[0].attachments), 1)
+
+        # Queued longer ago than the pin lasts, yet the replica still lacks the invoice: retry later
+        db_routers.replicate()
+        late = Invoice.objects.create(invoice_number='INV-R2', subtotal='20.00', total='20.00')
+        job = tasks.send_invoice_email.delay(user_id=self.user.id, invoice_ids=[late.id])
+        Job.objects.filter(id=job.id).update(created_at=timezone.now() - timedelta(hours=1))
+        claimed = jobs.claim('w1')[0]
+        with db_routers.scope(), self.assertLogs('myapp.jobs', 'WARNING'):
+            self.assertEqual(jobs.run_job(claimed, 'w1'), 'queued')
+        self.assertEqual(len(mail.outbox), 1)
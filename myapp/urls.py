@@ -6,6 +6,7 @@ urlpatterns = [
     path('', views.index, name='home'),
     path('about/', views.about, name='about'),
     path('profile/', views.profile, name='profile'),
+    path('autocomplete/', views.autocomplete_view, name='autocomplete'),
     
     # Product Logic
     path('product/<str:cat>/<int:id>/', views.product_detail, name='product_detail'),
@@ -50,6 +51,7 @@ urlpatterns = [
     
     # FEATURE 5: Customer Dashboard
     path('dashboard/', views.customer_dashboard, name='customer_dashboard'),
+    path('dashboard/<str:section>/', views.customer_dashboard_section, name='customer_dashboard_section'),
     path('order/<int:order_id>/', views.order_detail, name='order_detail'),
     path('order/<int:order_id>/refund/', views.request_refund, name='request_refund'),
     path('profile/update/', views.update_profile, name='update_profile'),
@@ -65,6 +67,9 @@ urlpatterns = [
     path('invoice/<int:invoice_id>/', views.invoice_view, name='invoice_view'),
     path('download-invoice/<int:order_id>/', views.generate_invoice, name='generate_invoice'),
     path('download-invoice/invoice/<int:invoice_id>/', views.download_consolidated_invoice, name='download_invoice_consolidated'),
+
+    # Monitoring
+    path('cache-stats/', views.cache_stats_view, name='cache_stats'),
     
     # Social Login (Google/GitHub)
     path('accounts/', include('allauth.urls')),
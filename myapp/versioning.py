@@ -0,0 +1,118 @@
+"""Cache version counters.
+
+Derived data (facet snapshots, rendered fragments, ...) is cached under a
+key that embeds a version number. Bumping the version makes every old key
+unreachable at once, so nothing ever has to be deleted or scanned for.
+
+A version is bumped when the transaction that changed the data commits, so
+a page rendered in between is stored under the old version. With read
+replicas, a page rendered just after the bump may still read the old rows
+from a replica; :func:`fill_timeout` keeps such fills only until the
+replicas have caught up (``REPLICA_PIN_SECONDS``).
+"""
+import math
+import time
+from functools import partial
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import db_routers
+from .models import Product, ProductImage, ProductReview, ProductVariant
+
+CATALOG = 'catalog'
+
+
+def _key(namespace):
+    return f'version:{namespace}'
+
+
+def _seed():
+    # Start from a clock-derived value so a counter that was evicted never
+    # comes back at a number an old cached entry was stored under.
+    return int(time.time() * 1000)
+
+
+def get_version(namespace):
+    version = cache.get(_key(namespace))
+    if version is None:
+        cache.add(_key(namespace), _seed(), None)
+        version = cache.get(_key(namespace), _seed())
+    return version
+
+
+def _settling_key(namespace):
+    return f'version:{namespace}:settling'
+
+
+def _bump(namespace):
+    if db_routers.replicas():
+        # Set before the bump, so no reader sees the new version without it
+        cache.set(_settling_key(namespace), time.time() + db_routers.pin_seconds(), db_routers.pin_seconds())
+    try:
+        cache.incr(_key(namespace))
+    except ValueError:
+        cache.set(_key(namespace), _seed(), None)
+
+
+def bump_version(namespace, using=None):
+    """Bump ``namespace`` when the current transaction on ``using`` commits, or now outside one."""
+    transaction.on_commit(partial(_bump, namespace), using=using)
+
+
+def fill_timeout(timeout, *namespaces):
+    """Timeout for caching data read under the current versions of ``namespaces``.
+
+    Within ``REPLICA_PIN_SECONDS`` of a bump a replica may still serve the
+    rows from before it, so the entry only lives until the replicas have
+    caught up.
+    """
+    if not db_routers.replicas():
+        return timeout
+    settling = cache.get_many([_settling_key(namespace) for namespace in namespaces]).values()
+    remaining = max(settling, default=0) - time.time()
+    return min(timeout, math.ceil(remaining)) if remaining > 0 else timeout
+
+
+def catalog_version():
+    return get_version(CATALOG)
+
+
+def bump_catalog_version(using=None, **kwargs):
+    """Signal-friendly wrapper; also call it after bulk catalog imports."""
+    bump_version(CATALOG, using)
+
+
+def product_namespace(product_id):
+    """Namespace of one product's detail page (the product, its images, variants and reviews)."""
+    return f'product:{product_id}'
+
+
+def product_version(product_id):
+    return get_version(product_namespace(product_id))
+
+
+def bump_product_version(product_id, using=None):
+    bump_version(product_namespace(product_id), using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_catalog(sender, using=None, **kwargs):
+    bump_catalog_version(using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_product(sender, instance, using=None, **kwargs):
+    bump_product_version(instance.pk if sender is Product else instance.product_id, using)
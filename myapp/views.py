@@ -4,29 +4,55 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.forms import AuthenticationForm
 from django.views.decorators.csrf import csrf_protect
-from django.db.models import Q, Avg, Count
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from .models import (CartOrder, Product, ContactMessage, ProductReview, WishlistItem, 
-                     Cart, CartItem, ProductImage, Coupon, Invoice, RefundRequest,
+                     ProductImage, Coupon, Invoice, RefundRequest,
                      NewsletterSubscription, Profile, SellerAnalytics)
 from .forms import (SellerSignUpForm, ProductReviewForm, AddToCartForm, ApplyCouponForm,
                    NewsletterForm, RefundRequestForm, ProductFilterForm)
-from io import BytesIO
+from . import (autocomplete, cache_backends, carts, facets, inventory, invoices, pagination, sales, search, tasks,
+               versioning)
+from .pricing import split_discount
+from .sqlbudget import query_budget
 from django.template.loader import render_to_string
-from django.core.mail import EmailMessage
 from django.conf import settings
 from django.http import HttpResponse
 from django.template.loader import get_template
+from datetime import timedelta
 from decimal import Decimal
 import json
 import hmac
+import os
 import hashlib
-import io
-from types import SimpleNamespace
 from django.utils import timezone
 
-SESSION_CART_KEY = 'guest_cart'
+# Keyset orderings for the listing sorts: (field, descending). The cursor
+# paginator appends ``id`` as the tie-breaker.
+LISTING_SORTS = {
+    '-created_at': [('created_at', True)],
+    'price_low': [('price', False)],
+    'price_high': [('price', True)],
+    'rating': [('avg_rating', True)],
+    'popular': [('review_count', True)],
+}
+SELLER_DASHBOARD_DAYS = 30
+PRODUCT_FRAGMENT_TIMEOUT = 60 * 60 * 24
+
+
+def _fragment_versions(product_id):
+    """Versions of the product page's cached fragments, and how long a fill may be kept."""
+    namespaces = versioning.product_namespace(product_id), versioning.CATALOG
+    return {
+        'fragment_version': versioning.get_version(namespaces[0]),
+        'catalog_version': versioning.get_version(namespaces[1]),
+        # Read after the versions, so a bump in between is never missed
+        'fragment_timeout': versioning.fill_timeout(PRODUCT_FRAGMENT_TIMEOUT, *namespaces),
+    }
 
 
 def _normalize_quantity(raw_quantity):
@@ -37,126 +63,53 @@ def _normalize_quantity(raw_quantity):
     return max(1, quantity)
 
 
-def _get_session_cart(request):
-    return request.session.get(SESSION_CART_KEY, {})
-
-
-def _save_session_cart(request, cart_data):
-    if cart_data:
-        request.session[SESSION_CART_KEY] = cart_data
-    else:
-        request.session.pop(SESSION_CART_KEY, None)
-    request.session.modified = True
-
-
-def _add_to_session_cart(request, product, quantity):
-    cart_data = _get_session_cart(request)
-    product_key = str(product.id)
-    existing_quantity = cart_data.get(product_key, 0)
-    try:
-        existing_quantity = int(existing_quantity)
-    except (TypeError, ValueError):
-        existing_quantity = 0
-    cart_data[product_key] = max(0, existing_quantity) + quantity
-    _save_session_cart(request, cart_data)
-
-
-def _build_session_cart_items(request):
-    cart_data = _get_session_cart(request)
-    if not cart_data:
-        return [], Decimal('0.00')
-
-    products = Product.objects.filter(id__in=cart_data.keys())
-    product_map = {str(product.id): product for product in products}
-    items = []
-    total = Decimal('0.00')
-    cleaned_cart = {}
-
-    for product_id, raw_quantity in cart_data.items():
-        product = product_map.get(str(product_id))
-        if not product:
-            continue
-
-        quantity = _normalize_quantity(raw_quantity)
-        line_total = product.price * quantity
-        total += line_total
-        cleaned_cart[str(product.id)] = quantity
-        items.append(SimpleNamespace(
-            id=product.id,
-            product=product,
-            product_name=product.title,
-            price=product.price,
-            quantity=quantity,
-            total_price=line_total,
-        ))
-
-    if cleaned_cart != cart_data:
-        _save_session_cart(request, cleaned_cart)
-
-    return items, total
-
-
-def _merge_session_cart_into_orders(request, user):
-    cart_data = _get_session_cart(request)
-    if not cart_data:
-        return
-
-    products = Product.objects.filter(id__in=cart_data.keys())
-    product_map = {str(product.id): product for product in products}
-
-    for product_id, raw_quantity in cart_data.items():
-        product = product_map.get(str(product_id))
-        if not product:
-            continue
-
-        quantity = _normalize_quantity(raw_quantity)
-        existing_order = CartOrder.objects.filter(
-            user=user,
-            product=product,
-            status='pending',
-        ).order_by('id').first()
-
-        if existing_order:
-            existing_order.quantity += quantity
-            existing_order.price = product.price
-            existing_order.product_name = product.title
-            existing_order.save(update_fields=['quantity', 'price', 'product_name'])
+def _cart_page(request):
+    """Render the cart (guest or signed-in) with its priced lines."""
+    cart = carts.CartService(request)
+    pricing = cart.pricing()
+    coupon_msg = None
+    if pricing.coupon:
+        if pricing.coupon.is_valid():
+            coupon_msg = f"Coupon {pricing.coupon.code} applied!"
         else:
-            CartOrder.objects.create(
-                user=user,
-                product=product,
-                product_name=product.title,
-                price=product.price,
-                quantity=quantity,
-                status='pending',
-            )
-
-    _save_session_cart(request, {})
-
-# PDF libraries: prefer xhtml2pdf (works on all platforms)
-try:
-    from xhtml2pdf import pisa
-    HAS_XHTML2PDF = True
-except Exception:
-    HAS_XHTML2PDF = False
+            cart.apply_coupon(None)
+            coupon_msg = "This coupon has expired"
 
-# WeasyPrint fallback (requires system libraries on Windows)
-try:
-    import weasyprint
-    HAS_WEASY = True
-except Exception:
-    HAS_WEASY = False
+    return render(request, 'cart.html', {
+        'cart_items': pricing.items,
+        'subtotal': pricing.subtotal,
+        'discount': pricing.discount,
+        'total': pricing.total,
+        'coupon_form': ApplyCouponForm(),
+        'coupon_msg': coupon_msg,
+        # Key used by the cart template
+        'items': pricing.items,
+    })
 
 # --- 1. HOME & SEARCH ---
+@query_budget(6)
 def index(request):
     query = request.GET.get("q") 
     cat = request.GET.get("cat") 
     trend = Product.objects.all()
+    ordering = LISTING_SORTS['-created_at']
     if query:
-        trend = trend.filter(Q(title__icontains=query) | Q(brand__icontains=query))
+        trend = search.search_products(trend, query)
+        ordering = None  # keep relevance order
     elif cat:
         trend = trend.filter(category=cat)
-    return render(request, "index.html", {"trend": trend, "query": query, "cat": cat})
+    page = pagination.paginate(trend, ordering, request.GET.get("cursor"))
+    return render(request, "index.html", {"trend": page, "page": page, "query": query, "cat": cat})
+
+@query_budget(2)
+def autocomplete_view(request):
+    """JSON title/brand completions for the header search box."""
+    query = request.GET.get("q", "")
+    try:
+        limit = int(request.GET.get("limit", autocomplete.DEFAULT_LIMIT))
+    except ValueError:
+        limit = autocomplete.DEFAULT_LIMIT
+    return JsonResponse({"query": query, "suggestions": autocomplete.complete(query, limit)})
 
 # --- 2. AUTHENTICATION (The Elite Version) ---
 def auth_view(request):
@@ -179,7 +132,7 @@ def register_user(request):
             # This save() method in your forms.py creates the User + Profile
             user = form.save() 
             login(request, user, backend='django.contrib.auth.backends.ModelBackend')
-            _merge_session_cart_into_orders(request, user)
+            carts.merge_guest_cart(request, user)
             return redirect('/') 
         else:
             # Return form with errors to be displayed in template
@@ -201,7 +154,7 @@ def login_user(request):
             user = authenticate(request, username=user_obj.username, password=password)
             if user is not None:
                 login(request, user, backend='django.contrib.auth.backends.ModelBackend')
-                _merge_session_cart_into_orders(request, user)
+                carts.merge_guest_cart(request, user)
                 next_url = request.POST.get('next')
                 return redirect(next_url if next_url else '/')
             else:
@@ -223,12 +176,15 @@ def logout_user(request):
     return redirect("/")
 
 # --- 3. SHOPPING SYSTEM ---
+@query_budget(10)
 def product_detail(request, cat, id):
     try:
         product = Product.objects.get(id=id)
-        related = Product.objects.filter(category=cat).exclude(id=id)[:6]
     except Product.DoesNotExist:
         raise Http404("Product Not Found")
+    # Related by the product's own category (not the URL slug) so the cached
+    # fragment is the same whichever URL the page was reached through
+    related = Product.objects.filter(category=product.category).exclude(id=id)[:6]
     
     # Handle POST actions: review submission or add-to-cart
     if request.method == 'POST' and request.user.is_authenticated:
@@ -253,32 +209,26 @@ def product_detail(request, cat, id):
 
         # Add to cart submission
         if request.POST.get('add_to_cart'):
-            qty = int(request.POST.get('quantity', 1))
-            cart, _ = Cart.objects.get_or_create(user=request.user)
-            # create or update item
-            ci, created = CartItem.objects.get_or_create(cart=cart, product=product, variant=None, defaults={'quantity': qty})
-            if not created:
-                ci.quantity = max(1, ci.quantity + qty)
-                ci.save()
+            carts.CartService(request).add(product, int(request.POST.get('quantity', 1)))
             return redirect('cart_view_new')
     
-    # Get product images
+    # Images, reviews and related products stay lazy: the template only
+    # evaluates them when its cached fragments for this product version miss.
     images = ProductImage.objects.filter(product=product)
-    
-    # Get reviews and calculate average rating
-    reviews = ProductReview.objects.filter(product=product).order_by('-created_at')
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-    avg_rating = round(avg_rating, 1)
-    review_count = reviews.count()
+    reviews = ProductReview.objects.filter(product=product).select_related('user').order_by('-created_at')
+    in_wishlist = (request.user.is_authenticated
+                   and WishlistItem.objects.filter(user=request.user, product=product).exists())
     
     return render(request, "product_detail.html", {
         "product": product,
         "images": images,
         "reviews": reviews,
-        "avg_rating": avg_rating,
-        "review_count": review_count,
+        "avg_rating": round(product.avg_rating, 1),
+        "review_count": product.review_count,
         "related": related,
-        "cat": cat
+        "cat": cat,
+        "in_wishlist": in_wishlist,
+        **_fragment_versions(product.pk),
     })
 
 def add_to_cart(request, p_id):
@@ -288,41 +238,31 @@ def add_to_cart(request, p_id):
     if not request.user.is_authenticated:
         return redirect('auth')
     
-    CartOrder.objects.create(
-        user=request.user, 
-        product=item, 
-        product_name=item.title, 
-        price=item.price, 
-        quantity=quantity,
-        status='pending'
-    )
+    carts.CartService(request).add(item, quantity)
     return redirect('cart_view')
 
+@query_budget(5)
 def cart_view(request):
     if request.user.is_authenticated:
-        _merge_session_cart_into_orders(request, request.user)
-        items = CartOrder.objects.filter(user=request.user, status='pending')
-        total = sum(item.total_price for item in items)
-    else:
-        items, total = _build_session_cart_items(request)
-    return render(request, "cart.html", {"items": items, "total": total})
+        carts.merge_guest_cart(request, request.user)
+    return _cart_page(request)
 
 def remove_from_cart(request, item_id):
-    if request.user.is_authenticated:
-        CartOrder.objects.filter(user=request.user, id=item_id).delete()
-    else:
-        cart_data = _get_session_cart(request)
-        cart_data.pop(str(item_id), None)
-        _save_session_cart(request, cart_data)
+    carts.CartService(request).remove(item_id)
     return redirect('cart_view')
 
+@query_budget(5)
 def checkout_view(request):
     if not request.user.is_authenticated:
         return redirect('auth')
-    items = CartOrder.objects.filter(user=request.user, status='pending')
-    total = sum(item.total_price for item in items)  # Use total_price property
-    return render(request, "checkout.html", {"items": items, "total": total})
+    return render(request, "checkout.html", _checkout_context(carts.CartService(request).pricing()))
+
+
+def _checkout_context(pricing, **extra):
+    return {"items": pricing.items, "subtotal": pricing.subtotal, "discount": pricing.discount,
+            "total": pricing.total, **extra}
 
+@query_budget(19)
 def confirm_order(request):
     if request.method == "POST" and request.user.is_authenticated:
         address = request.POST.get("address")
@@ -330,137 +270,89 @@ def confirm_order(request):
         payment_method = request.POST.get("payment_method", "cod")
         transaction_id = request.POST.get("transaction_id", "").strip()
         
-        user_cart = CartOrder.objects.filter(user=request.user, status='pending')
-
-        # If no CartOrder pending (new cart system uses Cart/CartItem), create CartOrder(s)
-        if not user_cart.exists():
-            cart = None
-            try:
-                cart = Cart.objects.get(user=request.user)
-            except Cart.DoesNotExist:
-                cart = None
-
-            created_orders = []
-            if cart:
-                items = CartItem.objects.filter(cart=cart)
-                for ci in items:
-                    price = ci.total_price
-                    # Payment status is always pending initially; webhook/manual confirmation updates it
-                    order = CartOrder.objects.create(
+        order_fields = {
+            'status': 'packed',
+            'mobile': mobile or "",
+            'payment_method': payment_method,
+            # Payment status is always pending initially; webhook/manual confirmation updates it
+            'payment_status': 'pending',
+            'transaction_id': transaction_id if payment_method == 'upi_qr' else None,
+        }
+
+        # One transaction with a fixed number of statements, however many lines the cart has:
+        # either every order, invoice, stock decrement and the emptied cart are committed, or none of them.
+        try:
+            with transaction.atomic():
+                # Every cart line becomes a CartOrder; the cart is emptied and its stock holds consumed
+                priced = carts.CartService(request).checkout()
+                items = priced.items
+                orders = CartOrder.objects.bulk_create([
+                    CartOrder(
                         user=request.user,
                         product=ci.product,
                         product_name=ci.product.title,
-                        price=price,
-                        status='packed',
+                        price=ci.unit_price,
+                        quantity=ci.quantity,
                         shipping_address=address or "Not Provided",
-                        mobile=mobile or "",
-                        payment_method=payment_method,
-                        payment_status='pending',
-                        transaction_id=transaction_id if payment_method == 'upi_qr' else None,
-                    )
-                    created_orders.append(order)
-                # clear cart after creating orders
-                items.delete()
-
-            # use created orders as the user_cart for invoice creation
-            if created_orders:
-                user_cart = CartOrder.objects.filter(id__in=[o.id for o in created_orders])
-        else:
-            # Update existing pending orders with payment info
-            user_cart.update(
-                status='packed',
-                shipping_address=address,
-                mobile=mobile,
-                payment_method=payment_method,
-                payment_status='pending',
-                transaction_id=transaction_id if payment_method == 'upi_qr' else None,
-            )
-        
-        # Razorpay payment disabled for offline mode - will be implemented later
-        
-        # For UPI QR and COD payments: continue with invoice creation
-        consolidate = getattr(settings, 'CONSOLIDATED_INVOICE', True)
-        invoices = []
-
-        if user_cart.exists():
-            if consolidate:
-                # Create a single invoice for all orders in this checkout
-                subtotal = sum([o.total_price for o in user_cart])  # Use total_price (price × quantity)
-                invoice_number = f"INV{request.user.id}{int(timezone.now().timestamp())}"
-                invoice = Invoice.objects.create(
-                    invoice_number=invoice_number,
-                    subtotal=subtotal,
-                    tax=0,
-                    total=subtotal,
-                )
-                invoice.orders.set(user_cart)
-                invoices = [invoice]
-            else:
-                # Keep legacy behavior: one invoice per order
-                for order in user_cart:
-                    invoice = Invoice.objects.create(
-                        invoice_number=f"INV{order.id}{int(order.ordered_date.timestamp())}",
-                        subtotal=order.total_price,  # Use total_price
-                        tax=0,
-                        total=order.total_price,
+                        **order_fields,
                     )
-                    invoice.orders.add(order)
-                    invoices.append(invoice)
+                    for ci in items
+                ])
+                # bulk_create skips the signals that keep the sellers' sales rollups current
+                sales.record(orders)
+
+                # Razorpay payment disabled for offline mode - will be implemented later
+
+                # For UPI QR and COD payments: continue with invoice creation
+                invoices = []
+                if orders:
+                    if getattr(settings, 'CONSOLIDATED_INVOICE', True):
+                        # Create a single invoice for all orders in this checkout
+                        subtotal = sum(o.total_price for o in orders)  # Use total_price (price × quantity)
+                        invoices = [Invoice.objects.create(
+                            # The first order id keeps two checkouts in the same second apart
+                            invoice_number=f"INV{request.user.id}{int(timezone.now().timestamp())}-{orders[0].id}",
+                            subtotal=subtotal,
+                            discount=priced.discount,
+                            tax=0,
+                            total=subtotal - priced.discount,
+                        )]
+                        links = [(invoices[0], o) for o in orders]
+                    else:
+                        # Keep legacy behavior: one invoice per order
+                        # The coupon is shared out over the orders in proportion to their totals
+                        discounts = split_discount(priced.discount, [o.total_price for o in orders])
+                        invoices = Invoice.objects.bulk_create([
+                            Invoice(
+                                invoice_number=f"INV{o.id}{int(o.ordered_date.timestamp())}",
+                                subtotal=o.total_price,
+                                discount=discount,
+                                tax=0,
+                                total=o.total_price - discount,
+                            )
+                            for o, discount in zip(orders, discounts)
+                        ])
+                        links = list(zip(invoices, orders))
+                    Invoice.orders.through.objects.bulk_create([
+                        Invoice.orders.through(invoice_id=inv.id, cartorder_id=o.id) for inv, o in links
+                    ])
+                    # Rendering the PDFs and talking to SMTP happen in the job worker, once this commits
+                    if request.user.email:
+                        tasks.send_invoice_email.delay(user_id=request.user.id, invoice_ids=[inv.id for inv in invoices])
+        except inventory.OutOfStock as exc:
+            return render(request, "checkout.html", _checkout_context(
+                carts.CartService(request).pricing(), stock_error=exc.product_titles()))
+        except carts.CouponUnavailable as exc:
+            # Nothing was ordered; show the cart again at its full price
+            cart = carts.CartService(request)
+            cart.apply_coupon(None)
+            return render(request, "checkout.html", _checkout_context(cart.pricing(), coupon_error=exc.coupon.code))
 
         # If no invoices were created (empty list), try to fetch any existing invoices for the user
         if not invoices:
             invoices = list(Invoice.objects.filter(orders__user=request.user).distinct())
 
         total_amount = sum(inv.total for inv in invoices)
-        # Attempt to generate PDF invoices and email them to the customer
-        attachments = []
-
-        def render_invoice_pdf(inv):
-            html = render_to_string('invoice.html', {'invoice': inv})
-            # WeasyPrint preferred
-            if HAS_WEASY:
-                try:
-                    pdf_bytes = weasyprint.HTML(string=html).write_pdf()
-                    return pdf_bytes
-                except Exception:
-                    pass
-            # xhtml2pdf fallback
-            if HAS_XHTML2PDF:
-                try:
-                    result = BytesIO()
-                    pisa_status = pisa.CreatePDF(html, dest=result)
-                    if pisa_status.err:
-                        return None
-                    return result.getvalue()
-                except Exception:
-                    return None
-            return None
-
-        for inv in invoices:
-            pdf = render_invoice_pdf(inv)
-            if pdf:
-                attachments.append((f"{inv.invoice_number}.pdf", pdf, 'application/pdf'))
-            else:
-                # Attach HTML fallback
-                html = render_to_string('invoice.html', {'invoice': inv})
-                attachments.append((f"{inv.invoice_number}.html", html.encode('utf-8'), 'text/html'))
-
-        # Send email with attachments if the user has an email
-        user_email = getattr(request.user, 'email', None)
-        if user_email:
-            subject = f"Your Invoice(s) from {getattr(settings, 'DEFAULT_FROM_EMAIL', 'Our Store')}"
-            body = "Thank you for your order. Attached are your invoice(s)."
-            email = EmailMessage(subject=subject, body=body, from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None), to=[user_email])
-            for name, content, mimetype in attachments:
-                try:
-                    email.attach(name, content, mimetype)
-                except Exception:
-                    # skip attachment if it fails
-                    continue
-            try:
-                email.send(fail_silently=True)
-            except Exception:
-                pass
 
         context = {
             'invoices': invoices,
@@ -472,6 +364,7 @@ def confirm_order(request):
     return redirect('cart_view')
 
 
+@query_budget(9)
 @login_required(login_url='auth')
 def invoice_view(request, invoice_id):
     """Render a printable invoice for the customer."""
@@ -483,6 +376,7 @@ def invoice_view(request, invoice_id):
     return render(request, 'invoice.html', {'invoice': invoice})
 
 
+@query_budget(6)
 @login_required(login_url='auth')
 def invoice_list(request):
     """List all invoices visible to the current user."""
@@ -493,58 +387,31 @@ def invoice_list(request):
 
 
 def generate_invoice(request, order_id):
-    """Generate a PDF for a single CartOrder (downloadable)."""
+    """Download the PDF for a single CartOrder, rendered once and then served from the invoice store."""
     try:
         order = CartOrder.objects.get(id=order_id, user=request.user)
     except CartOrder.DoesNotExist:
         return HttpResponse('Order not found', status=404)
 
-    # Render template to HTML
-    template = get_template('invoice_pdf.html')
-    context = {'order': order, 'user': request.user}
-    html = template.render(context)
-
-    if HAS_XHTML2PDF:
-        result = io.BytesIO()
-        pdf = pisa.pisaDocument(io.BytesIO(html.encode('utf-8')), result)
-        if not pdf.err:
-            resp = HttpResponse(result.getvalue(), content_type='application/pdf')
-            resp['Content-Disposition'] = f'attachment; filename="Invoice_Order_{order_id}.pdf"'
-            return resp
-        return HttpResponse('Error generating PDF', status=400)
-
-    return HttpResponse('PDF generator not available', status=500)
+    html = get_template('invoice_pdf.html').render({'order': order, 'user': request.user})
+    digest = invoices.store_pdf(html)
+    if digest is None:
+        return HttpResponse('PDF generator not available', status=500)
+    return invoices.pdf_response(request, digest, f"Invoice_Order_{order_id}.pdf", as_attachment=True)
 
 
 @login_required(login_url='auth')
 def download_consolidated_invoice(request, invoice_id):
-    """Generate a single PDF that contains the consolidated `Invoice` (all linked orders)."""
+    """Serve the consolidated `Invoice` (all linked orders) as a PDF from the invoice store."""
     invoice = get_object_or_404(Invoice, id=invoice_id)
     # Ensure ownership
     if not invoice.orders.filter(user=request.user).exists():
         return HttpResponse('Invoice not found', status=404)
 
-    html = render_to_string('invoice.html', {'invoice': invoice})
-
-    # Try xhtml2pdf first (works on all platforms)
-    if HAS_XHTML2PDF:
-        try:
-            result = BytesIO()
-            pisa_status = pisa.CreatePDF(io.BytesIO(html.encode('utf-8')), dest=result)
-            if not pisa_status.err:
-                return HttpResponse(result.getvalue(), content_type='application/pdf')
-        except Exception:
-            pass
-
-    # Fallback to WeasyPrint
-    if HAS_WEASY:
-        try:
-            pdf_bytes = weasyprint.HTML(string=html).write_pdf()
-            return HttpResponse(pdf_bytes, content_type='application/pdf')
-        except Exception:
-            pass
-
-    return HttpResponse('PDF generator not available', status=500)
+    digest = invoices.stored_invoice_pdf(invoice)
+    if digest is None:
+        return HttpResponse('PDF generator not available', status=500)
+    return invoices.pdf_response(request, digest, f"{invoice.invoice_number}.pdf")
 
 # --- 4. EXTRA PAGES ---
 def profile(request): 
@@ -579,6 +446,7 @@ def contact(request):
 # ==================== NEW PREMIUM FEATURES ====================
 
 # --- FEATURE 1: PRODUCT DETAIL PAGE (30 min) ---
+@query_budget(10)
 @login_required(login_url='auth')
 def product_detail_new(request, product_id):
     """Premium product detail page with gallery, reviews, and wishlist."""
@@ -607,42 +475,33 @@ def product_detail_new(request, product_id):
 
         # Add to cart submission
         if request.POST.get('add_to_cart'):
-            qty = int(request.POST.get('quantity', 1))
-            cart, _ = Cart.objects.get_or_create(user=request.user)
-            # create or update item
-            ci, created = CartItem.objects.get_or_create(cart=cart, product=product, variant=None, defaults={'quantity': qty})
-            if not created:
-                ci.quantity = max(1, ci.quantity + qty)
-                ci.save()
+            carts.CartService(request).add(product, int(request.POST.get('quantity', 1)))
             return redirect('cart_view_new')
 
-    # Get all images for gallery
+    # Gallery, reviews and related products are lazy querysets; they only
+    # run when the cached fragments for this product version miss
     images = ProductImage.objects.filter(product=product).order_by('uploaded_at')
+    reviews = ProductReview.objects.filter(product=product).select_related('user').order_by('-created_at')
+    related = Product.objects.filter(category=product.category).exclude(id=product_id)[:6]
 
-    # Get all reviews with ratings
-    reviews = ProductReview.objects.filter(product=product).order_by('-created_at')
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-    review_count = reviews.count()
-
-    # Check if in wishlist
+    # Per-user state, computed on every request
     in_wishlist = WishlistItem.objects.filter(user=request.user, product=product).exists()
 
-    # Get related products (same category)
-    related = Product.objects.filter(category=product.category).exclude(id=product_id)[:6]
-
     context = {
         'product': product,
-        'images': images if images.exists() else [],
+        'images': images,
         'reviews': reviews,
-        'avg_rating': round(avg_rating, 1),
-        'review_count': review_count,
+        'avg_rating': round(product.avg_rating, 1),
+        'review_count': product.review_count,
         'in_wishlist': in_wishlist,
         'related': related,
+        **_fragment_versions(product.pk),
     }
     return render(request, 'product_detail.html', context)
 
 
 # --- FEATURE 2: PRODUCT SEARCH & FILTERS (25 min) ---
+@query_budget(6)
 def product_list(request):
     """Advanced product search with filters and sorting."""
     products = Product.objects.all()
@@ -650,16 +509,7 @@ def product_list(request):
     # Search query
     search_query = request.GET.get('search', '')
     if search_query:
-        products = products.filter(
-            Q(title__icontains=search_query) | 
-            Q(brand__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
-    
-    # Category filter
-    category = request.GET.get('category', '')
-    if category:
-        products = products.filter(category=category)
+        products = search.search_products(products, search_query)
     
     # Price range filter
     min_price = request.GET.get('min_price', '')
@@ -672,42 +522,51 @@ def product_list(request):
     # In stock filter
     in_stock = request.GET.get('in_stock', '')
     if in_stock:
-        products = products.filter(in_stock=True)
+        products = products.filter(stock_count__gt=0)
     
-    # Rating filter
+    # Sidebar facets: counted before the category/brand/rating selections are
+    # applied so each facet keeps showing the alternatives to its own choice
+    category = request.GET.get('category', '')
+    brand = request.GET.get('brand', '')
     min_rating = request.GET.get('min_rating', '')
-    if min_rating:
-        products = products.annotate(
-            avg_rating=Avg('productreview__rating')
-        ).filter(avg_rating__gte=min_rating)
+    try:
+        min_stars = int(min_rating or 0)
+    except ValueError:
+        min_stars = 0
+    facet_counts = facets.facet_counts(
+        products,
+        {'search': search_query, 'min_price': min_price, 'max_price': max_price, 'in_stock': in_stock},
+        category=category, brand=brand, min_rating=min_stars,
+    )
     
-    # Sorting
-    sort_by = request.GET.get('sort', '-created_at')
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    elif sort_by == 'rating':
-        products = products.annotate(
-            avg_rating=Avg('productreview__rating')
-        ).order_by('-avg_rating')
-    elif sort_by == 'popular':
-        products = products.annotate(
-            review_count=Count('productreview')
-        ).order_by('-review_count')
-    else:
-        products = products.order_by(sort_by)
+    # Category / brand / rating filters
+    if category:
+        products = products.filter(category=category)
+    if brand:
+        products = products.filter(brand=brand)
+    if min_stars:
+        products = products.filter(avg_rating__gte=min_stars)
     
-    # Get unique categories for filter
-    categories = Product.objects.values_list('category', flat=True).distinct()
+    # Sorting (searches default to relevance order from the search backend)
+    sort_by = request.GET.get('sort', 'relevance' if search_query else '-created_at')
+    if sort_by == 'relevance' and search_query:
+        # search.search_products() already ordered the matches by rank
+        ordering = None
+    else:
+        if sort_by not in LISTING_SORTS:
+            sort_by = '-created_at'
+        ordering = LISTING_SORTS[sort_by]
+    products = pagination.paginate(products, ordering, request.GET.get('cursor'))
     
     form = ProductFilterForm(request.GET or None)
     
     context = {
         'products': products,
+        'page': products,
         'search_query': search_query,
         'category': category,
-        'categories': categories,
+        'brand': brand,
+        'facets': facet_counts,
         'min_price': min_price,
         'max_price': max_price,
         'in_stock': in_stock,
@@ -754,6 +613,7 @@ def remove_from_wishlist(request, product_id):
     return redirect(request.META.get('HTTP_REFERER', '/'))
 
 
+@query_budget(6)
 @login_required(login_url='auth')
 def wishlist_view(request):
     """Display user's wishlist."""
@@ -774,9 +634,7 @@ def move_to_cart(request, product_id):
     """Move wishlist item to cart."""
     product = get_object_or_404(Product, id=product_id)
     
-    # Create cart item
-    cart, _ = Cart.objects.get_or_create(user=request.user)
-    CartItem.objects.create(cart=cart, product=product, quantity=1)
+    carts.CartService(request).add(product, 1)
     
     # Remove from wishlist
     WishlistItem.objects.filter(user=request.user, product=product).delete()
@@ -785,62 +643,22 @@ def move_to_cart(request, product_id):
 
 
 # --- FEATURE 4: ADVANCED CART SYSTEM (25 min) ---
+@query_budget(4)
 @login_required(login_url='auth')
 def cart_view_new(request):
     """Premium shopping cart with coupon application."""
-    cart, _ = Cart.objects.get_or_create(user=request.user)
-    cart_items = CartItem.objects.filter(cart=cart).select_related('product')
-    
-    subtotal = sum(item.total_price for item in cart_items)
-    discount = 0
-    coupon_msg = None
-    
-    if cart.coupon:
-        if cart.coupon.is_active:
-            if cart.coupon.discount_flat:
-                discount = min(cart.coupon.discount_flat, subtotal)
-            elif cart.coupon.discount_percentage:
-                discount = (subtotal * cart.coupon.discount_percentage) / 100
-            coupon_msg = f"Coupon {cart.coupon.code} applied!"
-        else:
-            cart.coupon = None
-            cart.save()
-            coupon_msg = "This coupon has expired"
-    
-    total = max(0, subtotal - discount)
-    
-    coupon_form = ApplyCouponForm()
-    
-    context = {
-        'cart_items': cart_items,
-        'cart': cart,
-        'subtotal': subtotal,
-        'discount': discount,
-        'total': total,
-        'coupon_form': coupon_form,
-        'coupon_msg': coupon_msg,
-        # Backwards-compatible keys for the older cart template
-        'items': cart_items,
-        'total': total,
-    }
-    # Render the existing cart template (cart.html) which expects 'items' and 'total'
-    return render(request, 'cart.html', context)
+    return _cart_page(request)
 
 
 @login_required(login_url='auth')
 def update_cart_quantity(request, item_id):
     """Update quantity of item in cart."""
-    cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
     quantity = int(request.POST.get('quantity', 1))
-    
-    if quantity > 0:
-        cart_item.quantity = quantity
-        cart_item.save()
-    else:
-        cart_item.delete()
+    cart_item = carts.CartService(request).update(item_id, quantity)
+    if cart_item is None:
+        raise Http404("Cart item not found")
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        cart = cart_item.cart if quantity > 0 else Cart.objects.get(user=request.user)
         return JsonResponse({
             'status': 'success',
             'total_price': cart_item.total_price if quantity > 0 else 0
@@ -852,7 +670,7 @@ def update_cart_quantity(request, item_id):
 @login_required(login_url='auth')
 def remove_cart_item(request, item_id):
     """Remove item from cart."""
-    CartItem.objects.filter(id=item_id, cart__user=request.user).delete()
+    carts.CartService(request).remove(item_id)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'status': 'success'})
@@ -868,12 +686,10 @@ def apply_coupon(request):
             coupon = Coupon.objects.get(code=code)
             if not coupon.is_active:
                 msg = 'This coupon is not active'
-            elif coupon.usage_count >= coupon.max_usage:
+            elif coupon.max_uses is not None and coupon.used_count >= coupon.max_uses:
                 msg = 'Coupon usage limit reached'
             else:
-                cart = Cart.objects.get(user=request.user)
-                cart.coupon = coupon
-                cart.save()
+                carts.CartService(request).apply_coupon(coupon)
                 msg = f'Coupon {code} applied!'
         except Coupon.DoesNotExist:
             msg = f'Coupon code "{code}" not found'
@@ -887,6 +703,21 @@ def apply_coupon(request):
 
 
 # --- FEATURE 5: CUSTOMER DASHBOARD (30 min) ---
+# The dashboard's long lists, served a page at a time by customer_dashboard_section:
+# title, the rows of one customer, their keyset ordering and the fragment template
+CUSTOMER_DASHBOARD_PAGE_SIZE = 10
+CUSTOMER_DASHBOARD_SECTIONS = {
+    'orders': ('Orders', lambda user: CartOrder.objects.filter(user=user).select_related('product'),
+               [('ordered_date', True)], 'partials/dashboard_orders.html'),
+    'refunds': ('Returns', lambda user: RefundRequest.objects.filter(order__user=user).select_related('order'),
+                [('created_at', True)], 'partials/dashboard_refunds.html'),
+    'invoices': ('Invoices', lambda user: Invoice.objects.filter(
+                     id__in=Invoice.orders.through.objects.filter(cartorder__user=user).values('invoice_id')),
+                 [('issued_at', True)], 'partials/dashboard_invoices.html'),
+}
+
+
+@query_budget(6)
 @login_required(login_url='auth')
 def customer_dashboard(request):
     """Premium customer dashboard with orders, returns, and profile."""
@@ -899,35 +730,39 @@ def customer_dashboard(request):
         # Create a profile if missing
         profile, _ = Profile.objects.get_or_create(user=user)
     
-    # Orders
-    # CartOrder uses `ordered_date` as the timestamp field
-    orders = CartOrder.objects.filter(user=user).order_by('-ordered_date')
-    total_orders = orders.count()
-    total_spent = sum(order.price for order in orders)
-    
-    # Refunds/Returns
-    refunds = RefundRequest.objects.filter(order__user=user).select_related('order')
-
-    # Invoices
-    # Invoice model uses `orders` (ManyToMany) and `issued_at`
-    invoices = Invoice.objects.filter(orders__user=user).distinct().order_by('-issued_at')
-    
-    # Recent activity
-    recent_orders = orders[:5]
+    # Totals in one aggregate, however long the history; the lists themselves are
+    # fetched page by page from customer_dashboard_section when the customer opens them
+    totals = CartOrder.objects.filter(user=user).aggregate(
+        total_orders=Count('id'),
+        total_spent=Coalesce(Sum(F('price') * F('quantity')), Value(Decimal('0')),
+                             output_field=DecimalField(max_digits=15, decimal_places=2)),
+        total_refunds=Count('refund'),
+    )
     
     context = {
         'user': user,
         'profile': profile,
-        'orders': orders,
-        'total_orders': total_orders,
-        'total_spent': total_spent,
-        'refunds': refunds,
-        'invoices': invoices,
-        'recent_orders': recent_orders,
+        **totals,
+        'sections': [(name, section[0]) for name, section in CUSTOMER_DASHBOARD_SECTIONS.items()],
     }
     return render(request, 'customer_dashboard.html', context)
 
 
+@query_budget(4)
+@login_required(login_url='auth')
+def customer_dashboard_section(request, section):
+    """One page of a dashboard list as JSON: the rendered rows and the cursor of the next page."""
+    if section not in CUSTOMER_DASHBOARD_SECTIONS:
+        raise Http404("Unknown dashboard section")
+    _title, rows, ordering, template = CUSTOMER_DASHBOARD_SECTIONS[section]
+    page = pagination.paginate(rows(request.user), ordering, request.GET.get('cursor'),
+                               per_page=CUSTOMER_DASHBOARD_PAGE_SIZE)
+    return JsonResponse({
+        'html': render_to_string(template, {'page': page}, request=request),
+        'next': page.next_cursor,
+    })
+
+
 @login_required(login_url='auth')
 def order_detail(request, order_id):
     """View full order details."""
@@ -1010,9 +845,15 @@ def seller_profile(request, seller_id):
     # Seller analytics
     analytics = SellerAnalytics.objects.filter(seller=seller).first()
     
-    # Seller reviews (from product reviews)
+    # Seller reviews (from product reviews); the seller-wide average is
+    # derived from the per-product rating histograms
     reviews = ProductReview.objects.filter(product__seller=seller).order_by('-created_at')[:10]
-    avg_rating = reviews.aggregate(Avg('rating'))['rating__avg'] or 0
+    totals = products.aggregate(
+        count=Sum('review_count'),
+        stars=Sum(F('rating_1_count') + F('rating_2_count') * 2 + F('rating_3_count') * 3
+                  + F('rating_4_count') * 4 + F('rating_5_count') * 5),
+    )
+    avg_rating = totals['stars'] / totals['count'] if totals['count'] else 0
     
     context = {
         'seller': seller,
@@ -1026,6 +867,7 @@ def seller_profile(request, seller_id):
     return render(request, 'seller_profile.html', context)
 
 
+@query_budget(10)
 @login_required(login_url='auth')
 def seller_dashboard(request):
     """Seller analytics and management dashboard."""
@@ -1038,26 +880,26 @@ def seller_dashboard(request):
     products = Product.objects.filter(seller=seller)
     product_count = products.count()
     
-    # Sales
-    orders = CartOrder.objects.filter(product__seller=seller)
-    total_sales = sum(order.price for order in orders)
-    total_orders = orders.count()
-    
-    # Analytics
+    # Sales: lifetime totals from SellerAnalytics and the recent window from the daily
+    # rollups (myapp/sales.py), so the page never reads the seller's orders
     analytics = SellerAnalytics.objects.filter(seller=seller).first()
+    since = timezone.localdate() - timedelta(days=SELLER_DASHBOARD_DAYS - 1)
+    daily_sales = sales.daily(seller, since)
     
-    # Top products
-    top_products = products.annotate(
-        review_count=Count('productreview')
-    ).order_by('-review_count')[:5]
+    # Top products by revenue over the same window
+    top_products = sales.top_products(seller, since, limit=5)
     
     context = {
         'seller': seller,
         'product_count': product_count,
-        'total_sales': total_sales,
-        'total_orders': total_orders,
+        'total_sales': analytics.total_sales if analytics else 0,
+        'total_orders': analytics.total_orders if analytics else 0,
         'analytics': analytics,
         'products': products[:10],
+        'daily_sales': daily_sales,
+        'recent_sales': sum((day['revenue'] for day in daily_sales), Decimal('0')),
+        'recent_units': sum(day['units'] for day in daily_sales),
+        'sales_days': SELLER_DASHBOARD_DAYS,
         'top_products': top_products,
     }
     return render(request, 'seller_dashboard.html', context)
@@ -1127,7 +969,7 @@ def verify_razorpay(request):
         for order in orders:
             order.payment_status = 'paid'
             order.transaction_id = razorpay_payment_id  # Store payment ID for reference
-            order.save()
+            order.save(update_fields=['payment_status', 'transaction_id'])
         
         return JsonResponse({
             'status': 'success',
@@ -1195,3 +1037,11 @@ def order_success(request):
     
     return render(request, 'order_success.html', context)
 
+
+
+# --- MONITORING ---
+@query_budget(2)
+@staff_member_required
+def cache_stats_view(request):
+    """Hit/miss counters of this worker's two-tier caches."""
+    return JsonResponse({'pid': os.getpid(), 'caches': cache_backends.cache_stats()})
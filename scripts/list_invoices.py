@@ -1,7 +1,15 @@
-from myapp.models import Invoice
-ins = Invoice.objects.all()
-print('INVOICE_COUNT=', ins.count())
+from django.db.models import Prefetch
+
+from myapp.models import CartOrder, Invoice
+
+# One query for the invoices and one for all their orders (with users),
+# instead of two more queries per invoice.
+ins = Invoice.objects.prefetch_related(
+    Prefetch('orders', queryset=CartOrder.objects.select_related('user'))
+)
+print('INVOICE_COUNT=', len(ins))
 for inv in ins:
-    orders = list(inv.orders.values_list('id', flat=True))
-    users = list(set(o.user.username for o in inv.orders.all()))
+    invoice_orders = inv.orders.all()
+    orders = [o.id for o in invoice_orders]
+    users = list(set(o.user.username for o in invoice_orders))
     print(inv.id, inv.invoice_number, float(inv.total), orders, users)